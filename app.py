@@ -3,11 +3,21 @@ from flask_cors import CORS
 import firebase_admin
 from firebase_admin import credentials, firestore, auth
 import smtplib
+import sqlite3
+import queue
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
 from email import encoders
 import hashlib
+import heapq
+import random
+import gzip
+import decimal
+import string
+import hmac
+import re
+import zlib
 import uuid
 import datetime
 import os
@@ -16,31 +26,109 @@ import qrcode
 import io
 import base64
 from werkzeug.utils import secure_filename
+from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.security import generate_password_hash, check_password_hash
 import threading
 import time
+import copy
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque
+from urllib.parse import quote, unquote
 from flask import render_template
 from google.cloud.firestore_v1 import FieldFilter
+from google.api_core.exceptions import FailedPrecondition
 from flask import jsonify
 from flask import session
+from flask import g
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def gevent_active():
+    """True when a gevent worker has monkey-patched the standard library"""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('socket')
+
+# Firestore's gRPC channels need gevent-aware polling under a patched worker
+if gevent_active():
+    import grpc.experimental.gevent as grpc_gevent
+    grpc_gevent.init_gevent()
+
+_blocking_pool = None
+
+def run_blocking(fn, *args, **kwargs):
+    """Call fn on a native OS thread under gevent, inline otherwise
+
+    sqlite, file I/O, PDF parsing and hashing never yield to the gevent hub;
+    run in a greenlet they would stall every other request on the worker.
+    Only the calling greenlet waits for the pool.
+    """
+    global _blocking_pool
+    if not gevent_active():
+        return fn(*args, **kwargs)
+    if _blocking_pool is None:
+        from gevent.threadpool import ThreadPool
+        _blocking_pool = ThreadPool(int(os.environ.get('BLOCKING_IO_THREADS', 8)))
+    return _blocking_pool.apply(fn, args, kwargs)
+
+def offload_blocking(fn):
+    """Decorator routing every call of fn through run_blocking"""
+    from functools import wraps
+    
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        return run_blocking(fn, *args, **kwargs)
+    return wrapper
+
 # Initialize Flask app
 app = Flask(__name__)
-app.config['SECRET_KEY'] = '12345678'
+# No default: a key anyone can read in the repo would let them mint tokens
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')
+if not app.config['SECRET_KEY']:
+    logger.warning("SECRET_KEY is not set; signed auth tokens are disabled")
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB max file size
 CORS(app)
+# Trust only the X-Forwarded-For entries appended by our own proxies; earlier ones are client-supplied
+TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', 1))
+if TRUSTED_PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS)
 
 # Email Configuration
 EMAIL_CONFIG = {
-    'smtp_server': 'smtp.gmail.com',
-    'smtp_port': 587,
-    'email': 'printqsystem@gmail.com',  # Change this
-    'password': 'sppt mulz koph islp ',  # Change this to your app password
+    'smtp_server': os.environ.get('SMTP_SERVER', 'smtp.gmail.com'),
+    'smtp_port': int(os.environ.get('SMTP_PORT', 587)),
+    'email': os.environ.get('SMTP_USERNAME', 'printqsystem@gmail.com'),  # Change this
+    'password': os.environ.get('SMTP_PASSWORD', 'sppt mulz koph islp '),  # Change this to your app password
+    # Disable for a local SMTP sink without STARTTLS; set SMTP_USERNAME empty to skip AUTH
+    'use_tls': os.environ.get('SMTP_USE_TLS', 'True').lower() == 'true'
+}
+
+# Notification outbox and dispatcher configuration
+NOTIFICATION_CONFIG = {
+    'outbox_path': os.environ.get('NOTIFICATION_OUTBOX_PATH', 'data/outbox.sqlite3'),
+    'connections': int(os.environ.get('SMTP_POOL_SIZE', 3)),
+    'idle_timeout': 60,  # seconds before an idle SMTP connection is closed
+    'poll_interval': 2,  # seconds between outbox polls when idle
+    'lease_seconds': 120,
+    'max_attempts': 8,
+    'backoff_base': 30,  # seconds; doubles per attempt
+    'backoff_max': 3600,
+    'retain_sent_seconds': 7 * 24 * 3600,
+    'digest_window': 60,  # seconds job notifications wait to be merged into one digest
+    'recipient_rate_limit': 10,  # emails per recipient per rate window
+    'recipient_rate_window': 3600,
+    'smtp_timeout': 30
 }
 
 # Firebase Configuration
@@ -79,6 +167,119 @@ DEFAULT_ADMIN = {
     'is_default': True
 }
 
+# Auth principal cache configuration
+AUTH_CACHE_CONFIG = {
+    'ttl_seconds': int(os.environ.get('AUTH_CACHE_TTL', 60)),
+    'max_entries': int(os.environ.get('AUTH_CACHE_MAX_ENTRIES', 10000))
+}
+
+# Auth token configuration
+AUTH_TOKEN_CONFIG = {
+    'version': 'v2',  # v2 carries the user's revocation generation; v1 tokens are checked against Firestore
+    'ttl_seconds': int(os.environ.get('AUTH_TOKEN_TTL', 12 * 3600)),
+    # Accept old student_<id>_<timestamp> tokens during the migration window
+    'accept_legacy': os.environ.get('ACCEPT_LEGACY_TOKENS', 'True').lower() == 'true'
+}
+
+# Token revocation configuration
+TOKEN_REVOCATION_CONFIG = {
+    'enabled': os.environ.get('TOKEN_REVOCATIONS_ENABLED', 'True').lower() == 'true',
+    'collection': 'token_revocations',
+    'check_workers': 2,  # background checks that a signed token's user still exists
+    'check_interval': int(os.environ.get('AUTH_CACHE_TTL', 60)),  # seconds between checks of one user
+    'max_checked': 10000
+}
+
+# Password hashing pool configuration
+PASSWORD_HASH_CONFIG = {
+    'max_workers': int(os.environ.get('PASSWORD_HASH_WORKERS', 4)),
+    'max_queue': int(os.environ.get('PASSWORD_HASH_QUEUE', 64)),
+    'timeout_seconds': 30
+}
+
+# Upload ingestion configuration
+UPLOAD_CONFIG = {
+    'directory': 'uploads',
+    'chunk_size': 64 * 1024,
+    'allowed_extensions': {'.pdf', '.docx', '.ppt', '.pptx', '.doc'}
+}
+
+# Live job event stream configuration
+EVENT_STREAM_CONFIG = {
+    'heartbeat_seconds': 15,
+    'replay_buffer': 1000,  # recent events kept for Last-Event-ID resume
+    'subscriber_queue': 100,
+    'retry_ms': 5000
+}
+
+# Materialised job view configuration
+JOB_VIEW_CONFIG = {
+    'enabled': os.environ.get('JOB_VIEW_ENABLED', 'True').lower() == 'true',
+    'active_statuses': ('pending', 'approved', 'printing')
+}
+
+# Printer registry configuration
+PRINTER_REGISTRY_CONFIG = {
+    'enabled': os.environ.get('PRINTER_REGISTRY_ENABLED', 'True').lower() == 'true'
+}
+
+# Printer assignment configuration
+PRINTER_ASSIGNMENT_CONFIG = {
+    'default_pages_per_minute': 20,  # for printers without a pages_per_minute field
+    'queued_statuses': ('approved', 'printing'),
+    'reservation_seconds': 30  # how long an assignment counts before the job view reflects it
+}
+
+# Scheduled job release configuration
+JOB_SCHEDULER_CONFIG = {
+    'enabled': os.environ.get('JOB_SCHEDULER_ENABLED', 'True').lower() == 'true',
+    # scheduled_time is a pickup time, so jobs are released this long before it
+    'lead_seconds': int(os.environ.get('SCHEDULER_LEAD_SECONDS', 900)),
+    'auto_approve': os.environ.get('SCHEDULER_AUTO_APPROVE', 'False').lower() == 'true',
+    'retry_seconds': 60
+}
+
+# Printer throughput estimation configuration
+PRINTER_THROUGHPUT_CONFIG = {
+    'alpha': 0.2,  # weight of the newest observation in the moving average
+    'warm_jobs': 200,  # recent completed jobs replayed on first use
+    # Rates outside these bounds are jobs completed without really printing, or left uncollected
+    'min_pages_per_minute': 0.5,
+    'max_pages_per_minute': 120,
+    # Per-printer completion watermarks, kept out of printers so completions
+    # do not bump the printers version
+    'collection': 'printer_throughput'
+}
+
+# Firestore caps the number of values in an 'in' filter
+FIRESTORE_IN_LIMIT = 30
+
+# Admin job listing configuration
+JOB_LIST_CONFIG = {
+    'default_page_size': 100,
+    'max_page_size': 500
+}
+
+# Bulk job action configuration
+BULK_JOB_CONFIG = {
+    'max_jobs': 1000,
+    'batch_size': 500  # Firestore's limit on writes per batch
+}
+
+# ETag version counter configuration
+VERSION_COUNTER_CONFIG = {
+    # Counter documents per collection; each takes about one write per second
+    'shards': {'jobs': int(os.environ.get('JOBS_VERSION_SHARDS', 8))},
+    # Collections that also keep one counter per student for student-scoped reads
+    'per_student': ('jobs',)
+}
+
+# JSON response configuration
+JSON_RESPONSE_CONFIG = {
+    'gzip_min_bytes': int(os.environ.get('JSON_GZIP_MIN_BYTES', 1400)),  # smaller bodies fit in one packet anyway
+    'gzip_level': 5
+}
+
 # Pricing configuration
 PRICING = {
     'bw_single': 1.05,
@@ -89,27 +290,164 @@ PRICING = {
     'a3_multiplier': 2.5
 }
 
+# Default system settings (stored in settings/system on first read)
+DEFAULT_SETTINGS = {
+    'max_file_size': 50,
+    'supported_formats': 'PDF, DOCX, PPT, PPTX',
+    'auto_delete_hours': 24,
+    'pricing': PRICING,
+    'email_notifications': {
+        'job_submitted': True,
+        'job_completed': True,
+        'job_failed': True
+    },
+    'security': {
+        'require_2fa': False,
+        'session_timeout': 60,
+        'max_login_attempts': 5,
+        'max_login_attempts_per_ip': 100,
+        'login_window_seconds': 300,
+        # Werkzeug hash method; stored hashes using another method are upgraded on login
+        'password_hash_method': 'scrypt:32768:8:1'
+    }
+}
+
+# Unique user keys (email, student_id) -> user document id
+USER_INDEX_COLLECTION = 'user_index'
+USER_UNIQUE_FIELDS = {
+    'students': ['email', 'student_id'],
+    'admins': ['email']
+}
+
+class DuplicateUserKeyError(Exception):
+    """Raised when a unique user key is already claimed in the user index"""
+    def __init__(self, field):
+        super().__init__(f"{field} already exists")
+        self.field = field
+
+def user_index_key(collection, field, value):
+    """Document id of the user index entry for a unique (collection, field, value)"""
+    normalized = str(value).strip().lower()
+    return f"{collection}:{field}:{quote(normalized, safe='@.+-_')}"
+
+def user_index_ref(collection, field, value):
+    return db.collection(USER_INDEX_COLLECTION).document(user_index_key(collection, field, value))
+
+def lookup_user(collection, field, value):
+    """Resolve a unique key to the user document with two point reads instead of a query"""
+    index_doc = user_index_ref(collection, field, value).get()
+    if not index_doc.exists:
+        return None
+    
+    user_doc = db.collection(collection).document(index_doc.to_dict()['doc_id']).get()
+    return user_doc if user_doc.exists else None
+
+@firestore.transactional
+def create_user_with_index(transaction, collection, user_data):
+    """Claim every unique key and create the user document in one transaction"""
+    index_refs = {
+        field: user_index_ref(collection, field, user_data[field])
+        for field in USER_UNIQUE_FIELDS[collection]
+    }
+    
+    # Reads give a precise error message; the creates below still fail the
+    # commit if a concurrent registration claimed the same key first
+    for field, ref in index_refs.items():
+        if ref.get(transaction=transaction).exists:
+            raise DuplicateUserKeyError(field)
+    
+    for field, ref in index_refs.items():
+        transaction.create(ref, {
+            'collection': collection,
+            'field': field,
+            'doc_id': user_data['id'],
+            'created_at': datetime.datetime.now()
+        })
+    
+    transaction.create(db.collection(collection).document(user_data['id']), user_data)
+
+@firestore.transactional
+def update_user_with_index(transaction, collection, user_id, current_data, update_data):
+    """Apply a user update, moving any changed unique keys in the same transaction"""
+    moves = []
+    for field in USER_UNIQUE_FIELDS[collection]:
+        new_value = update_data.get(field)
+        old_value = current_data.get(field)
+        if new_value is None or old_value is None:
+            continue
+        if user_index_key(collection, field, new_value) == user_index_key(collection, field, old_value):
+            continue
+        
+        new_ref = user_index_ref(collection, field, new_value)
+        if new_ref.get(transaction=transaction).exists:
+            raise DuplicateUserKeyError(field)
+        moves.append((field, user_index_ref(collection, field, old_value), new_ref))
+    
+    for field, old_ref, new_ref in moves:
+        transaction.delete(old_ref)
+        transaction.create(new_ref, {
+            'collection': collection,
+            'field': field,
+            'doc_id': user_id,
+            'created_at': datetime.datetime.now()
+        })
+    
+    transaction.update(db.collection(collection).document(user_id), update_data)
+
 class PrintQBackend:
     def __init__(self):
+        self.initialize_user_index()
         self.initialize_default_admin()
         self.initialize_printers()
     
+    def initialize_user_index(self):
+        """Backfill the user index once for users created before it existed"""
+        try:
+            meta_ref = db.collection('settings').document('user_index')
+            meta_doc = meta_ref.get()
+            if meta_doc.exists and meta_doc.to_dict().get('backfilled'):
+                return
+            
+            created = 0
+            for collection, fields in USER_UNIQUE_FIELDS.items():
+                for doc in db.collection(collection).get():
+                    user_data = doc.to_dict()
+                    for field in fields:
+                        if not user_data.get(field):
+                            continue
+                        ref = user_index_ref(collection, field, user_data[field])
+                        existing = ref.get()
+                        if existing.exists:
+                            if existing.to_dict().get('doc_id') != doc.id:
+                                logger.warning(f"Duplicate {collection} {field} '{user_data[field]}' on {doc.id}, keeping {existing.to_dict().get('doc_id')}")
+                            continue
+                        ref.set({
+                            'collection': collection,
+                            'field': field,
+                            'doc_id': doc.id,
+                            'created_at': datetime.datetime.now()
+                        })
+                        created += 1
+            
+            meta_ref.set({'backfilled': True, 'backfilled_at': datetime.datetime.now()})
+            logger.info(f"User index backfilled with {created} entries")
+        except Exception as e:
+            logger.error(f"Error initializing user index: {e}")
+    
     def initialize_default_admin(self):
         """Initialize default admin if not exists"""
         try:
-            admins_ref = db.collection('admins')
-            default_admin_query = admins_ref.where('email', '==', DEFAULT_ADMIN['email']).limit(1)
-            docs = default_admin_query.get()
-            
-            if not docs:
+            if not lookup_user('admins', 'email', DEFAULT_ADMIN['email']):
                 admin_data = DEFAULT_ADMIN.copy()
                 admin_data['password'] = generate_password_hash(admin_data['password'])
                 admin_data['id'] = str(uuid.uuid4())
                 
-                admins_ref.document(admin_data['id']).set(admin_data)
+                create_user_with_index(db.transaction(), 'admins', admin_data)
                 logger.info("Default admin created successfully")
             else:
                 logger.info("Default admin already exists")
+        except DuplicateUserKeyError:
+            logger.info("Default admin already exists")
         except Exception as e:
             logger.error(f"Error initializing default admin: {e}")
     
@@ -129,6 +467,8 @@ class PrintQBackend:
                         'status': 'online',
                         'paper_level': 85,
                         'toner_level': 70,
+                        'supports_a3': True,
+                        'pages_per_minute': 30,
                         'created_at': datetime.datetime.now()
                     },
                     {
@@ -139,12 +479,15 @@ class PrintQBackend:
                         'status': 'online',
                         'paper_level': 90,
                         'toner_level': 45,
+                        'supports_a3': False,
+                        'pages_per_minute': 20,
                         'created_at': datetime.datetime.now()
                     }
                 ]
                 
                 for printer in default_printers:
                     printers_ref.document(printer['id']).set(printer)
+                bump_collection_versions('printers')
                 logger.info("Default printers created successfully")
         except Exception as e:
             logger.error(f"Error initializing printers: {e}")
@@ -162,10 +505,7 @@ def normalize_timestamp(ts):
 backend = PrintQBackend()
 
 # Email Templates
-def get_email_template(template_type, data):
-    """Generate modern HTML email templates with enhanced PrintQ branding"""
-    
-    base_style = """
+EMAIL_BASE_STYLE = """
     <style>
         @import url('https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700&display=swap');
         
@@ -494,46 +834,126 @@ def get_email_template(template_type, data):
         }
     </style>
     """
-    
-    if template_type == 'welcome':
-        return f"""
+
+# Page chrome shared by every notification; {content} is the per-type body
+EMAIL_PAGE_LAYOUT = """
         <!DOCTYPE html>
         <html lang="en">
         <head>
             <meta charset="UTF-8">
             <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <title>PrintQ - Welcome to PrintQ!</title>
-            {base_style}
+            <title>{title}</title>
+            {style}
         </head>
         <body>
             <div class="email-wrapper">
                 <div class="container">
                     <div class="header">
                         <div class="logo">
-                            <div class="logo-icon">🎉</div>
+                            <div class="logo-icon">{icon}</div>
                             PrintQ
                         </div>
-                        <h2>Welcome to PrintQ!</h2>
+                        <h2>{heading}</h2>
                     </div>
                     <div class="content">
-                        <div class="greeting">Hi {data.get('student_name', 'Student')}! 👋</div>
+{content}
+                    </div>
+                    <div class="footer">
+                        <div class="footer-brand">PrintQ - Smart Campus Printing</div>
+                        <div>{footer_note}</div>
+                    </div>
+                </div>
+            </div>
+        </body>
+        </html>
+        """
+
+# Job detail blocks shared by the single-job emails and the digest
+EMAIL_JOB_APPROVED_DETAILS = """
+                        <div class="job-details">
+                            <h3>📄 Job Details</h3>
+                            <div class="detail-row">
+                                <span class="detail-label">Job ID</span>
+                                <span class="detail-value">{job_id}</span>
+                            </div>
+                            <div class="detail-row">
+                                <span class="detail-label">Printer</span>
+                                <span class="detail-value">{printer_name}</span>
+                            </div>
+                            <div class="detail-row">
+                                <span class="detail-label">Location</span>
+                                <span class="detail-value">{printer_location}</span>
+                            </div>
+                            <div class="detail-row">
+                                <span class="detail-label">Status</span>
+                                <span class="detail-value">
+                                    <span class="status-badge status-approved">✅ APPROVED</span>
+                                </span>
+                            </div>
+                        </div>
+
+                        <div style="text-align: center; margin: 24px 0;">
+                            <div style="color: #4a5568; margin-bottom: 8px; font-weight: 500; font-size: 14px;">Your Pickup PIN</div>
+                            <div class="pickup-pin">{pickup_pin}</div>
+                            <div style="color: #718096; font-size: 12px; margin-top: 8px;">Keep this PIN safe - you'll need it to collect your prints!</div>
+                        </div>
+"""
+
+EMAIL_JOB_COMPLETED_DETAILS = """
+                        <div class="job-details">
+                            <h3>📄 Job Details</h3>
+                            <div class="detail-row">
+                                <span class="detail-label">Job ID</span>
+                                <span class="detail-value">{job_id}</span>
+                            </div>
+                            <div class="detail-row">
+                                <span class="detail-label">Printer</span>
+                                <span class="detail-value">{printer_name}</span>
+                            </div>
+                            <div class="detail-row">
+                                <span class="detail-label">Location</span>
+                                <span class="detail-value">{printer_location}</span>
+                            </div>
+                            <div class="detail-row">
+                                <span class="detail-label">Status</span>
+                                <span class="detail-value">
+                                    <span class="status-badge status-completed">🎉 COMPLETED</span>
+                                </span>
+                            </div>
+                        </div>
+
+                        <div style="text-align: center; margin: 24px 0;">
+                            <div style="color: #4a5568; margin-bottom: 8px; font-weight: 500; font-size: 14px;">Your Pickup PIN</div>
+                            <div class="pickup-pin">{pickup_pin}</div>
+                        </div>
+"""
+
+# Per-type bodies in str.format syntax, compiled once by compile_email_templates()
+EMAIL_TEMPLATE_SOURCES = {
+    'welcome': {
+        'title': 'PrintQ - Welcome to PrintQ!',
+        'icon': '🎉',
+        'heading': 'Welcome to PrintQ!',
+        'footer_note': '© 2024 • Welcome aboard!',
+        'content': """
+                        <div class="greeting">Hi {student_name}! 👋</div>
                         <div class="message">
                             Welcome to PrintQ - Smart Campus Printing! We're excited to have you on board. Your account has been successfully created and you're ready to start printing.
                         </div>
-                        
+
                         <div class="job-details">
                             <h3>👤 Your Account Details</h3>
                             <div class="detail-row">
                                 <span class="detail-label">Student ID</span>
-                                <span class="detail-value">{data.get('student_id', 'N/A')}</span>
+                                <span class="detail-value">{student_id}</span>
                             </div>
                             <div class="detail-row">
                                 <span class="detail-label">Email</span>
-                                <span class="detail-value">{data.get('email', 'N/A')}</span>
+                                <span class="detail-value">{email}</span>
                             </div>
                             <div class="detail-row">
                                 <span class="detail-label">Initial Balance</span>
-                                <span class="detail-value">${data.get('initial_balance', 0):.2f}</span>
+                                <span class="detail-value">${initial_balance:.2f}</span>
                             </div>
                             <div class="detail-row">
                                 <span class="detail-label">Account Status</span>
@@ -542,13 +962,13 @@ def get_email_template(template_type, data):
                                 </span>
                             </div>
                         </div>
-                        
+
                         <div style="text-align: center; margin: 24px 0;">
-                            <a href="{data.get('app_link', '#')}" class="cta-button">
+                            <a href="{app_link}" class="cta-button">
                                 📱 Start Printing Now
                             </a>
                         </div>
-                        
+
                         <div class="eco-tip">
                             <div class="eco-tip-header">
                                 🌟 Getting Started Tips
@@ -560,65 +980,40 @@ def get_email_template(template_type, data):
                                 <li>Use your student ID and pickup PIN to collect your documents</li>
                             </ul>
                         </div>
-                        
+
                         <div class="divider"></div>
                         <p style="color: #4a5568; font-size: 14px; text-align: center;">
                             Need help? Visit our support center or contact us at <strong>support@printq.com</strong>
-                        </p>
-                    </div>
-                    <div class="footer">
-                        <div class="footer-brand">PrintQ - Smart Campus Printing</div>
-                        <div>© 2024 • Welcome aboard!</div>
-                    </div>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
-    
-    elif template_type == 'job_submitted':
-        return f"""
-        <!DOCTYPE html>
-        <html lang="en">
-        <head>
-            <meta charset="UTF-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <title>PrintQ - Job Submitted</title>
-            {base_style}
-        </head>
-        <body>
-            <div class="email-wrapper">
-                <div class="container">
-                    <div class="header">
-                        <div class="logo">
-                            <div class="logo-icon">📱</div>
-                            PrintQ
-                        </div>
-                        <h2>Job Submitted Successfully!</h2>
-                    </div>
-                    <div class="content">
-                        <div class="greeting">Hi {data.get('student_name', 'Student')}! 👋</div>
+                        </p>"""
+    },
+    'job_submitted': {
+        'title': 'PrintQ - Job Submitted',
+        'icon': '📱',
+        'heading': 'Job Submitted Successfully!',
+        'footer_note': '© 2024 • This is an automated message, please do not reply.',
+        'content': """
+                        <div class="greeting">Hi {student_name}! 👋</div>
                         <div class="message">
                             Your print job has been submitted and is now waiting for approval. We'll notify you as soon as it's ready!
                         </div>
-                        
+
                         <div class="job-details">
                             <h3>📄 Job Details</h3>
                             <div class="detail-row">
                                 <span class="detail-label">Job ID</span>
-                                <span class="detail-value">{data.get('job_id', 'N/A')}</span>
+                                <span class="detail-value">{job_id}</span>
                             </div>
                             <div class="detail-row">
                                 <span class="detail-label">File Name</span>
-                                <span class="detail-value">{data.get('file_name', 'N/A')}</span>
+                                <span class="detail-value">{file_name}</span>
                             </div>
                             <div class="detail-row">
                                 <span class="detail-label">Pages</span>
-                                <span class="detail-value">{data.get('pages', 'N/A')}</span>
+                                <span class="detail-value">{pages}</span>
                             </div>
                             <div class="detail-row">
                                 <span class="detail-label">Cost</span>
-                                <span class="detail-value">${data.get('cost', 0):.2f}</span>
+                                <span class="detail-value">${cost:.2f}</span>
                             </div>
                             <div class="detail-row">
                                 <span class="detail-label">Status</span>
@@ -627,303 +1022,1504 @@ def get_email_template(template_type, data):
                                 </span>
                             </div>
                         </div>
-                        
-                        {f'''<div class="eco-tip">
-                            <div class="eco-tip-header">
-                                🌱 Eco-Friendly Choice!
-                            </div>
-                            Great choice on double-sided printing! You're helping save trees and reduce waste.
-                        </div>''' if data.get('duplex') else ''}
-                        
+
+                        {duplex_tip}
+
                         <div class="divider"></div>
                         <p style="color: #4a5568; font-size: 14px; text-align: center;">
                             You'll receive another notification once your job is approved and ready for pickup.
-                        </p>
-                    </div>
-                    <div class="footer">
-                        <div class="footer-brand">PrintQ - Smart Campus Printing</div>
-                        <div>© 2024 • This is an automated message, please do not reply.</div>
-                    </div>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
-    
-    elif template_type == 'job_approved':
-        return f"""
-        <!DOCTYPE html>
-        <html lang="en">
-        <head>
-            <meta charset="UTF-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <title>PrintQ - Job Approved</title>
-            {base_style}
-        </head>
-        <body>
-            <div class="email-wrapper">
-                <div class="container">
-                    <div class="header">
-                        <div class="logo">
-                            <div class="logo-icon">✅</div>
-                            PrintQ
-                        </div>
-                        <h2>Job Approved - Ready to Print!</h2>
-                    </div>
-                    <div class="content">
-                        <div class="greeting">Hi {data.get('student_name', 'Student')}! 🎉</div>
+                        </p>"""
+    },
+    'job_approved': {
+        'title': 'PrintQ - Job Approved',
+        'icon': '✅',
+        'heading': 'Job Approved - Ready to Print!',
+        'footer_note': '© 2024',
+        'content': """
+                        <div class="greeting">Hi {student_name}! 🎉</div>
                         <div class="message">
                             Great news! Your print job has been approved and is now in the printing queue.
                         </div>
-                        
-                        <div class="job-details">
-                            <h3>📄 Job Details</h3>
-                            <div class="detail-row">
-                                <span class="detail-label">Job ID</span>
-                                <span class="detail-value">{data.get('job_id', 'N/A')}</span>
+""" + EMAIL_JOB_APPROVED_DETAILS + """
+                        <div class="divider"></div>
+                        <p style="color: #4a5568; font-size: 14px; text-align: center;">
+                            📍 Head to <strong>{pickup_location}</strong> when your job is completed!
+                        </p>"""
+    },
+    'job_completed': {
+        'title': 'PrintQ - Job Completed',
+        'icon': '🎉',
+        'heading': 'Print Job Completed!',
+        'footer_note': '© 2024',
+        'content': """
+                        <div class="greeting">Hi {student_name}! 🎉</div>
+                        <div class="message">
+                            Your print job is ready for pickup! Don't forget to collect your documents.
+                        </div>
+""" + EMAIL_JOB_COMPLETED_DETAILS + """
+                        <div class="highlight-box" style="text-align: center;">
+                            <div style="font-size: 16px; font-weight: 600; color: #2d3748; margin-bottom: 6px;">
+                                🏃‍♂️ Ready for Pickup!
+                            </div>
+                            <div style="color: #4a5568; font-size: 14px;">
+                                Head to <strong>{pickup_location}</strong> now to collect your documents!<br>
+                                Remember to bring your student ID and use the pickup PIN above.
                             </div>
+                        </div>
+
+                        {eco_points_tip}"""
+    },
+    'low_balance': {
+        'title': 'PrintQ - Low Balance Alert',
+        'icon': '⚠️',
+        'heading': 'Low Wallet Balance Alert',
+        'footer_note': '© 2024',
+        'content': """
+                        <div class="greeting">Hi {student_name}! 👋</div>
+                        <div class="message">
+                            Your PrintQ wallet balance is running low. Add money now to ensure uninterrupted printing services.
+                        </div>
+
+                        <div class="highlight-box" style="text-align: center;">
+                            <div style="color: #4a5568; margin-bottom: 12px; font-weight: 500; font-size: 14px;">Current Balance</div>
+                            <div class="balance-display">${balance:.2f}</div>
+                            <div style="color: #718096; font-size: 12px;">Recommended top-up: $10.00 or more</div>
+                        </div>
+
+                        <div class="job-details">
+                            <h3>💰 Wallet Status</h3>
                             <div class="detail-row">
-                                <span class="detail-label">Printer</span>
-                                <span class="detail-value">{data.get('printer_name', 'N/A')}</span>
+                                <span class="detail-label">Current Balance</span>
+                                <span class="detail-value" style="color: #f56565;">${balance:.2f}</span>
                             </div>
                             <div class="detail-row">
-                                <span class="detail-label">Location</span>
-                                <span class="detail-value">{data.get('printer_location', 'N/A')}</span>
+                                <span class="detail-label">Recommended Top-up</span>
+                                <span class="detail-value">$10.00 or more</span>
                             </div>
                             <div class="detail-row">
                                 <span class="detail-label">Status</span>
-                                <span class="detail-value">
-                                    <span class="status-badge status-approved">✅ APPROVED</span>
-                                </span>
+                                <span class="detail-value" style="color: #f56565; font-weight: 600;">⚠️ Low Balance</span>
                             </div>
                         </div>
-                        
+
                         <div style="text-align: center; margin: 24px 0;">
-                            <div style="color: #4a5568; margin-bottom: 8px; font-weight: 500; font-size: 14px;">Your Pickup PIN</div>
-                            <div class="pickup-pin">{data.get('pickup_pin', 'N/A')}</div>
-                            <div style="color: #718096; font-size: 12px; margin-top: 8px;">Keep this PIN safe - you'll need it to collect your prints!</div>
+                            <a href="{top_up_link}" class="cta-button">
+                                💳 Add Money to Wallet
+                            </a>
                         </div>
-                        
+
+                        <div style="color: #718096; font-size: 12px; text-align: center;">
+                            💡 Pro tip: Set up automatic top-ups to never run out of balance again!
+                        </div>"""
+    },
+    'digest': {
+        'title': 'PrintQ - Print Job Updates',
+        'icon': '📬',
+        'heading': 'Your Print Job Updates',
+        'footer_note': '© 2024 • Updates sent close together are grouped into one email.',
+        'content': """
+                        <div class="greeting">Hi {student_name}! 👋</div>
+                        <div class="message">
+                            You have {update_count} updates on your print jobs. Details for each job are below.
+                        </div>
+{digest_sections}
                         <div class="divider"></div>
                         <p style="color: #4a5568; font-size: 14px; text-align: center;">
-                            📍 Head to <strong>{data.get('printer_location', 'the printer location')}</strong> when your job is completed!
-                        </p>
-                    </div>
-                    <div class="footer">
-                        <div class="footer-brand">PrintQ - Smart Campus Printing</div>
-                        <div>© 2024</div>
-                    </div>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
-    
-    elif template_type == 'job_completed':
-        return f"""
-        <!DOCTYPE html>
-        <html lang="en">
-        <head>
-            <meta charset="UTF-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <title>PrintQ - Job Completed</title>
-            {base_style}
-        </head>
-        <body>
-            <div class="email-wrapper">
-                <div class="container">
-                    <div class="header">
-                        <div class="logo">
-                            <div class="logo-icon">🎉</div>
-                            PrintQ
-                        </div>
-                        <h2>Print Job Completed!</h2>
-                    </div>
-                    <div class="content">
-                        <div class="greeting">Hi {data.get('student_name', 'Student')}! 🎉</div>
+                            Remember to bring your student ID and the pickup PIN for each job.
+                        </p>"""
+    },
+    'default': {
+        'title': 'PrintQ Notification',
+        'icon': '📱',
+        'heading': 'Notification',
+        'footer_note': '© 2024',
+        'content': """
                         <div class="message">
-                            Your print job is ready for pickup! Don't forget to collect your documents.
-                        </div>
-                        
-                        <div class="job-details">
-                            <h3>📄 Job Details</h3>
-                            <div class="detail-row">
-                                <span class="detail-label">Job ID</span>
-                                <span class="detail-value">{data.get('job_id', 'N/A')}</span>
-                            </div>
-                            <div class="detail-row">
-                                <span class="detail-label">Printer</span>
-                                <span class="detail-value">{data.get('printer_name', 'N/A')}</span>
-                            </div>
-                            <div class="detail-row">
-                                <span class="detail-label">Location</span>
-                                <span class="detail-value">{data.get('printer_location', 'N/A')}</span>
-                            </div>
-                            <div class="detail-row">
-                                <span class="detail-label">Status</span>
-                                <span class="detail-value">
-                                    <span class="status-badge status-completed">🎉 COMPLETED</span>
-                                </span>
-                            </div>
-                        </div>
-                        
-                        <div style="text-align: center; margin: 24px 0;">
-                            <div style="color: #4a5568; margin-bottom: 8px; font-weight: 500; font-size: 14px;">Your Pickup PIN</div>
-                            <div class="pickup-pin">{data.get('pickup_pin', 'N/A')}</div>
-                        </div>
-                        
-                        <div class="highlight-box" style="text-align: center;">
-                            <div style="font-size: 16px; font-weight: 600; color: #2d3748; margin-bottom: 6px;">
-                                🏃‍♂️ Ready for Pickup!
-                            </div>
-                            <div style="color: #4a5568; font-size: 14px;">
-                                Head to <strong>{data.get('printer_location', 'the printer location')}</strong> now to collect your documents!<br>
-                                Remember to bring your student ID and use the pickup PIN above.
+                            Thank you for using PrintQ - Smart Campus Printing!
+                        </div>"""
+    }
+}
+
+EMAIL_DUPLEX_TIP = """<div class="eco-tip">
+                            <div class="eco-tip-header">
+                                🌱 Eco-Friendly Choice!
                             </div>
-                        </div>
-                        
-                        {f'''<div class="eco-tip">
+                            Great choice on double-sided printing! You're helping save trees and reduce waste.
+                        </div>"""
+
+EMAIL_ECO_POINTS_TIP = """<div class="eco-tip">
                             <div class="eco-tip-header">
                                 🌱 Eco Points Earned!
                             </div>
-                            Thanks for choosing eco-friendly printing options! You earned <strong>{data.get("eco_points", 0)} eco points</strong>!
-                        </div>''' if data.get('eco_points') else ''}
-                    </div>
-                    <div class="footer">
-                        <div class="footer-brand">PrintQ - Smart Campus Printing</div>
-                        <div>© 2024</div>
-                    </div>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
+                            Thanks for choosing eco-friendly printing options! You earned <strong>{eco_points} eco points</strong>!
+                        </div>"""
+
+# Per-job sections of a digest email, keyed by the notification type they stand in for
+EMAIL_DIGEST_SECTIONS = {
+    'job_approved': """
+                        <div class="message"><strong>✅ Approved - now in the printing queue</strong></div>""" + EMAIL_JOB_APPROVED_DETAILS,
+    'job_completed': """
+                        <div class="message"><strong>🎉 Completed - ready for pickup at {pickup_location}</strong></div>""" + EMAIL_JOB_COMPLETED_DETAILS
+}
+
+# Fallbacks for fields a caller leaves out, matching the original per-field defaults
+EMAIL_FIELD_DEFAULTS = {
+    'student_name': 'Student',
+    'student_id': 'N/A',
+    'email': 'N/A',
+    'initial_balance': 0,
+    'app_link': '#',
+    'job_id': 'N/A',
+    'file_name': 'N/A',
+    'pages': 'N/A',
+    'cost': 0,
+    'printer_name': 'N/A',
+    'printer_location': 'N/A',
+    'pickup_pin': 'N/A',
+    'eco_points': 0,
+    'balance': 0,
+    'top_up_link': '#'
+}
+
+
+def html_ascii(text):
+    """Replace non-ASCII characters with HTML character references
+
+    Rendering joins the literal chunks on every send. An ASCII-only stylesheet
+    chunk joined with an emoji chunk is widened to four bytes per character
+    each time; all-ASCII chunks are copied as they are.
+    """
+    return text.encode('ascii', 'xmlcharrefreplace').decode('ascii')
+
+
+class EmailTemplate:
+    """An HTML email compiled once into literal chunks and named fields
+
+    Field defaults are resolved at compile time, so rendering only walks the
+    precomputed parts and formats the values the caller supplied. Literal
+    text is stored ASCII-only (see html_ascii).
+    """
+
+    def __init__(self, source, defaults):
+        parts = []
+        pending = ''
+        for literal, field, spec, _ in string.Formatter().parse(source):
+            # The parser splits at every escaped brace; fold those runs back into one literal
+            pending += literal
+            if field is not None:
+                parts.append((html_ascii(pending), field, spec, defaults.get(field)))
+                pending = ''
+        self.parts = tuple(parts)
+        self.tail = html_ascii(pending)
+        self.fields = frozenset(field for _, field, _, _ in parts)
+
+    def render(self, data, computed):
+        out = []
+        for literal, field, spec, default in self.parts:
+            out.append(literal)
+            value = computed[field] if field in computed else data.get(field, default)
+            out.append(format(value, spec) if spec else str(value))
+        out.append(self.tail)
+        return ''.join(out)
+
+
+def compile_email_templates():
+    """Inline the shared stylesheet into each page layout and compile it"""
+    # The stylesheet is substituted as text, so its braces must be escaped to stay literal
+    style = EMAIL_BASE_STYLE.replace('{', '{{').replace('}', '}}')
+    compiled = {}
+    for template_type, source in EMAIL_TEMPLATE_SOURCES.items():
+        page = EMAIL_PAGE_LAYOUT.format(style=style, **source)
+        compiled[template_type] = EmailTemplate(page, EMAIL_FIELD_DEFAULTS)
+    return compiled
+
+
+EMAIL_TEMPLATES = compile_email_templates()
+ECO_POINTS_TIP_TEMPLATE = EmailTemplate(EMAIL_ECO_POINTS_TIP, EMAIL_FIELD_DEFAULTS)
+DIGEST_SECTION_TEMPLATES = {
+    template_type: EmailTemplate(source, EMAIL_FIELD_DEFAULTS)
+    for template_type, source in EMAIL_DIGEST_SECTIONS.items()
+}
+
+
+EMAIL_DUPLEX_TIP_HTML = html_ascii(EMAIL_DUPLEX_TIP)
+
+# Fields derived from the caller's data: conditional blocks and alternate defaults
+EMAIL_COMPUTED_FIELDS = {
+    'pickup_location': lambda data: data.get('printer_location', 'the printer location'),
+    'duplex_tip': lambda data: EMAIL_DUPLEX_TIP_HTML if data.get('duplex') else '',
+    'eco_points_tip': lambda data: ECO_POINTS_TIP_TEMPLATE.render(data, {}) if data.get('eco_points') else ''
+}
+
+
+def email_computed_fields(template, data):
+    """The derived fields a template uses; the others are never built"""
+    return {field: compute(data) for field, compute in EMAIL_COMPUTED_FIELDS.items() if field in template.fields}
+
+
+def get_email_template(template_type, data):
+    """Render a precompiled HTML email template with enhanced PrintQ branding"""
+    template = EMAIL_TEMPLATES.get(template_type, EMAIL_TEMPLATES['default'])
+    return template.render(data, email_computed_fields(template, data))
+
+
+def get_digest_template(items):
+    """Render one digest email from several (template_type, data) job notifications"""
+    sections = ''.join(
+        DIGEST_SECTION_TEMPLATES[template_type].render(data, email_computed_fields(DIGEST_SECTION_TEMPLATES[template_type], data))
+        for template_type, data in items
+    )
+    return EMAIL_TEMPLATES['digest'].render(items[0][1], {
+        'update_count': len(items),
+        'digest_sections': sections
+    })
+
+
+def build_email_message(to_email, subject, template_type, data):
+    """Build the MIME message for a notification"""
+    msg = MIMEMultipart('alternative')
+    msg['From'] = EMAIL_CONFIG['email']
+    msg['To'] = to_email
+    msg['Subject'] = f"PrintQ - {subject}"
     
-    elif template_type == 'low_balance':
-        return f"""
-        <!DOCTYPE html>
-        <html lang="en">
-        <head>
-            <meta charset="UTF-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <title>PrintQ - Low Balance Alert</title>
-            {base_style}
-        </head>
-        <body>
-            <div class="email-wrapper">
-                <div class="container">
-                    <div class="header">
-                        <div class="logo">
-                            <div class="logo-icon">⚠️</div>
-                            PrintQ
-                        </div>
-                        <h2>Low Wallet Balance Alert</h2>
-                    </div>
-                    <div class="content">
-                        <div class="greeting">Hi {data.get('student_name', 'Student')}! 👋</div>
-                        <div class="message">
-                            Your PrintQ wallet balance is running low. Add money now to ensure uninterrupted printing services.
-                        </div>
-                        
-                        <div class="highlight-box" style="text-align: center;">
-                            <div style="color: #4a5568; margin-bottom: 12px; font-weight: 500; font-size: 14px;">Current Balance</div>
-                            <div class="balance-display">${data.get('balance', 0):.2f}</div>
-                            <div style="color: #718096; font-size: 12px;">Recommended top-up: $10.00 or more</div>
-                        </div>
-                        
-                        <div class="job-details">
-                            <h3>💰 Wallet Status</h3>
-                            <div class="detail-row">
-                                <span class="detail-label">Current Balance</span>
-                                <span class="detail-value" style="color: #f56565;">${data.get('balance', 0):.2f}</span>
-                            </div>
-                            <div class="detail-row">
-                                <span class="detail-label">Recommended Top-up</span>
-                                <span class="detail-value">$10.00 or more</span>
-                            </div>
-                            <div class="detail-row">
-                                <span class="detail-label">Status</span>
-                                <span class="detail-value" style="color: #f56565; font-weight: 600;">⚠️ Low Balance</span>
-                            </div>
-                        </div>
-                        
-                        <div style="text-align: center; margin: 24px 0;">
-                            <a href="{data.get('top_up_link', '#')}" class="cta-button">
-                                💳 Add Money to Wallet
-                            </a>
-                        </div>
-                        
-                        <div style="color: #718096; font-size: 12px; text-align: center;">
-                            💡 Pro tip: Set up automatic top-ups to never run out of balance again!
-                        </div>
-                    </div>
-                    <div class="footer">
-                        <div class="footer-brand">PrintQ - Smart Campus Printing</div>
-                        <div>© 2024</div>
-                    </div>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
+    html_body = get_email_template(template_type, data)
+    msg.attach(MIMEText(html_body, 'html'))
+    return msg
+
+
+def build_digest_message(to_email, items):
+    """Build one MIME message summarising several job notifications"""
+    msg = MIMEMultipart('alternative')
+    msg['From'] = EMAIL_CONFIG['email']
+    msg['To'] = to_email
+    msg['Subject'] = f"PrintQ - {len(items)} Print Job Updates"
     
-    else:
-        return f"""
-        <!DOCTYPE html>
-        <html lang="en">
-        <head>
-            <meta charset="UTF-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <title>PrintQ Notification</title>
-            {base_style}
-        </head>
-        <body>
-            <div class="email-wrapper">
-                <div class="container">
-                    <div class="header">
-                        <div class="logo">
-                            <div class="logo-icon">📱</div>
-                            PrintQ
-                        </div>
-                        <h2>Notification</h2>
-                    </div>
-                    <div class="content">
-                        <div class="message">
-                            Thank you for using PrintQ - Smart Campus Printing!
-                        </div>
-                    </div>
-                    <div class="footer">
-                        <div class="footer-brand">PrintQ - Smart Campus Printing</div>
-                        <div>© 2024</div>
-                    </div>
-                </div>
-            </div>
-        </body>
-        </html>
+    html_body = get_digest_template(items)
+    msg.attach(MIMEText(html_body, 'html'))
+    return msg
+
+
+class NotificationOutbox:
+    """Durable notification queue in a local SQLite database (WAL mode)
+
+    Appending is a single local insert, so handlers never wait on mail
+    delivery. Rows carry an idempotency key: re-queuing the same event is a
+    no-op. Drainers lease rows, so a worker that dies mid-send only delays
+    the message until the lease expires.
+
+    Digestible job notifications wait out a short coalescing window and are
+    then claimed together with every other pending one for the same
+    recipient. Each recipient is also capped at a number of emails per
+    window; rows over the cap are deferred, not dropped.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            idempotency_key TEXT UNIQUE,
+            to_email TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            template_type TEXT NOT NULL,
+            data TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            available_at REAL NOT NULL,
+            lease_until REAL,
+            last_error TEXT,
+            created_at REAL NOT NULL,
+            sent_at REAL
+        );
+        CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, available_at);
+        CREATE INDEX IF NOT EXISTS outbox_recipient ON outbox (to_email, status);
+        CREATE TABLE IF NOT EXISTS recipient_sends (
+            to_email TEXT NOT NULL,
+            sent_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS recipient_sends_recent ON recipient_sends (to_email, sent_at);
+    """
+
+    def __init__(self, path, config, digest_types=()):
+        self.path = path
+        self.config = config
+        self.digest_types = tuple(digest_types)
+        self._local = threading.local()
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            with self._schema_lock:
+                if not self._schema_ready:
+                    connection.executescript(self.SCHEMA)
+                    self._schema_ready = True
+            self._local.connection = connection
+        return connection
+
+    @offload_blocking
+    def append(self, to_email, subject, template_type, data, idempotency_key=None):
+        """Persist a notification; returns False if the key was already queued"""
+        now = time.time()
+        # Digestible events wait out the window so siblings can join the same email
+        available_at = now + self.config['digest_window'] if template_type in self.digest_types else now
+        cursor = self._connection().execute(
+            "INSERT OR IGNORE INTO outbox "
+            "(idempotency_key, to_email, subject, template_type, data, available_at, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (idempotency_key, to_email, subject, template_type, json.dumps(data, default=str), available_at, now)
+        )
+        return cursor.rowcount == 1
+
+    @offload_blocking
+    def claim(self):
+        """Lease the next due message as a list of rows (several for a digest)
+
+        Returns (rows, deferred) where deferred counts rows pushed back by
+        the per-recipient rate cap; rows is empty when nothing is due.
         """
+        connection = self._connection()
+        now = time.time()
+        deferred = 0
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            candidates = connection.execute(
+                "SELECT * FROM outbox WHERE (status = 'queued' AND available_at <= ?) "
+                "OR (status = 'sending' AND lease_until < ?) ORDER BY available_at LIMIT 20",
+                (now, now)
+            ).fetchall()
+            rows = []
+            for row in candidates:
+                allowed_at = self._rate_allowed_at(connection, row['to_email'], now)
+                if allowed_at is not None:
+                    connection.execute(
+                        "UPDATE outbox SET status = 'queued', available_at = ?, lease_until = NULL WHERE id = ?",
+                        (allowed_at, row['id'])
+                    )
+                    deferred += 1
+                    continue
+                
+                rows = [row]
+                if row['template_type'] in self.digest_types:
+                    placeholders = ','.join('?' * len(self.digest_types))
+                    rows += connection.execute(
+                        f"SELECT * FROM outbox WHERE to_email = ? AND status = 'queued' AND id != ? "
+                        f"AND template_type IN ({placeholders}) ORDER BY id",
+                        (row['to_email'], row['id'], *self.digest_types)
+                    ).fetchall()
+                connection.executemany(
+                    "UPDATE outbox SET status = 'sending', lease_until = ? WHERE id = ?",
+                    [(now + self.config['lease_seconds'], claimed['id']) for claimed in rows]
+                )
+                # Count the send against the cap at claim time so concurrent drainers see it
+                connection.execute(
+                    "INSERT INTO recipient_sends (to_email, sent_at) VALUES (?, ?)",
+                    (row['to_email'], now)
+                )
+                break
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return rows, deferred
+
+    def _rate_allowed_at(self, connection, to_email, now):
+        """When the recipient may next be emailed, or None if under the cap now"""
+        window = self.config['recipient_rate_window']
+        count, oldest = connection.execute(
+            "SELECT COUNT(*), MIN(sent_at) FROM recipient_sends WHERE to_email = ? AND sent_at > ?",
+            (to_email, now - window)
+        ).fetchone()
+        if count < self.config['recipient_rate_limit']:
+            return None
+        return oldest + window
+
+    @offload_blocking
+    def mark_sent(self, rows):
+        now = time.time()
+        self._connection().executemany(
+            "UPDATE outbox SET status = 'sent', sent_at = ?, lease_until = NULL WHERE id = ?",
+            [(now, row['id']) for row in rows]
+        )
 
-def send_email(to_email, subject, template_type, data):
-    """Send email notification"""
-    try:
-        msg = MIMEMultipart('alternative')
-        msg['From'] = EMAIL_CONFIG['email']
-        msg['To'] = to_email
-        msg['Subject'] = f"PrintQ - {subject}"
-        
-        html_body = get_email_template(template_type, data)
-        msg.attach(MIMEText(html_body, 'html'))
-        
-        server = smtplib.SMTP(EMAIL_CONFIG['smtp_server'], EMAIL_CONFIG['smtp_port'])
-        server.starttls()
-        server.login(EMAIL_CONFIG['email'], EMAIL_CONFIG['password'])
-        server.send_message(msg)
-        server.quit()
+    @offload_blocking
+    def mark_failed(self, row, error):
+        """Reschedule with exponential backoff, or dead-letter after the last attempt"""
+        attempts = row['attempts'] + 1
+        if attempts >= self.config['max_attempts']:
+            self._connection().execute(
+                "UPDATE outbox SET status = 'dead', attempts = ?, last_error = ?, lease_until = NULL WHERE id = ?",
+                (attempts, str(error)[:500], row['id'])
+            )
+            return False
+        
+        delay = min(self.config['backoff_base'] * (2 ** (attempts - 1)), self.config['backoff_max'])
+        self._connection().execute(
+            "UPDATE outbox SET status = 'queued', attempts = ?, last_error = ?, available_at = ?, "
+            "lease_until = NULL WHERE id = ?",
+            (attempts, str(error)[:500], time.time() + delay, row['id'])
+        )
+        return True
+
+    @offload_blocking
+    def purge_sent(self):
+        cutoff = time.time() - self.config['retain_sent_seconds']
+        self._connection().execute("DELETE FROM outbox WHERE status = 'sent' AND sent_at < ?", (cutoff,))
+        self._connection().execute(
+            "DELETE FROM recipient_sends WHERE sent_at < ?",
+            (time.time() - self.config['recipient_rate_window'],)
+        )
+
+    @offload_blocking
+    def counts(self):
+        rows = self._connection().execute("SELECT status, COUNT(*) AS n FROM outbox GROUP BY status").fetchall()
+        return {row['status']: row['n'] for row in rows}
+
+
+class NotificationDispatcher:
+    """Drains the notification outbox over a small pool of persistent SMTP connections
+
+    Each worker thread owns one long-lived authenticated connection,
+    reconnects when the server drops it and closes it after a period of
+    inactivity. Workers wake immediately for notifications queued by this
+    process and poll briefly for rows appended by other processes.
+    """
+
+    def __init__(self, config, email_config, outbox):
+        self.config = config
+        self.email_config = email_config
+        self.outbox = outbox
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._started = False
+        self.open_connections = 0
+        self.sent = 0
+        self.retried = 0
+        self.dead_lettered = 0
+        self.reconnects = 0
+        self.digests = 0
+        self.coalesced = 0
+        self.rate_deferred = 0
+        self.send_seconds_total = 0.0
+        self.send_seconds_max = 0.0
+
+    def start(self):
+        """Start the drainer threads; SMTP connections open only when a row is due"""
+        if self._started:
+            return
+        with self._lock:
+            if self._started:
+                return
+            for index in range(self.config['connections']):
+                threading.Thread(target=self._run_worker, name=f"smtp-{index}", daemon=True).start()
+            self._started = True
+
+    def enqueue(self, to_email, subject, template_type, data, idempotency_key=None):
+        """Append a notification to the outbox and wake a drainer"""
+        if not to_email:
+            return False
+        try:
+            queued = self.outbox.append(to_email, subject, template_type, data, idempotency_key)
+        except Exception as e:
+            logger.error(f"Failed to queue '{subject}' for {to_email}: {e}")
+            return False
+        self.start()
+        self._wakeup.set()
+        return queued
+
+    def _connect(self):
+        server = smtplib.SMTP(
+            self.email_config['smtp_server'],
+            self.email_config['smtp_port'],
+            timeout=self.config['smtp_timeout']
+        )
+        if self.email_config['use_tls']:
+            server.starttls()
+        if self.email_config['email'] and self.email_config['password']:
+            server.login(self.email_config['email'], self.email_config['password'])
+        with self._lock:
+            self.open_connections += 1
+        return server
+
+    def _close(self, server):
+        try:
+            server.quit()
+        except Exception:
+            pass
+        with self._lock:
+            self.open_connections -= 1
+
+    def _run_worker(self):
+        server = None
+        idle_since = time.monotonic()
+        last_purge = 0.0
+        while True:
+            if time.monotonic() - last_purge > 3600:
+                try:
+                    self.outbox.purge_sent()
+                except Exception as e:
+                    logger.error(f"Outbox purge error: {e}")
+                last_purge = time.monotonic()
+            
+            try:
+                rows, deferred = self.outbox.claim()
+            except Exception as e:
+                logger.error(f"Outbox claim error: {e}")
+                rows, deferred = [], 0
+            if deferred:
+                with self._lock:
+                    self.rate_deferred += deferred
+            
+            if not rows:
+                if server is not None and time.monotonic() - idle_since > self.config['idle_timeout']:
+                    self._close(server)
+                    server = None
+                self._wakeup.wait(timeout=self.config['poll_interval'])
+                self._wakeup.clear()
+                continue
+            
+            server = self._deliver(server, rows)
+            idle_since = time.monotonic()
+
+    def _deliver(self, server, rows):
+        """Send one message for the claimed rows; returns the connection to keep using"""
+        row = rows[0]
+        try:
+            if len(rows) > 1:
+                items = [(claimed['template_type'], json.loads(claimed['data'])) for claimed in rows]
+                msg = build_digest_message(row['to_email'], items)
+            else:
+                msg = build_email_message(row['to_email'], row['subject'], row['template_type'], json.loads(row['data']))
+            # Stable Message-ID lets receivers drop a duplicate from an at-least-once redelivery
+            msg['Message-ID'] = f"<outbox-{row['id']}@printq>"
+        except Exception as e:
+            logger.error(f"Failed to build email for {row['to_email']}: {e}")
+            self._record_failure(rows, e)
+            return server
         
-        logger.info(f"Email sent successfully to {to_email}")
+        started = time.perf_counter()
+        # A reused connection may have been dropped by the server: retry once on a fresh one
+        for fresh in (server is None, True):
+            try:
+                if server is None:
+                    server = self._connect()
+                server.send_message(msg)
+                break
+            except (smtplib.SMTPException, OSError) as e:
+                if server is not None:
+                    self._close(server)
+                    server = None
+                if fresh:
+                    self._record_failure(rows, e)
+                    return None
+                with self._lock:
+                    self.reconnects += 1
+        
+        elapsed = time.perf_counter() - started
+        self.outbox.mark_sent(rows)
+        with self._lock:
+            self.sent += 1
+            if len(rows) > 1:
+                self.digests += 1
+                self.coalesced += len(rows)
+            self.send_seconds_total += elapsed
+            self.send_seconds_max = max(self.send_seconds_max, elapsed)
+        logger.info(f"Email sent successfully to {row['to_email']}")
+        return server
+
+    def _record_failure(self, rows, error):
+        # Rows of a failed digest retry individually and may regroup on the next claim
+        for row in rows:
+            if self.outbox.mark_failed(row, error):
+                with self._lock:
+                    self.retried += 1
+                logger.warning(f"Email to {row['to_email']} failed, will retry: {error}")
+            else:
+                with self._lock:
+                    self.dead_lettered += 1
+                logger.error(f"Email to {row['to_email']} dead-lettered after {row['attempts'] + 1} attempts: {error}")
+
+    def stats(self):
+        try:
+            outbox_counts = self.outbox.counts()
+        except Exception as e:
+            outbox_counts = {'error': str(e)}
+        with self._lock:
+            return {
+                'connections': self.config['connections'],
+                'open_connections': self.open_connections,
+                'queue_depth': outbox_counts.get('queued', 0) + outbox_counts.get('sending', 0),
+                'outbox': outbox_counts,
+                'sent': self.sent,
+                'retried': self.retried,
+                'dead_lettered': self.dead_lettered,
+                'reconnects': self.reconnects,
+                'digests': self.digests,
+                'coalesced': self.coalesced,
+                'rate_deferred': self.rate_deferred,
+                'send_avg_ms': round(self.send_seconds_total / self.sent * 1000, 2) if self.sent else 0.0,
+                'send_max_ms': round(self.send_seconds_max * 1000, 2)
+            }
+
+notification_outbox = NotificationOutbox(NOTIFICATION_CONFIG['outbox_path'], NOTIFICATION_CONFIG, EMAIL_DIGEST_SECTIONS)
+notification_dispatcher = NotificationDispatcher(NOTIFICATION_CONFIG, EMAIL_CONFIG, notification_outbox)
+
+def send_email(to_email, subject, template_type, data, idempotency_key=None):
+    """Queue an email notification in the durable outbox"""
+    return notification_dispatcher.enqueue(to_email, subject, template_type, data, idempotency_key)
+
+
+class EventSubscription:
+    """One connected event stream: a bounded queue and an overflow flag"""
+
+    def __init__(self, max_queue):
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.overflowed = False
+
+
+class JobEventHub:
+    """In-process fan-out of job status events to per-student stream subscribers
+
+    Recent events stay in a ring buffer so a reconnecting client can resume
+    from Last-Event-ID. Event ids carry a per-process epoch; an id from
+    another process, or one that has fallen out of the buffer, tells the
+    client to resync from the REST API instead.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.epoch = uuid.uuid4().hex[:8]
+        self._seq = 0
+        self._buffer = deque(maxlen=config['replay_buffer'])  # (seq, event)
+        self._subscribers = {}  # student_id -> {EventSubscription, ...}
+        self._lock = threading.Lock()
+        self._recent_keys = OrderedDict()  # dedupe keys of recently published events
+        self.published = 0
+        self.deduplicated = 0
+        self.resyncs = 0
+        self.overflows = 0
+
+    def _event_id(self, seq):
+        return f"{self.epoch}-{seq}"
+
+    def publish(self, student_id, event_type, data, dedupe_key=None):
+        """Fan an event out to the student's subscribers; repeated dedupe keys are dropped"""
+        with self._lock:
+            if dedupe_key is not None:
+                if dedupe_key in self._recent_keys:
+                    self.deduplicated += 1
+                    return
+                self._recent_keys[dedupe_key] = True
+                if len(self._recent_keys) > self.config['replay_buffer']:
+                    self._recent_keys.popitem(last=False)
+            self._seq += 1
+            event = (self._event_id(self._seq), student_id, event_type, data)
+            self._buffer.append((self._seq, event))
+            subscriptions = list(self._subscribers.get(student_id, ()))
+            self.published += 1
+        
+        for subscription in subscriptions:
+            try:
+                subscription.queue.put_nowait(event)
+            except queue.Full:
+                subscription.overflowed = True
+                with self._lock:
+                    self.overflows += 1
+
+    def subscribe(self, student_id, last_event_id=None):
+        """Register a subscriber; returns (subscription, backlog, resync)
+
+        Registration and the backlog snapshot happen under one lock, so no
+        event falls between the replayed backlog and the live queue.
+        """
+        subscription = EventSubscription(self.config['subscriber_queue'])
+        with self._lock:
+            self._subscribers.setdefault(student_id, set()).add(subscription)
+            backlog, resync = self._replay(student_id, last_event_id)
+            if resync:
+                self.resyncs += 1
+        return subscription, backlog, resync
+
+    def _replay(self, student_id, last_event_id):
+        if not last_event_id:
+            return [], False
+        epoch, _, seq = last_event_id.partition('-')
+        if epoch != self.epoch or not seq.isdigit():
+            return [], True
+        seq = int(seq)
+        oldest = self._buffer[0][0] if self._buffer else self._seq + 1
+        if seq < oldest - 1:
+            return [], True
+        return [event for event_seq, event in self._buffer if event_seq > seq and event[1] == student_id], False
+
+    def unsubscribe(self, student_id, subscription):
+        with self._lock:
+            subscriptions = self._subscribers.get(student_id)
+            if subscriptions:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscribers[student_id]
+
+    def latest_event_id(self):
+        with self._lock:
+            return self._event_id(self._seq)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'epoch': self.epoch,
+                'students': len(self._subscribers),
+                'subscribers': sum(len(subscriptions) for subscriptions in self._subscribers.values()),
+                'buffered': len(self._buffer),
+                'published': self.published,
+                'deduplicated': self.deduplicated,
+                'resyncs': self.resyncs,
+                'overflows': self.overflows
+            }
+
+job_event_hub = JobEventHub(EVENT_STREAM_CONFIG)
+
+def publish_job_event(job_id, job_data, status, **extra):
+    """Push a job status transition to the owning student's open streams"""
+    if not job_data.get('student_id'):
+        return
+    data = {
+        'job_id': job_id,
+        'status': status,
+        'file_name': job_data.get('file_name'),
+        'printer_name': job_data.get('printer_name'),
+        'printer_location': job_data.get('printer_location')
+    }
+    data.update(extra)
+    # The request handler and the job view listener may both report the same transition
+    job_event_hub.publish(job_data['student_id'], 'job_status', data, dedupe_key=(job_id, status))
+
+
+class JobView:
+    """Process-wide materialised view of active jobs and jobs created today
+
+    Two snapshot listeners keep it current: one on the active statuses and
+    one on today's jobs, re-subscribed when the date changes. Jobs are
+    indexed by status, printer and student, so admin reads come from memory
+    instead of scanning the collection. Status transitions the listeners
+    observe are forwarded to the job event hub, which drops the ones this
+    process already published.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self._lock = threading.RLock()
+        self._jobs = {}  # job_id -> job data
+        self._sources = {}  # job_id -> {'active', 'today'}
+        self._indexes = {'status': {}, 'printer_id': {}, 'student_id': {}}  # field -> value -> {job_id}
+        self._printer_queues = {}  # printer_id -> ordered queue summary, dropped when its jobs change
+        self._watches = {}  # source -> snapshot watch
+        self._generations = {}  # source -> token of the current watch
+        self._ready = {}  # source -> threading.Event set by the first snapshot
+        self._day = None
+        self.changes = 0
+        self.transitions = 0
+
+    def ensure_started(self):
+        """Start the listeners on first use and roll the today listener over at midnight"""
+        if not self.config['enabled']:
+            return False
+        with self._lock:
+            if 'active' not in self._watches:
+                statuses = list(self.config['active_statuses'])
+                self._watch('active', db.collection('jobs').where(filter=FieldFilter('status', 'in', statuses)))
+            today = datetime.datetime.now().date()
+            if self._day != today:
+                self._roll_day(today)
         return True
-    except Exception as e:
-        logger.error(f"Failed to send email to {to_email}: {e}")
+
+    def ready(self, *sources):
+        return all(source in self._ready and self._ready[source].is_set() for source in sources)
+
+    def _roll_day(self, today):
+        watch = self._watches.pop('today', None)
+        if watch is not None:
+            watch.unsubscribe()
+            for job_id in [job_id for job_id, sources in self._sources.items() if 'today' in sources]:
+                self._drop_source(job_id, 'today')
+        self._day = today
+        start_of_day = datetime.datetime.combine(today, datetime.time.min)
+        self._watch('today', db.collection('jobs').where(filter=FieldFilter('created_at', '>=', start_of_day)))
+
+    def _watch(self, source, query):
+        generation = object()
+        ready = threading.Event()
+        self._generations[source] = generation
+        self._ready[source] = ready
+        
+        def on_snapshot(docs, changes, read_time):
+            # A replaced watch can still deliver a late snapshot; ignore it
+            if self._generations.get(source) is not generation:
+                return
+            self._apply(source, changes, initial=not ready.is_set())
+            ready.set()
+        
+        self._watches[source] = query.on_snapshot(on_snapshot)
+
+    def _apply(self, source, changes, initial):
+        transitions = []
+        with self._lock:
+            for change in changes:
+                doc = change.document
+                if change.type.name == 'REMOVED':
+                    self._drop_source(doc.id, source)
+                    continue
+                data = doc.to_dict()
+                previous = self._jobs.get(doc.id)
+                self._sources.setdefault(doc.id, set()).add(source)
+                self._store(doc.id, data)
+                if not initial and previous is not None and previous.get('status') != data.get('status'):
+                    transitions.append((doc.id, data))
+            self.changes += len(changes)
+            self.transitions += len(transitions)
+        
+        # A job that leaves the view on its transition (completed after the day it was
+        # created) arrives as REMOVED with its old data; its own handler still publishes it
+        for job_id, data in transitions:
+            publish_job_event(job_id, data, data.get('status'))
+
+    def _store(self, job_id, data):
+        self._unindex(job_id)
+        self._jobs[job_id] = data
+        self._invalidate_queue(data)
+        for field, index in self._indexes.items():
+            value = data.get(field)
+            if value is not None:
+                index.setdefault(value, set()).add(job_id)
+
+    def _unindex(self, job_id):
+        previous = self._jobs.get(job_id)
+        if previous is None:
+            return
+        self._invalidate_queue(previous)
+        for field, index in self._indexes.items():
+            ids = index.get(previous.get(field))
+            if ids is not None:
+                ids.discard(job_id)
+                if not ids:
+                    del index[previous.get(field)]
+
+    def _drop_source(self, job_id, source):
+        sources = self._sources.get(job_id)
+        if sources is None:
+            return
+        sources.discard(source)
+        if not sources:
+            del self._sources[job_id]
+            self._unindex(job_id)
+            self._jobs.pop(job_id, None)
+
+    def _invalidate_queue(self, data):
+        if data.get('status') in PRINTER_ASSIGNMENT_CONFIG['queued_statuses']:
+            self._printer_queues.pop(data.get('printer_id'), None)
+
+    def queue_position(self, printer_id, job_id):
+        """(jobs ahead, pages ahead) of a job in its printer's queue
+
+        The ordered queue and its running page totals are built once per
+        change to the printer's queued jobs, so repeated lookups are O(1).
+        A job not yet in the view counts as last in line.
+        """
+        with self._lock:
+            summary = self._printer_queues.get(printer_id)
+            if summary is None:
+                statuses = PRINTER_ASSIGNMENT_CONFIG['queued_statuses']
+                queue = sorted(
+                    ((queued_id, self._jobs[queued_id]) for queued_id in self._indexes['printer_id'].get(printer_id, ())
+                     if self._jobs[queued_id].get('status') in statuses),
+                    key=printer_queue_order
+                )
+                positions = {}
+                pages = 0
+                for index, (queued_id, data) in enumerate(queue):
+                    positions[queued_id] = (index, pages)
+                    pages += job_print_pages(data)
+                summary = {'positions': positions, 'jobs': len(queue), 'pages': pages}
+                self._printer_queues[printer_id] = summary
+            return summary['positions'].get(job_id, (summary['jobs'], summary['pages']))
+
+    def get(self, job_id):
+        """A copy of the job's data, or None if it is not in the view"""
+        with self._lock:
+            data = self._jobs.get(job_id)
+            return dict(data) if data is not None else None
+
+    def select(self, status=None, printer_id=None, student_id=None, today_only=False):
+        """Copies of the matching jobs as (job_id, data) pairs, via the secondary indexes"""
+        with self._lock:
+            candidates = None
+            for field, value in (('status', status), ('printer_id', printer_id), ('student_id', student_id)):
+                if value is None:
+                    continue
+                ids = self._indexes[field].get(value, set())
+                candidates = set(ids) if candidates is None else candidates & ids
+            if candidates is None:
+                candidates = self._jobs.keys()
+            return [
+                (job_id, dict(self._jobs[job_id]))
+                for job_id in candidates
+                if not today_only or 'today' in self._sources.get(job_id, ())
+            ]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.config['enabled'],
+                'ready': {source: event.is_set() for source, event in self._ready.items()},
+                'jobs': len(self._jobs),
+                'statuses': {status: len(ids) for status, ids in self._indexes['status'].items()},
+                'changes': self.changes,
+                'transitions': self.transitions
+            }
+
+job_view = JobView(JOB_VIEW_CONFIG)
+
+def newest_first(jobs):
+    """Sort (job_id, data) pairs like the (created_at, __name__) descending queries"""
+    dated = [(job_id, data) for job_id, data in jobs if normalize_timestamp(data.get('created_at'))]
+    dated.sort(key=lambda item: (normalize_timestamp(item[1]['created_at']), item[0]), reverse=True)
+    return dated
+
+def job_print_pages(job_data):
+    return (job_data.get('pages') or 0) * (job_data.get('copies') or 1)
+
+def printer_supports_a3(printer_data):
+    # Printers created before the supports_a3 field fall back to their type
+    return printer_data.get('supports_a3', printer_data.get('type') == 'multifunc')
+
+def printer_can_print(printer_data, job_data):
+    if job_data.get('is_color') and printer_data.get('type') != 'color':
         return False
+    if job_data.get('paper_size') == 'A3' and not printer_supports_a3(printer_data):
+        return False
+    return True
+
+class PrinterRegistry:
+    """Process-wide copy of the printers collection, kept current by a snapshot listener
+
+    There are only a few dozen printers and they rarely change, so each
+    snapshot simply replaces the whole map. Once the first snapshot has
+    arrived, printer reads are served from memory; until then, or with the
+    registry disabled, they fall back to Firestore. The content fingerprint
+    stands in for the printers version counter in ETags, so it is the same
+    on every worker.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self._lock = threading.RLock()
+        self._printers = {}  # printer_id -> printer data
+        self._watch = None
+        self._ready = threading.Event()
+        self.version = None
+        self.snapshots = 0
+        self.fallbacks = 0
+
+    def ensure_started(self):
+        if not self.config['enabled']:
+            return False
+        with self._lock:
+            if self._watch is None:
+                self._watch = db.collection('printers').on_snapshot(self._on_snapshot)
+        return True
+
+    def live(self):
+        return self.ensure_started() and self._ready.is_set()
+
+    def _on_snapshot(self, docs, changes, read_time):
+        printers = {doc.id: doc.to_dict() for doc in docs}
+        with self._lock:
+            self._replace(printers)
+            self.snapshots += 1
+        self._ready.set()
+
+    def _replace(self, printers):
+        self._printers = printers
+        encoded = json.dumps(sorted(printers.items()), sort_keys=True, default=str)
+        self.version = hashlib.sha256(encoded.encode()).hexdigest()[:16]
+
+    def record_write(self, printer_id, data, merge=False):
+        """Apply a write this process just made, ahead of the listener confirming it"""
+        with self._lock:
+            if not self._ready.is_set():
+                return
+            printers = dict(self._printers)
+            printer = dict(printers.get(printer_id, {}), **data) if merge else dict(data)
+            printers[printer_id] = {key: value for key, value in printer.items() if value is not firestore.DELETE_FIELD}
+            self._replace(printers)
+
+    def all(self):
+        """Every printer as (printer_id, data) pairs, ordered by id like a collection read"""
+        if self.live():
+            with self._lock:
+                return [(printer_id, dict(data)) for printer_id, data in sorted(self._printers.items())]
+        self.fallbacks += 1
+        return [(doc.id, doc.to_dict()) for doc in db.collection('printers').get()]
+
+    def online(self):
+        return [(printer_id, data) for printer_id, data in self.all() if data.get('status') == 'online']
+
+    def get(self, printer_id):
+        """A printer's data, or None if there is no such printer"""
+        if self.live():
+            with self._lock:
+                data = self._printers.get(printer_id)
+            return dict(data) if data is not None else None
+        self.fallbacks += 1
+        doc = db.collection('printers').document(printer_id).get()
+        return doc.to_dict() if doc.exists else None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.config['enabled'],
+                'ready': self._ready.is_set(),
+                'printers': len(self._printers),
+                'snapshots': self.snapshots,
+                'fallbacks': self.fallbacks
+            }
+
+printer_registry = PrinterRegistry(PRINTER_REGISTRY_CONFIG)
+
+def get_online_printers():
+    return printer_registry.online()
+
+def printer_queue_order(job):
+    """Sort key for a (job_id, data) pair: the job printing now, then approvals in order"""
+    approved_at = normalize_timestamp(job[1].get('approved_at'))
+    approved_at = approved_at.replace(tzinfo=None) if approved_at else datetime.datetime.max
+    return job[1].get('status') != 'printing', approved_at, job[0]
+
+def get_queued_jobs():
+    """Approved and printing jobs as (job_id, data) pairs, from the job view when it is ready"""
+    statuses = PRINTER_ASSIGNMENT_CONFIG['queued_statuses']
+    if job_view.ensure_started() and job_view.ready('active'):
+        return [job for status in statuses for job in job_view.select(status=status)]
+    query = db.collection('jobs').where(filter=FieldFilter('status', 'in', list(statuses)))
+    fields = ['printer_id', 'pages', 'copies', 'status', 'approved_at']
+    return [(doc.id, doc.to_dict()) for doc in query.select(fields).get()]
+
+class PrinterThroughput:
+    """Per-printer pages-per-minute estimates learned from completed jobs
+
+    Each completion updates an exponentially weighted moving average in
+    O(1). A job's print time runs from its approval, or from the previous
+    completion on the same printer when that was later, so time spent
+    queued behind other jobs is not counted as printing. The previous
+    completion is shared between workers through last_completed_at in
+    printer_throughput/<printer_id>. The most recent completed jobs are
+    replayed once on first use, so a fresh worker does not start from
+    nothing; that query needs the jobs (status, completed_at desc) index
+    from firestore.indexes.json.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()  # held through the warm-up so nothing is observed ahead of it
+        self._rates = {}  # printer_id -> pages per minute
+        self._last_completed = {}  # printer_id -> epoch seconds of the latest completion
+        self._loaded = False
+        self.observations = 0
+        self.discarded = 0
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._load_lock:
+            if self._loaded:
+                return
+            # Set first so a failed warm-up is not retried on every request
+            self._loaded = True
+            try:
+                query = db.collection('jobs').where('status', '==', 'completed')
+                query = query.order_by('completed_at', direction=firestore.Query.DESCENDING).limit(self.config['warm_jobs'])
+                docs = query.select(['printer_id', 'pages', 'copies', 'approved_at', 'completed_at']).get()
+                # Oldest first, so the averages end on the latest jobs
+                for doc in reversed(list(docs)):
+                    self._observe(doc.to_dict())
+            except FailedPrecondition as e:
+                logger.warning(f"Printer throughput warm-up skipped, the jobs (status, completed_at) index "
+                               f"from firestore.indexes.json is missing; learning from new completions only: {e}")
+            except Exception as e:
+                logger.warning(f"Printer throughput warm-up failed: {e}")
+
+    def observe(self, job_data, completed_at=None, previous_completed_at=None):
+        """Fold one completed job into its printer's rate
+
+        previous_completed_at is the printer's last completion recorded by
+        any worker, if known. History is replayed first, since a completion
+        seen before it would make every replayed job look queued.
+        """
+        self._ensure_loaded()
+        self._observe(job_data, completed_at, previous_completed_at)
+
+    def _observe(self, job_data, completed_at=None, previous_completed_at=None):
+        printer_id = job_data.get('printer_id')
+        approved_at = normalize_timestamp(job_data.get('approved_at'))
+        completed_at = normalize_timestamp(completed_at or job_data.get('completed_at'))
+        previous_completed_at = normalize_timestamp(previous_completed_at)
+        pages = job_print_pages(job_data)
+        if not (printer_id and approved_at and completed_at and pages):
+            return
+        # Stored naive local times come back tagged UTC; drop the tag as elsewhere
+        approved = approved_at.replace(tzinfo=None).timestamp()
+        completed = completed_at.replace(tzinfo=None).timestamp()
+        shared = previous_completed_at.replace(tzinfo=None).timestamp() if previous_completed_at else None
+        
+        with self._lock:
+            last_completed = max(filter(None, (self._last_completed.get(printer_id), shared)), default=None)
+            started = max(approved, last_completed) if last_completed else approved
+            self._last_completed[printer_id] = max(completed, last_completed or completed)
+            minutes = (completed - started) / 60
+            rate = pages / minutes if minutes > 0 else float('inf')
+            if not self.config['min_pages_per_minute'] <= rate <= self.config['max_pages_per_minute']:
+                self.discarded += 1
+                return
+            previous = self._rates.get(printer_id)
+            self._rates[printer_id] = rate if previous is None else previous + self.config['alpha'] * (rate - previous)
+            self.observations += 1
+
+    def record_completions(self, completions):
+        """Observe (job_data, completed_at) pairs and publish each printer's latest completion
+
+        The printers' watermarks are read in one get_all before and written
+        in one batch after, so the next completion measures from them
+        whichever worker handles it.
+        """
+        # Replay history first, or this completion would become the latest
+        # and the replay would measure every older job against it
+        self._ensure_loaded()
+        completions = [(job_data, completed_at) for job_data, completed_at in completions if job_data.get('printer_id')]
+        if not completions:
+            return
+        collection = db.collection(self.config['collection'])
+        shared = {}
+        try:
+            printer_ids = {job_data['printer_id'] for job_data, _ in completions}
+            for snapshot in db.get_all([collection.document(printer_id) for printer_id in printer_ids]):
+                if snapshot.exists:
+                    shared[snapshot.id] = snapshot.to_dict().get('last_completed_at')
+        except Exception as e:
+            logger.warning(f"Reading printer completion times failed: {e}")
+        
+        latest = {}
+        for job_data, completed_at in completions:
+            printer_id = job_data['printer_id']
+            self._observe(job_data, completed_at, shared.get(printer_id))
+            latest[printer_id] = max(latest.get(printer_id, completed_at), completed_at)
+        try:
+            batch = db.batch()
+            for printer_id, completed_at in latest.items():
+                batch.set(collection.document(printer_id), {'last_completed_at': completed_at}, merge=True)
+            batch.commit()
+        except Exception as e:
+            logger.warning(f"Recording printer completion times failed: {e}")
+
+    def rate(self, printer_id, printer_data=None):
+        """(pages per minute, source): learned, else the printer's rated speed, else the default"""
+        self._ensure_loaded()
+        with self._lock:
+            learned = self._rates.get(printer_id)
+        if learned:
+            return learned, 'learned'
+        if printer_data and printer_data.get('pages_per_minute'):
+            return printer_data['pages_per_minute'], 'printer'
+        return PRINTER_ASSIGNMENT_CONFIG['default_pages_per_minute'], 'default'
+
+    def stats(self):
+        with self._lock:
+            return {
+                'printers': {printer_id: round(rate, 2) for printer_id, rate in self._rates.items()},
+                'observations': self.observations,
+                'discarded': self.discarded
+            }
+
+printer_throughput = PrinterThroughput(PRINTER_THROUGHPUT_CONFIG)
+
+class PrinterAssigner:
+    """Assign jobs to the capable online printer that will finish them soonest
+
+    Queue depth is the pages approved or printing on each printer, taken
+    from the job view when it is ready and from Firestore otherwise, and
+    drain time divides it by the printer's learned throughput.
+    Assignments are also held as short-lived reservations until the view
+    shows them, so back-to-back approvals and bulk batches spread out
+    instead of piling onto one printer.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self._lock = threading.Lock()
+        self._reservations = {}  # job_id -> (printer_id, pages, expires_at)
+        self.assignments = 0
+        self.unassignable = 0
+
+    def outstanding_pages(self):
+        """Pages queued on each printer, including recent assignments"""
+        queued = {}
+        seen = set()
+        for job_id, job_data in get_queued_jobs():
+            printer_id = job_data.get('printer_id')
+            if printer_id:
+                queued[printer_id] = queued.get(printer_id, 0) + job_print_pages(job_data)
+                seen.add(job_id)
+        
+        now = time.monotonic()
+        with self._lock:
+            for job_id, (printer_id, pages, expires_at) in list(self._reservations.items()):
+                if expires_at <= now:
+                    del self._reservations[job_id]
+                elif job_id not in seen:
+                    queued[printer_id] = queued.get(printer_id, 0) + pages
+        return queued
+
+    def drain_minutes(self, printer_id, printer_data, pages):
+        speed, _ = printer_throughput.rate(printer_id, printer_data)
+        return pages / speed
+
+    def assign(self, job_id, job_data, printers, queued=None):
+        """Pick a printer for the job from (printer_id, data) pairs, or None if none can print it
+
+        Pass the same queued dict for a batch of jobs; it is updated with
+        each assignment.
+        """
+        if queued is None:
+            queued = self.outstanding_pages()
+        capable = [(printer_id, data) for printer_id, data in printers if printer_can_print(data, job_data)]
+        if not capable:
+            with self._lock:
+                self.unassignable += 1
+            return None
+        
+        pages = job_print_pages(job_data)
+        printer_id, printer_data = min(
+            capable,
+            key=lambda printer: (self.drain_minutes(printer[0], printer[1], queued.get(printer[0], 0) + pages), printer[0])
+        )
+        queued[printer_id] = queued.get(printer_id, 0) + pages
+        with self._lock:
+            self._reservations[job_id] = (printer_id, pages, time.monotonic() + self.config['reservation_seconds'])
+            self.assignments += 1
+        return printer_id, printer_data
+
+    def release(self, job_id):
+        """Drop the reservation of an assignment that was never written"""
+        with self._lock:
+            self._reservations.pop(job_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'assignments': self.assignments,
+                'unassignable': self.unassignable,
+                'reservations': len(self._reservations)
+            }
+
+printer_assigner = PrinterAssigner(PRINTER_ASSIGNMENT_CONFIG)
+
+def scheduled_release_at(scheduled_time):
+    """Epoch seconds at which a job scheduled for pickup at scheduled_time is released
+
+    scheduled_time is a naive local datetime; Firestore hands it back tagged
+    as UTC, so the tag is dropped before converting, as elsewhere.
+    """
+    scheduled_time = normalize_timestamp(scheduled_time)
+    if scheduled_time is None:
+        return None
+    return scheduled_time.replace(tzinfo=None).timestamp() - JOB_SCHEDULER_CONFIG['lead_seconds']
+
+@firestore.transactional
+def release_scheduled_job(transaction, job_ref, plan):
+    """Apply plan(job_data)'s update if the job is still scheduled
+
+    Returns (job_data, update), or None when the job was deleted or already
+    released by another worker.
+    """
+    job_doc = job_ref.get(transaction=transaction)
+    if not job_doc.exists or job_doc.get('status') != 'scheduled':
+        return None
+    job_data = job_doc.to_dict()
+    update = plan(job_data)
+    transaction.update(job_ref, update)
+    stage_version_bump(transaction, 'jobs', student_ids=[job_data.get('student_id')])
+    return job_data, update
+
+class JobScheduler:
+    """Releases scheduled jobs into the active queue when they fall due
+
+    Release times sit in a min-heap of (release_at, job_id). The worker
+    thread waits on a condition until the earliest release time, and is
+    woken early only when a job due sooner is scheduled, so nothing polls.
+    Cancelled entries stay in the heap and are skipped when they reach the
+    top. On start the heap is rebuilt from the jobs still 'scheduled'; the
+    release itself is a transaction, so several workers holding the same
+    job release it once.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self._heap = []
+        self._due = {}  # job_id -> release_at of its live heap entry
+        self._condition = threading.Condition()
+        self._started = False
+        self.released = 0
+        self.auto_approved = 0
+        self.skipped = 0
+        self.failures = 0
+
+    def start(self):
+        if not self.config['enabled'] or self._started:
+            return
+        self._started = True
+        threading.Thread(target=self._run, name='job-scheduler', daemon=True).start()
+
+    def schedule(self, job_id, release_at):
+        with self._condition:
+            self._due[job_id] = release_at
+            heapq.heappush(self._heap, (release_at, job_id))
+            # Only a new earliest entry shortens the worker's wait
+            if self._heap[0] == (release_at, job_id):
+                self._condition.notify()
+
+    def cancel(self, job_id):
+        with self._condition:
+            self._due.pop(job_id, None)
+
+    def _rebuild(self):
+        query = db.collection('jobs').where('status', '==', 'scheduled').select(['scheduled_time'])
+        count = 0
+        for doc in query.stream():
+            release_at = scheduled_release_at(doc.get('scheduled_time'))
+            # A scheduled job without a usable time is released straight away
+            self.schedule(doc.id, release_at if release_at is not None else time.time())
+            count += 1
+        logger.info(f"Job scheduler rebuilt with {count} scheduled jobs")
+
+    def _next_due(self):
+        """Block until the earliest live entry is due and return its job id"""
+        with self._condition:
+            while True:
+                while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+                release_at, job_id = self._heap[0]
+                delay = release_at - time.time()
+                if delay <= 0:
+                    heapq.heappop(self._heap)
+                    del self._due[job_id]
+                    return job_id
+                self._condition.wait(delay)
+
+    def _run(self):
+        while True:
+            try:
+                self._rebuild()
+                break
+            except Exception as e:
+                logger.error(f"Job scheduler rebuild error: {e}")
+                time.sleep(self.config['retry_seconds'])
+        
+        while True:
+            job_id = self._next_due()
+            try:
+                self._release(job_id)
+            except Exception as e:
+                logger.error(f"Releasing scheduled job {job_id} failed: {e}")
+                self.failures += 1
+                self.schedule(job_id, time.time() + self.config['retry_seconds'])
+
+    def _release(self, job_id):
+        now = datetime.datetime.now()
+        job_ref = db.collection('jobs').document(job_id)
+        
+        # Pick the printer before the transaction, which may run plan more
+        # than once; the reservation is handed back if the release fails
+        assignment = None
+        if self.config['auto_approve']:
+            job_doc = job_ref.get()
+            if not job_doc.exists or job_doc.get('status') != 'scheduled':
+                self.skipped += 1
+                return
+            job_data = job_doc.to_dict()
+            printers = get_online_printers()
+            # Unverified page counts wait for an admin like any other pending job
+            if printers and job_data.get('page_count_source') != 'unverified':
+                assignment = printer_assigner.assign(job_id, job_data, printers)
+        
+        def plan(job_data):
+            update = {'status': 'pending', 'released_at': now, 'updated_at': now}
+            if assignment:
+                printer_id, printer_data = assignment
+                update.update({
+                    'status': 'approved',
+                    'printer_id': printer_id,
+                    'printer_name': printer_data['name'],
+                    'printer_location': printer_data['location'],
+                    'approved_at': now,
+                    'approved_by': 'scheduler'
+                })
+            return update
+        
+        try:
+            result = release_scheduled_job(db.transaction(), job_ref, plan)
+        except Exception:
+            if assignment:
+                printer_assigner.release(job_id)
+            raise
+        if result is None:
+            if assignment:
+                printer_assigner.release(job_id)
+            self.skipped += 1
+            return
+        
+        job_data, update = result
+        self.released += 1
+        publish_job_event(job_id, dict(job_data, **update), update['status'])
+        logger.info(f"Released scheduled job {job_id} as {update['status']}")
+        
+        if update['status'] == 'approved':
+            self.auto_approved += 1
+            send_email(
+                job_data['student_email'],
+                'Job Approved - Ready to Print',
+                'job_approved',
+                {
+                    'student_name': job_data['student_name'],
+                    'job_id': job_id,
+                    'printer_name': update['printer_name'],
+                    'printer_location': update['printer_location'],
+                    'pickup_pin': job_data['pickup_pin']
+                },
+                idempotency_key=f"job_approved:{job_id}"
+            )
+
+    def stats(self):
+        with self._condition:
+            return {
+                'enabled': self.config['enabled'],
+                'scheduled': len(self._due),
+                'heap_entries': len(self._heap),
+                'released': self.released,
+                'auto_approved': self.auto_approved,
+                'skipped': self.skipped,
+                'failures': self.failures
+            }
+
+job_scheduler = JobScheduler(JOB_SCHEDULER_CONFIG)
 
 def generate_qr_code(data):
     """Generate QR code for job pickup"""
@@ -958,6 +2554,1115 @@ def generate_pickup_pin():
     """Generate 6-digit pickup PIN"""
     return str(uuid.uuid4().int)[:6]
 
+class UploadTooLargeError(Exception):
+    """Raised when an upload stream exceeds the maximum content length"""
+
+def write_chunk(out, digest, chunk):
+    digest.update(chunk)
+    out.write(chunk)
+
+def stream_upload_to_disk(stream, max_bytes):
+    """Copy an upload stream to a temporary file in fixed-size chunks
+
+    The SHA-256 is computed while writing, so memory use is one chunk
+    regardless of file size. Returns (temp_path, sha256_hex, size).
+    """
+    os.makedirs(UPLOAD_CONFIG['directory'], exist_ok=True)
+    temp_path = os.path.join(UPLOAD_CONFIG['directory'], f".incoming-{uuid.uuid4()}")
+    digest = hashlib.sha256()
+    size = 0
+    
+    try:
+        with open(temp_path, 'wb') as out:
+            while True:
+                chunk = stream.read(UPLOAD_CONFIG['chunk_size'])
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLargeError(f"Upload exceeds {max_bytes} bytes")
+                run_blocking(write_chunk, out, digest, chunk)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    
+    return temp_path, digest.hexdigest(), size
+
+def blob_path(file_sha256):
+    """Content-addressed location of an uploaded file"""
+    return f"{UPLOAD_CONFIG['directory']}/blobs/{file_sha256[:2]}/{file_sha256}"
+
+def commit_blob(temp_path, file_sha256):
+    """Move a fully written upload into the blob store once a job references it"""
+    path = blob_path(file_sha256)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        # link() never replaces, so a blob that is being garbage-collected
+        # is either still in place or already moved aside by remove_blob_file
+        os.link(temp_path, path)
+    except FileExistsError:
+        pass
+    os.remove(temp_path)
+    return path
+
+def remove_blob_file(path, file_sha256):
+    """Remove an orphaned blob unless a new submission re-referenced it
+
+    The file is first moved aside so a concurrent commit_blob installs its
+    own copy instead of linking to one that is about to disappear; it is
+    moved back if the blob document was recreated in the meantime.
+    """
+    doomed_path = f"{path}.{uuid.uuid4().hex}.deleted"
+    try:
+        os.replace(path, doomed_path)
+    except FileNotFoundError:
+        return False
+    if db.collection('blobs').document(file_sha256).get().exists:
+        try:
+            os.link(doomed_path, path)
+        except FileExistsError:
+            pass
+        os.remove(doomed_path)
+        return False
+    os.remove(doomed_path)
+    return True
+
+def find_blob(file_sha256, file_size=None):
+    """Blob document data for content already stored on this server, or None"""
+    file_sha256 = (file_sha256 or '').lower()
+    if not re.fullmatch(r'[0-9a-f]{64}', file_sha256):
+        return None
+    
+    blob_doc = get_identity_map().get('blobs', file_sha256)
+    if not blob_doc.exists:
+        return None
+    
+    blob_data = blob_doc.to_dict()
+    if file_size is not None and str(file_size) != str(blob_data.get('size')):
+        return None
+    if not os.path.exists(blob_path(file_sha256)):
+        return None
+    return blob_data
+
+@firestore.transactional
+def delete_job_and_release_blob(transaction, job_ref):
+    """Delete a job and drop its blob reference in one transaction
+
+    Returns (deleted, orphan_path); orphan_path is the file to remove when
+    this job held the last reference.
+    """
+    job_doc = job_ref.get(transaction=transaction)
+    if not job_doc.exists:
+        return False, None
+    
+    job_data = job_doc.to_dict()
+    orphan_path = None
+    file_sha256 = job_data.get('file_sha256')
+    if file_sha256:
+        blob_ref = db.collection('blobs').document(file_sha256)
+        blob_doc = blob_ref.get(transaction=transaction)
+        if blob_doc.exists and blob_doc.to_dict().get('ref_count', 0) > 1:
+            transaction.update(blob_ref, {'ref_count': firestore.Increment(-1)})
+        elif blob_doc.exists:
+            # Last reference: the file goes only with the blob document
+            transaction.delete(blob_ref)
+            orphan_path = blob_path(file_sha256)
+    elif job_data.get('file_path'):
+        # Uploads from before the blob store are owned by a single job
+        orphan_path = job_data['file_path']
+    
+    transaction.delete(job_ref)
+    stage_version_bump(transaction, 'jobs', student_ids=[job_data.get('student_id')])
+    return True, orphan_path
+
+def delete_job_files(job_ref):
+    """Delete a job and garbage-collect its upload when no other job references it"""
+    deleted, orphan_path = delete_job_and_release_blob(db.transaction(), job_ref)
+    if orphan_path:
+        file_sha256 = os.path.basename(orphan_path)
+        if orphan_path == blob_path(file_sha256):
+            remove_blob_file(orphan_path, file_sha256)
+        elif os.path.exists(orphan_path):
+            os.remove(orphan_path)
+    return deleted
+
+class PdfStructureError(Exception):
+    """Raised when a PDF's cross-reference data cannot be followed"""
+
+
+class PdfPageCounter:
+    """Counts PDF pages from the cross-reference data and the page tree root
+
+    Only the trailer, the xref sections and the catalog and root /Pages
+    objects are read; page content is never loaded, so memory use does not
+    grow with the document. Handles classic xref tables, xref streams
+    (including PNG predictors), hybrid files, incremental updates and
+    objects stored in object streams.
+    """
+
+    TAIL_BYTES = 4096
+    READ_CHUNK = 16 * 1024
+    MAX_OBJECT_BYTES = 4 * 1024 * 1024
+    MAX_XREF_SECTIONS = 64
+
+    STARTXREF_RE = re.compile(rb'startxref\s+(\d+)')
+    SUBSECTION_RE = re.compile(rb'\s*(\d+)\s+(\d+)[ \t]*(?:\r\n|\r|\n)')
+    ENTRY_RE = re.compile(rb'\s*(\d+)\s+(\d+)\s+([nf])')
+    OBJ_HEADER_RE = re.compile(rb'\s*(\d+)\s+(\d+)\s+obj')
+    STREAM_START_RE = re.compile(rb'stream(?:\r\n|\n|\r)')
+    ROOT_RE = re.compile(rb'/Root\s+(\d+)\s+(\d+)\s+R')
+    PAGES_RE = re.compile(rb'/Pages\s+(\d+)\s+(\d+)\s+R')
+    COUNT_RE = re.compile(rb'/Count\s+(\d+)(?:\s+(\d+)\s+R)?')
+    PREV_RE = re.compile(rb'/Prev\s+(\d+)')
+    XREFSTM_RE = re.compile(rb'/XRefStm\s+(\d+)')
+    INT_RE = re.compile(rb'\s*(\d+)')
+
+    def count(self, path):
+        """Return the page count of the PDF at path"""
+        with open(path, 'rb') as f:
+            self._file = f
+            self._sections = []
+            self._root = None
+            self._load_xref()
+            if self._root is None:
+                raise PdfStructureError("No /Root in trailer")
+            
+            catalog = self._read_object(self._root)
+            pages_match = self.PAGES_RE.search(catalog)
+            if not pages_match:
+                raise PdfStructureError("Catalog has no /Pages")
+            
+            pages_node = self._read_object(int(pages_match.group(1)))
+            count_match = self.COUNT_RE.search(pages_node)
+            if not count_match:
+                raise PdfStructureError("Page tree root has no /Count")
+            if count_match.group(2) is not None:
+                # Indirect /Count: the referenced object is a bare integer
+                int_match = self.INT_RE.match(self._read_object(int(count_match.group(1))))
+                if not int_match:
+                    raise PdfStructureError("Indirect /Count is not an integer")
+                return int(int_match.group(1))
+            return int(count_match.group(1))
+
+    # Cross-reference sections
+
+    def _load_xref(self):
+        f = self._file
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - self.TAIL_BYTES))
+        matches = list(self.STARTXREF_RE.finditer(f.read(self.TAIL_BYTES)))
+        if not matches:
+            raise PdfStructureError("No startxref")
+        
+        offset = int(matches[-1].group(1))
+        seen = set()
+        while offset is not None and offset not in seen:
+            if len(self._sections) >= self.MAX_XREF_SECTIONS:
+                raise PdfStructureError("Too many xref sections")
+            seen.add(offset)
+            f.seek(offset)
+            if f.read(32).lstrip().startswith(b'xref'):
+                offset = self._read_xref_table(offset)
+            else:
+                offset = self._read_xref_stream(offset)
+
+    def _read_xref_table(self, offset):
+        f = self._file
+        f.seek(offset)
+        head = f.read(32)
+        position = offset + head.index(b'xref') + len(b'xref')
+        subsections = []
+        while True:
+            f.seek(position)
+            buffer = f.read(64)
+            match = self.SUBSECTION_RE.match(buffer)
+            if not match:
+                break
+            start, count = int(match.group(1)), int(match.group(2))
+            entries_start = position + match.end()
+            subsections.append((start, count, entries_start))
+            # Classic xref entries are exactly 20 bytes each
+            position = entries_start + count * 20
+        
+        f.seek(position)
+        trailer = f.read(self.TAIL_BYTES)
+        if b'trailer' not in trailer:
+            raise PdfStructureError("Missing trailer")
+        trailer = trailer[trailer.index(b'trailer'):]
+        end = trailer.find(b'startxref')
+        if end != -1:
+            trailer = trailer[:end]
+        
+        self._sections.append(('table', subsections))
+        self._note_root(trailer)
+        
+        # Hybrid files carry extra entries in an xref stream
+        xrefstm = self.XREFSTM_RE.search(trailer)
+        if xrefstm:
+            self._read_xref_stream(int(xrefstm.group(1)), follow_prev=False)
+        
+        prev = self.PREV_RE.search(trailer)
+        return int(prev.group(1)) if prev else None
+
+    def _read_xref_stream(self, offset, follow_prev=True):
+        dictionary, data = self._read_stream_at(offset)
+        widths = [int(w) for w in re.search(rb'/W\s*\[([^\]]*)\]', dictionary).group(1).split()]
+        index_match = re.search(rb'/Index\s*\[([^\]]*)\]', dictionary)
+        if index_match:
+            numbers = [int(n) for n in index_match.group(1).split()]
+            ranges = list(zip(numbers[0::2], numbers[1::2]))
+        else:
+            ranges = [(0, int(re.search(rb'/Size\s+(\d+)', dictionary).group(1)))]
+        
+        # Rows are decoded on lookup, like table entries, so only the
+        # (bounded) decoded stream is held rather than one tuple per object
+        row_size = sum(widths)
+        subsections = []
+        position = 0
+        for start, count in ranges:
+            subsections.append((start, count, position))
+            position += count * row_size
+        if len(data) < position:
+            raise PdfStructureError("Truncated xref stream")
+        
+        self._sections.append(('stream', (widths, subsections, data)))
+        self._note_root(dictionary)
+        
+        if not follow_prev:
+            return None
+        prev = self.PREV_RE.search(dictionary)
+        return int(prev.group(1)) if prev else None
+
+    def _note_root(self, dictionary):
+        # The newest section that names a /Root wins
+        if self._root is None:
+            root = self.ROOT_RE.search(dictionary)
+            if root:
+                self._root = int(root.group(1))
+
+    def _locate(self, object_number):
+        """Newest xref entry for an object: ('offset', n) or ('compressed', stream, index)"""
+        for kind, section in self._sections:
+            if kind == 'table':
+                for start, count, entries_start in section:
+                    if start <= object_number < start + count:
+                        self._file.seek(entries_start + (object_number - start) * 20)
+                        match = self.ENTRY_RE.match(self._file.read(20))
+                        if not match:
+                            raise PdfStructureError("Malformed xref entry")
+                        if match.group(3) == b'f':
+                            return None
+                        return ('offset', int(match.group(1)))
+            else:
+                entry = self._stream_entry(section, object_number)
+                if entry is None:
+                    continue
+                entry_type, field_2, field_3 = entry
+                if entry_type == 1:
+                    return ('offset', field_2)
+                if entry_type == 2:
+                    return ('compressed', field_2, field_3)
+                return None
+        return None
+
+    @staticmethod
+    def _stream_entry(section, object_number):
+        """(type, field 2, field 3) of an object's xref stream row, or None"""
+        widths, subsections, data = section
+        row_size = sum(widths)
+        for start, count, position in subsections:
+            if start <= object_number < start + count:
+                cursor = position + (object_number - start) * row_size
+                fields = []
+                for width in widths:
+                    fields.append(int.from_bytes(data[cursor:cursor + width], 'big') if width else None)
+                    cursor += width
+                # A zero-width type field defaults to 1 (in use)
+                return (fields[0] if widths[0] else 1, fields[1], fields[2])
+        return None
+
+    # Objects
+
+    def _read_object(self, object_number):
+        location = self._locate(object_number)
+        if location is None:
+            raise PdfStructureError(f"Object {object_number} not found")
+        if location[0] == 'offset':
+            body = self._read_until(location[1], b'endobj')
+            header = self.OBJ_HEADER_RE.match(body)
+            if not header or int(header.group(1)) != object_number:
+                raise PdfStructureError(f"Object {object_number} not at its xref offset")
+            return body[header.end():]
+        return self._read_compressed_object(location[1], location[2])
+
+    def _read_compressed_object(self, stream_number, index):
+        stream_location = self._locate(stream_number)
+        if stream_location is None or stream_location[0] != 'offset':
+            raise PdfStructureError(f"Object stream {stream_number} not found")
+        dictionary, data = self._read_stream_at(stream_location[1])
+        count = int(re.search(rb'/N\s+(\d+)', dictionary).group(1))
+        first = int(re.search(rb'/First\s+(\d+)', dictionary).group(1))
+        header = [int(n) for n in data[:first].split()[:count * 2]]
+        offsets = header[1::2]
+        if index >= len(offsets):
+            raise PdfStructureError("Object stream index out of range")
+        start = first + offsets[index]
+        end = first + offsets[index + 1] if index + 1 < len(offsets) else len(data)
+        return data[start:end]
+
+    def _read_until(self, offset, terminator):
+        f = self._file
+        f.seek(offset)
+        buffer = b''
+        while terminator not in buffer:
+            chunk = f.read(self.READ_CHUNK)
+            if not chunk or len(buffer) > self.MAX_OBJECT_BYTES:
+                raise PdfStructureError(f"No {terminator.decode()} after offset {offset}")
+            buffer += chunk
+        return buffer[:buffer.index(terminator)]
+
+    def _read_stream_at(self, offset):
+        """Return (dictionary, decoded data) of the stream object at offset"""
+        raw = self._read_until(offset, b'endstream')
+        start = self.STREAM_START_RE.search(raw)
+        if not start:
+            raise PdfStructureError(f"No stream at offset {offset}")
+        dictionary = raw[:start.start()]
+        data = raw[start.end():]
+        
+        filters = re.search(rb'/Filter\s*(\[[^\]]*\]|/\w+)', dictionary)
+        if filters:
+            names = re.findall(rb'/(\w+)', filters.group(1))
+            if names != [b'FlateDecode']:
+                raise PdfStructureError(f"Unsupported stream filter {names}")
+            decompressor = zlib.decompressobj()
+            try:
+                data = decompressor.decompress(data, self.MAX_OBJECT_BYTES)
+            except zlib.error as e:
+                raise PdfStructureError(f"Corrupt stream at offset {offset}: {e}")
+            if decompressor.unconsumed_tail:
+                raise PdfStructureError(f"Stream at offset {offset} inflates beyond {self.MAX_OBJECT_BYTES} bytes")
+        
+        predictor = re.search(rb'/Predictor\s+(\d+)', dictionary)
+        if predictor and int(predictor.group(1)) >= 10:
+            columns = re.search(rb'/Columns\s+(\d+)', dictionary)
+            data = self._undo_png_predictor(data, int(columns.group(1)) if columns else 1)
+        return dictionary, data
+
+    @staticmethod
+    def _undo_png_predictor(data, columns):
+        rows = []
+        previous = bytearray(columns)
+        for row_start in range(0, len(data) - columns, columns + 1):
+            filter_type = data[row_start]
+            row = bytearray(data[row_start + 1:row_start + 1 + columns])
+            for i in range(len(row)):
+                left = row[i - 1] if i else 0
+                up = previous[i]
+                upper_left = previous[i - 1] if i else 0
+                if filter_type == 1:
+                    row[i] = (row[i] + left) & 0xFF
+                elif filter_type == 2:
+                    row[i] = (row[i] + up) & 0xFF
+                elif filter_type == 3:
+                    row[i] = (row[i] + (left + up) // 2) & 0xFF
+                elif filter_type == 4:
+                    estimate = left + up - upper_left
+                    distances = (abs(estimate - left), abs(estimate - up), abs(estimate - upper_left))
+                    row[i] = (row[i] + (left, up, upper_left)[distances.index(min(distances))]) & 0xFF
+            rows.append(bytes(row))
+            previous = row
+        return b''.join(rows)
+
+
+class PageCountCache:
+    """LRU of PDF page counts keyed by content hash"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+
+    def get(self, file_sha256):
+        with self._lock:
+            if file_sha256 in self._entries:
+                self._entries.move_to_end(file_sha256)
+                self.hits += 1
+                return self._entries[file_sha256]
+            self.misses += 1
+            return None
+
+    def put(self, file_sha256, pages):
+        with self._lock:
+            self._entries[file_sha256] = pages
+            self._entries.move_to_end(file_sha256)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'failures': self.failures
+            }
+
+page_count_cache = PageCountCache(max_entries=4096)
+
+def count_pdf_pages(path, file_sha256):
+    """Server-side page count for a PDF upload, or None if it cannot be determined"""
+    pages = page_count_cache.get(file_sha256)
+    if pages is not None:
+        return pages
+    
+    try:
+        pages = run_blocking(PdfPageCounter().count, path)
+    except Exception as e:
+        page_count_cache.record_failure()
+        logger.warning(f"Could not count pages of {file_sha256}: {e}")
+        return None
+    
+    if pages > 0:
+        page_count_cache.put(file_sha256, pages)
+        return pages
+    return None
+
+class JobSubmissionError(Exception):
+    """Raised inside the submission transaction to abort it with an HTTP status"""
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+@firestore.transactional
+def debit_and_create_job(transaction, student_id, job_data, require_blob=False):
+    """Debit the wallet and create the job in one atomic commit
+
+    The transactional read of the student makes concurrent submissions for
+    the same student serialise on the balance check; the debit itself is a
+    server-side increment. With require_blob the job references content
+    that was not uploaded in this request, so the blob must still exist.
+    Returns (student_data, new_balance).
+    """
+    student_ref = db.collection('students').document(student_id)
+    student_doc = student_ref.get(transaction=transaction)
+    if not student_doc.exists:
+        raise JobSubmissionError('Student not found', 404)
+    
+    if require_blob:
+        blob_doc = db.collection('blobs').document(job_data['file_sha256']).get(transaction=transaction)
+        if not blob_doc.exists:
+            raise JobSubmissionError('File is no longer on the server, please upload it again', 409)
+    
+    student_data = student_doc.to_dict()
+    balance = student_data.get('wallet_balance', 0)
+    if balance < job_data['total_cost']:
+        raise JobSubmissionError('Insufficient wallet balance', 400)
+    
+    job_data['student_email'] = student_data['email']
+    job_data['student_name'] = student_data['username']
+    
+    transaction.update(student_ref, {
+        'wallet_balance': firestore.Increment(-job_data['total_cost']),
+        'total_jobs': firestore.Increment(1)
+    })
+    transaction.create(db.collection('jobs').document(job_data['id']), job_data)
+    
+    # Reference count of the content-addressed upload this job points at
+    if job_data.get('file_sha256'):
+        blob_data = {
+            'path': job_data['file_path'],
+            'size': job_data['file_size'],
+            'ref_count': firestore.Increment(1),
+            'last_referenced_at': datetime.datetime.now()
+        }
+        if job_data.get('page_count_source') == 'server':
+            blob_data['pages'] = job_data['pages']
+        transaction.set(db.collection('blobs').document(job_data['file_sha256']), blob_data, merge=True)
+    
+    stage_version_bump(transaction, 'jobs', student_ids=[student_id])
+    return student_data, round(balance - job_data['total_cost'], 2)
+
+
+class PrincipalCache:
+    """In-process TTL + LRU cache of validated principals, keyed by token"""
+
+    def __init__(self, ttl_seconds, max_entries):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # token -> (expires_at, principal)
+        self._tokens_by_user = {}  # user_id -> {token, ...}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, token):
+        """Return a copy of the cached principal, or None on miss/expiry"""
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, principal = entry
+            if expires_at <= time.monotonic():
+                self._discard(token)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return dict(principal)
+
+    def put(self, token, principal):
+        with self._lock:
+            if token in self._entries:
+                self._discard(token)
+            self._entries[token] = (time.monotonic() + self.ttl_seconds, dict(principal))
+            self._tokens_by_user.setdefault(principal['user_id'], set()).add(token)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._discard(oldest)
+                self.evictions += 1
+
+    def invalidate_user(self, user_id):
+        """Drop every cached principal for a user whose document changed"""
+        with self._lock:
+            for token in list(self._tokens_by_user.get(user_id, ())):
+                self._discard(token)
+                self.invalidations += 1
+
+    def _discard(self, token):
+        expires_at, principal = self._entries.pop(token)
+        tokens = self._tokens_by_user.get(principal['user_id'])
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[principal['user_id']]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'ttl_seconds': self.ttl_seconds,
+                'max_entries': self.max_entries
+            }
+
+principal_cache = PrincipalCache(AUTH_CACHE_CONFIG['ttl_seconds'], AUTH_CACHE_CONFIG['max_entries'])
+
+
+class TokenRevocations:
+    """Per-user token generations, kept current by a snapshot listener
+
+    Signed tokens carry the generation their user had when they were
+    issued; revoking a user bumps it, which refuses every older token on
+    every worker once the listener delivers the change. Only revoked users
+    have a document, so the whole collection stays in memory and signed
+    tokens are verified without a read. That the user still exists is
+    checked in the background, at most once per check interval, and a
+    user found missing is revoked.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self._lock = threading.RLock()
+        self._generations = {}  # user_id -> current generation
+        self._checked = {}  # user_id -> monotonic time of the last existence check
+        self._watch = None
+        self._ready = threading.Event()
+        self._executor = ThreadPoolExecutor(max_workers=config['check_workers'], thread_name_prefix='token-check')
+        self.snapshots = 0
+        self.revoked = 0
+        self.checks = 0
+
+    def ensure_started(self):
+        if not self.config['enabled']:
+            return False
+        with self._lock:
+            if self._watch is None:
+                self._watch = db.collection(self.config['collection']).on_snapshot(self._on_snapshot)
+        return True
+
+    def live(self):
+        return self.ensure_started() and self._ready.is_set()
+
+    def _on_snapshot(self, docs, changes, read_time):
+        generations = {doc.id: doc.to_dict().get('generation', 0) for doc in docs}
+        with self._lock:
+            # Keep local bumps the listener has not delivered yet
+            for user_id, generation in self._generations.items():
+                generations[user_id] = max(generation, generations.get(user_id, 0))
+            self._generations = generations
+            self.snapshots += 1
+        self._ready.set()
+
+    def generation(self, user_id):
+        """The user's current generation, from memory once the listener is live"""
+        if self.live():
+            with self._lock:
+                return self._generations.get(user_id, 0)
+        doc = db.collection(self.config['collection']).document(user_id).get()
+        return doc.to_dict().get('generation', 0) if doc.exists else 0
+
+    def is_revoked(self, user_id, generation):
+        with self._lock:
+            return generation < self._generations.get(user_id, 0)
+
+    def revoke(self, user_id):
+        """Refuse every token issued to the user so far"""
+        db.collection(self.config['collection']).document(user_id).set({
+            'generation': firestore.Increment(1),
+            'revoked_at': datetime.datetime.now()
+        }, merge=True)
+        with self._lock:
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            self.revoked += 1
+        principal_cache.invalidate_user(user_id)
+
+    def check_user_later(self, user_type, user_id):
+        """Queue a check that the user still exists, unless one ran recently"""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._checked.get(user_id, float('-inf')) < self.config['check_interval']:
+                return
+            if len(self._checked) >= self.config['max_checked']:
+                self._checked.clear()
+            self._checked[user_id] = now
+        self._executor.submit(self._check_user, user_type, user_id)
+
+    def _check_user(self, user_type, user_id):
+        try:
+            collection = 'students' if user_type == 'student' else 'admins'
+            with self._lock:
+                self.checks += 1
+            if not db.collection(collection).document(user_id).get().exists:
+                logger.warning(f"Revoking tokens of missing {user_type} {user_id}")
+                self.revoke(user_id)
+        except Exception as e:
+            logger.warning(f"Token user check for {user_id} failed: {e}")
+            with self._lock:
+                self._checked.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.config['enabled'],
+                'ready': self._ready.is_set(),
+                'revoked_users': len(self._generations),
+                'snapshots': self.snapshots,
+                'revoked': self.revoked,
+                'checks': self.checks
+            }
+
+token_revocations = TokenRevocations(TOKEN_REVOCATION_CONFIG)
+
+
+class HashPoolBusyError(Exception):
+    """Raised when the password hash pool queue is full"""
+
+
+class PasswordHasher:
+    """Bounded worker pool for password hashing and verification"""
+
+    def __init__(self, max_workers, max_queue, timeout_seconds):
+        self.timeout_seconds = timeout_seconds
+        if gevent_active():
+            # Patched threads are greenlets; hashing must run on real OS threads off the event loop
+            from gevent.threadpool import ThreadPoolExecutor as NativeThreadPoolExecutor
+            self._executor = NativeThreadPoolExecutor(max_workers=max_workers)
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='pwhash')
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.running = 0
+        self.rejected = 0
+        self.verifications = 0
+        self.verify_seconds_total = 0.0
+        self.verify_seconds_max = 0.0
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise HashPoolBusyError("Password hashing queue is full")
+        
+        with self._lock:
+            self.in_flight += 1
+        
+        def task():
+            with self._lock:
+                self.running += 1
+            try:
+                return fn(*args)
+            finally:
+                with self._lock:
+                    self.running -= 1
+        
+        def finished(future):
+            # Runs when the hash really ends, so a caller that timed out keeps its slot taken
+            with self._lock:
+                self.in_flight -= 1
+            self._slots.release()
+        
+        try:
+            future = self._executor.submit(task)
+        except Exception:
+            finished(None)
+            raise
+        future.add_done_callback(finished)
+        return future.result(timeout=self.timeout_seconds)
+
+    def verify(self, pwhash, password):
+        started = time.perf_counter()
+        result = self._run(check_password_hash, pwhash, password)
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.verifications += 1
+            self.verify_seconds_total += elapsed
+            self.verify_seconds_max = max(self.verify_seconds_max, elapsed)
+        return result
+
+    def hash(self, password, method):
+        return self._run(generate_password_hash, password, method)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max_workers': self.max_workers,
+                'max_queue': self.max_queue,
+                'in_flight': self.in_flight,
+                'queue_depth': max(self.in_flight - self.running, 0),
+                'rejected': self.rejected,
+                'verifications': self.verifications,
+                'verify_avg_ms': round(self.verify_seconds_total / self.verifications * 1000, 2) if self.verifications else 0.0,
+                'verify_max_ms': round(self.verify_seconds_max * 1000, 2)
+            }
+
+password_hasher = PasswordHasher(
+    PASSWORD_HASH_CONFIG['max_workers'],
+    PASSWORD_HASH_CONFIG['max_queue'],
+    PASSWORD_HASH_CONFIG['timeout_seconds']
+)
+
+
+class TokenBucketThrottle:
+    """In-memory token buckets keyed by an arbitrary string (email, IP)
+
+    Each bucket keeps the capacity and refill rate it was last used with,
+    so keys under different policies can share one throttle.
+    """
+
+    def __init__(self, max_keys=50000):
+        self.max_keys = max_keys
+        self._buckets = {}  # key -> (tokens, last_refill, capacity, refill_rate)
+        self._lock = threading.Lock()
+        self.throttled = 0
+
+    def available(self, key, capacity, window_seconds):
+        """True if a token could be taken now; nothing is taken"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last_refill, _, _ = self._buckets.get(key, (capacity, now, capacity, 0))
+            return tokens + (now - last_refill) * capacity / float(window_seconds) >= 1
+
+    def allow(self, key, capacity, window_seconds):
+        """Take one token; buckets refill to capacity over window_seconds"""
+        now = time.monotonic()
+        refill_rate = capacity / float(window_seconds)
+        with self._lock:
+            tokens, last_refill, _, _ = self._buckets.get(key, (capacity, now, capacity, refill_rate))
+            tokens = min(capacity, tokens + (now - last_refill) * refill_rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now, capacity, refill_rate)
+                self.throttled += 1
+                return False
+            self._buckets[key] = (tokens - 1, now, capacity, refill_rate)
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+            return True
+
+    def _prune(self, now):
+        # Buckets that would be full again carry no state worth keeping
+        for key, (tokens, last_refill, capacity, refill_rate) in list(self._buckets.items()):
+            if tokens + (now - last_refill) * refill_rate >= capacity:
+                del self._buckets[key]
+
+    def stats(self):
+        with self._lock:
+            return {'tracked_keys': len(self._buckets), 'throttled': self.throttled}
+
+login_throttle = TokenBucketThrottle()
+
+
+_settings_cache = {'settings': None, 'loaded_at': 0.0}
+SETTINGS_CACHE_TTL = 30
+
+def get_system_settings():
+    """System settings merged over the defaults, cached briefly in-process"""
+    if _settings_cache['settings'] and time.monotonic() - _settings_cache['loaded_at'] < SETTINGS_CACHE_TTL:
+        return _settings_cache['settings']
+    
+    settings = copy.deepcopy(DEFAULT_SETTINGS)
+    try:
+        settings_doc = db.collection('settings').document('system').get()
+        if settings_doc.exists:
+            stored = settings_doc.to_dict()
+            for key, value in stored.items():
+                if isinstance(value, dict) and isinstance(settings.get(key), dict):
+                    settings[key].update(value)
+                else:
+                    settings[key] = value
+    except Exception as e:
+        logger.warning(f"Falling back to default settings: {e}")
+    
+    _settings_cache['settings'] = settings
+    _settings_cache['loaded_at'] = time.monotonic()
+    return settings
+
+def invalidate_settings_cache():
+    _settings_cache['settings'] = None
+
+def get_client_ip():
+    # ProxyFix has already replaced remote_addr with the address our proxy saw
+    return request.remote_addr or 'unknown'
+
+
+# Collections whose reads are served with ETags; every write to them bumps a version counter
+VERSIONED_COLLECTIONS = ('jobs', 'printers', 'settings')
+COLLECTION_VERSIONS = 'collection_versions'
+
+def collection_version_ref(collection, shard=0):
+    # Shard 0 is the collection's original counter document
+    document_id = f"{collection}-{shard}" if shard else collection
+    return db.collection(COLLECTION_VERSIONS).document(document_id)
+
+def student_version_ref(collection, student_id):
+    return db.collection(COLLECTION_VERSIONS).document(collection).collection('students').document(student_id)
+
+def version_bump_refs(collections, student_ids=()):
+    """Counter documents one write to the collections bumps
+
+    Each write picks one shard at random, so concurrent writers rarely
+    contend on the same counter; the version is the sum over the shards.
+    """
+    refs = []
+    for collection in collections:
+        refs.append(collection_version_ref(collection, random.randrange(VERSION_COUNTER_CONFIG['shards'].get(collection, 1))))
+        if collection in VERSION_COUNTER_CONFIG['per_student']:
+            refs.extend(student_version_ref(collection, student_id) for student_id in set(student_ids) if student_id)
+    return refs
+
+def stage_version_bump(writer, *collections, student_ids=()):
+    """Add version bumps to a batch or transaction so they commit with the write
+
+    Pass the students whose jobs are written so their own job lists
+    revalidate; other students keep their ETags.
+    """
+    for ref in version_bump_refs(collections, student_ids):
+        writer.set(ref, {'version': firestore.Increment(1)}, merge=True)
+
+def bump_collection_versions(*collections):
+    for ref in version_bump_refs(collections):
+        ref.set({'version': firestore.Increment(1)}, merge=True)
+
+def get_collection_versions(*collections, student_id=None):
+    """Current version of each collection, from one get_all over its counters
+
+    With student_id, per-student collections report that student's counter
+    instead. A live printer registry supplies the printers version without
+    a read.
+    """
+    versions = {}
+    if 'printers' in collections and printer_registry.live():
+        versions['printers'] = printer_registry.version
+    refs = []
+    owners = {}  # counter path -> collection
+    for collection in collections:
+        if collection in versions:
+            continue
+        if student_id is not None and collection in VERSION_COUNTER_CONFIG['per_student']:
+            counters = [student_version_ref(collection, student_id)]
+        else:
+            counters = [collection_version_ref(collection, shard)
+                        for shard in range(VERSION_COUNTER_CONFIG['shards'].get(collection, 1))]
+        for ref in counters:
+            refs.append(ref)
+            owners[ref.path] = collection
+    if refs:
+        for snapshot in db.get_all(refs):
+            collection = owners[snapshot.reference.path]
+            version = (snapshot.to_dict() or {}).get('version', 0) if snapshot.exists else 0
+            versions[collection] = versions.get(collection, 0) + version
+    return [versions.get(collection, 0) for collection in collections]
+
+
+class DocumentIdentityMap:
+    """Request-scoped map of loaded documents, plus writes staged for one batch commit"""
+
+    def __init__(self):
+        self._snapshots = {}  # (collection, doc_id) -> snapshot
+        self._writes = []  # (operation, reference, data, option)
+        self._job_students = {}  # job_id -> student_id of staged job writes, for version bumps
+        self.reads = 0
+        self.hits = 0
+
+    def seed(self, collection, snapshot):
+        self._snapshots[(collection, snapshot.id)] = snapshot
+
+    def get(self, collection, doc_id):
+        """Return the snapshot for a document, reading Firestore at most once per request"""
+        key = (collection, doc_id)
+        if key in self._snapshots:
+            self.hits += 1
+            return self._snapshots[key]
+        
+        self.reads += 1
+        snapshot = db.collection(collection).document(doc_id).get()
+        self._snapshots[key] = snapshot
+        return snapshot
+
+    def stage_update(self, collection, doc_id, data, option=None):
+        """Stage an update; option is a write precondition that fails the whole batch when unmet"""
+        self._stage('update', collection, doc_id, data, option)
+
+    def stage_set(self, collection, doc_id, data):
+        self._stage('set', collection, doc_id, data)
+
+    def _stage(self, operation, collection, doc_id, data, option=None):
+        self._writes.append((operation, db.collection(collection).document(doc_id), data, option))
+        # The stored snapshot no longer reflects the document once it is written
+        snapshot = self._snapshots.pop((collection, doc_id), None)
+        if collection == 'jobs' and doc_id not in self._job_students:
+            if snapshot is not None and snapshot.exists:
+                self._job_students[doc_id] = (snapshot.to_dict() or {}).get('student_id')
+            else:
+                self._job_students[doc_id] = (data or {}).get('student_id')
+
+    @property
+    def pending_writes(self):
+        return len(self._writes)
+
+    def flush(self):
+        """Commit every staged write in a single batch"""
+        if not self._writes:
+            return
+        
+        batch = db.batch()
+        for operation, reference, data, option in self._writes:
+            if option is not None:
+                getattr(batch, operation)(reference, data, option=option)
+            else:
+                getattr(batch, operation)(reference, data)
+        touched = {reference.parent.id for _, reference, _, _ in self._writes}
+        # Jobs staged without loading them first are looked up once here
+        unknown = [db.collection('jobs').document(job_id) for job_id, student_id in self._job_students.items() if not student_id]
+        for snapshot in db.get_all(unknown) if unknown else ():
+            if snapshot.exists:
+                self._job_students[snapshot.id] = (snapshot.to_dict() or {}).get('student_id')
+        stage_version_bump(batch, *sorted(touched.intersection(VERSIONED_COLLECTIONS)),
+                           student_ids=self._job_students.values())
+        try:
+            batch.commit()
+        finally:
+            # A failed batch wrote nothing; its writes are not retried
+            self._writes = []
+            self._job_students = {}
+
+def get_identity_map():
+    if 'identity_map' not in g:
+        g.identity_map = DocumentIdentityMap()
+    return g.identity_map
+
+def json_default(obj):
+    """Encode the types neither JSON encoder handles natively"""
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        # Firestore returns DatetimeWithNanoseconds, a datetime subclass orjson rejects
+        return obj.isoformat()
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+class PrintQJSONProvider(DefaultJSONProvider):
+    """JSON provider that encodes with orjson when it is installed
+
+    Timestamps come out as ISO 8601 on both paths, so handlers can return
+    Firestore documents as they are.
+    """
+
+    default = staticmethod(json_default)
+    orjson_options = (orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS) if orjson else 0
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=json_default, option=self.orjson_options).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is None:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        # The encoded bytes become the body directly, without a str round trip
+        body = orjson.dumps(obj, default=json_default, option=self.orjson_options | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+app.json = PrintQJSONProvider(app)
+
+@app.after_request
+def compress_json_response(response):
+    """Gzip large JSON bodies for clients that accept it"""
+    if (response.mimetype != 'application/json' or response.status_code != 200
+            or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers):
+        return response
+    
+    data = response.get_data()
+    if len(data) < JSON_RESPONSE_CONFIG['gzip_min_bytes']:
+        return response
+    
+    response.vary.add('Accept-Encoding')
+    if 'gzip' not in request.accept_encodings:
+        return response
+    
+    response.set_data(gzip.compress(data, compresslevel=JSON_RESPONSE_CONFIG['gzip_level']))
+    response.headers['Content-Encoding'] = 'gzip'
+    # A different encoding is a different representation, so it needs its own tag
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f"{etag}-gzip", weak)
+    return response
+
+@app.teardown_request
+def discard_identity_map(error=None):
+    identity_map = g.pop('identity_map', None)
+    if identity_map is not None and identity_map.pending_writes:
+        logger.warning(f"Discarding {identity_map.pending_writes} unflushed writes for {request.path}")
+
 
 # Serve student page
 @app.route('/')
@@ -969,6 +3674,119 @@ def student_home():
 def admin_home():
     return render_template('admin.html')
 
+def _b64url_encode(raw):
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def _b64url_decode(value):
+    return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+
+def _sign_token_payload(encoded_payload, version=None):
+    """HMAC-SHA256 over the versioned, encoded token payload"""
+    message = f"{version or AUTH_TOKEN_CONFIG['version']}.{encoded_payload}".encode()
+    digest = hmac.new(app.config['SECRET_KEY'].encode(), message, hashlib.sha256).digest()
+    return _b64url_encode(digest)
+
+class TokenSigningUnavailableError(Exception):
+    """Raised when a token must be signed but SECRET_KEY is not set"""
+
+def issue_token(user_type, user_id):
+    """Mint a signed, expiring token: v2.<base64 payload>.<signature>
+
+    The payload carries the user's revocation generation, so the token
+    stops verifying once the user is revoked.
+
+    Without a SECRET_KEY from the environment nothing is signed; the
+    legacy token format is issued instead while it is still accepted.
+    """
+    if not app.config['SECRET_KEY']:
+        if AUTH_TOKEN_CONFIG['accept_legacy']:
+            return f"{user_type}_{user_id}_{int(time.time())}"
+        raise TokenSigningUnavailableError()
+    issued_at = int(time.time())
+    expires_at = issued_at + AUTH_TOKEN_CONFIG['ttl_seconds']
+    generation = token_revocations.generation(user_id)
+    payload = f"{user_type}:{user_id}:{generation}:{issued_at}:{expires_at}"
+    encoded_payload = _b64url_encode(payload.encode())
+    return f"{AUTH_TOKEN_CONFIG['version']}.{encoded_payload}.{_sign_token_payload(encoded_payload)}"
+
+def verify_signed_token(token):
+    """Check a signed token's signature and expiry and return its claims"""
+    if not app.config['SECRET_KEY']:
+        return None, "Signed tokens are disabled on this server"
+    
+    try:
+        version, encoded_payload, signature = token.split('.')
+    except ValueError:
+        return None, "Invalid token format"
+    
+    if version not in ('v1', 'v2'):
+        return None, "Unsupported token version"
+    
+    if not hmac.compare_digest(signature, _sign_token_payload(encoded_payload, version)):
+        return None, "Invalid token signature"
+    
+    try:
+        user_type, rest = _b64url_decode(encoded_payload).decode().split(':', 1)
+        if version == 'v1':
+            # Issued before revocation generations; resolved through Firestore instead
+            user_id, issued_at, expires_at = rest.rsplit(':', 2)
+            generation = None
+        else:
+            user_id, generation, issued_at, expires_at = rest.rsplit(':', 3)
+            generation = int(generation)
+        issued_at, expires_at = int(issued_at), int(expires_at)
+    except ValueError:
+        return None, "Invalid token payload"
+    
+    if user_type not in ['student', 'admin']:
+        return None, "Invalid user type"
+    
+    if expires_at <= time.time():
+        return None, "Token expired"
+    
+    return {
+        'user_type': user_type,
+        'user_id': user_id,
+        'generation': generation,
+        'issued_at': issued_at,
+        'expires_at': expires_at
+    }, None
+
+def authorize_signed_token(token, claims):
+    """Resolve verified claims to a principal, in CPU while revocations are live
+
+    A revoked generation is refused; otherwise the user's existence is
+    checked in the background. v1 tokens, and any token while the
+    revocation listener is not yet live, read the user document instead.
+    """
+    if claims['generation'] is None or not token_revocations.live():
+        return load_principal(token, claims['user_type'], claims['user_id'], claims)
+    if token_revocations.is_revoked(claims['user_id'], claims['generation']):
+        return None, "Token revoked, please log in again"
+    token_revocations.check_user_later(claims['user_type'], claims['user_id'])
+    return dict(claims), None
+
+def load_principal(token, user_type, user_id, claims=None):
+    """Resolve a token's user through the principal cache
+
+    A miss reads the user document, so deleted users and admins whose
+    admin document is gone are refused within the cache TTL.
+    """
+    cached = principal_cache.get(token)
+    if cached:
+        return cached, None
+    
+    collection = 'students' if user_type == 'student' else 'admins'
+    user_doc = db.collection(collection).document(user_id).get()
+    
+    if not user_doc.exists:
+        return None, "User not found"
+    
+    principal = dict(claims or {}, user_type=user_type, user_id=user_id, user_data=user_doc.to_dict())
+    principal_cache.put(token, principal)
+    # Freshly read snapshot, handed to the request's identity map (never cached)
+    return dict(principal, user_doc=user_doc), None
+
 def validate_token(auth_header):
     """Validate authentication token"""
     try:
@@ -980,7 +3798,16 @@ def validate_token(auth_header):
         
         token = auth_header[7:]  # Remove 'Bearer '
         
-        # Parse custom token format: student_<id>_<timestamp> or admin_<id>_<timestamp>
+        if token.startswith(('v1.', 'v2.')):
+            claims, error = verify_signed_token(token)
+            if error:
+                return None, error
+            return authorize_signed_token(token, claims)
+        
+        if not AUTH_TOKEN_CONFIG['accept_legacy']:
+            return None, "Legacy token no longer accepted, please log in again"
+        
+        # Parse legacy token format: student_<id>_<timestamp> or admin_<id>_<timestamp>
         parts = token.split('_')
         if len(parts) < 3:
             return None, "Invalid token format"
@@ -992,18 +3819,7 @@ def validate_token(auth_header):
         if user_type not in ['student', 'admin']:
             return None, "Invalid user type"
         
-        # Check if user exists
-        collection = 'students' if user_type == 'student' else 'admins'
-        user_doc = db.collection(collection).document(user_id).get()
-        
-        if not user_doc.exists:
-            return None, "User not found"
-        
-        return {
-            'user_type': user_type,
-            'user_id': user_id,
-            'user_data': user_doc.to_dict()
-        }, None
+        return load_principal(token, user_type, user_id)
     
     except Exception as e:
         logger.error(f"Token validation error: {e}")
@@ -1021,12 +3837,76 @@ def require_auth(f):
         if error:
             return jsonify({'success': False, 'message': error}), 401
         
+        # Reuse a user document read during validation for the rest of the request
+        user_doc = auth_data.pop('user_doc', None)
+        if user_doc is not None:
+            collection = 'students' if auth_data['user_type'] == 'student' else 'admins'
+            get_identity_map().seed(collection, user_doc)
+        
         # Add auth data to request context
         request.auth = auth_data
         return f(*args, **kwargs)
     
     return decorated_function
 
+def conditional_get(*collections, per_student=False):
+    """Serve 304 Not Modified while the given collections are unchanged
+
+    The strong ETag is derived from the request path and query plus the
+    collections' version counters, so a matching If-None-Match is answered
+    without running the view or scanning Firestore. Gzipped bodies carry
+    the same tag with a -gzip suffix, which matches as well. With
+    per_student the view's student_id argument selects that student's
+    counters, so other students' writes leave its ETag valid.
+    """
+    from functools import wraps
+    
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            try:
+                student_id = kwargs.get('student_id') if per_student else None
+                versions = get_collection_versions(*collections, student_id=student_id)
+            except Exception as e:
+                logger.warning(f"Collection version lookup failed: {e}")
+                return f(*args, **kwargs)
+            
+            source = f"{request.full_path}|" + ','.join(f"{c}:{v}" for c, v in zip(collections, versions))
+            etag = hashlib.sha256(source.encode()).hexdigest()[:32]
+            
+            if request.if_none_match.contains(etag) or request.if_none_match.contains(f"{etag}-gzip"):
+                response = app.response_class(status=304)
+            else:
+                response = app.make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            
+            response.set_etag(etag)
+            # Clients may keep the body but must revalidate before reusing it
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        
+        return decorated_function
+    
+    return decorator
+
+def verify_password(user_doc, password, security):
+    """Check a password in the hash pool, upgrading the stored hash if its cost is outdated"""
+    stored_hash = user_doc.to_dict().get('password')
+    if not stored_hash or not password or not password_hasher.verify(stored_hash, password):
+        return False
+    
+    target_method = security.get('password_hash_method')
+    if target_method and stored_hash.split('$', 1)[0] != target_method:
+        try:
+            user_doc.reference.update({'password': password_hasher.hash(password, target_method)})
+            principal_cache.invalidate_user(user_doc.id)
+            logger.info(f"Rehashed password for {user_doc.id} with {target_method}")
+        except Exception as e:
+            logger.warning(f"Password rehash failed for {user_doc.id}: {e}")
+    
+    return True
+
 # API Routes
 
 @app.route('/api/auth/login', methods=['POST'])
@@ -1038,36 +3918,40 @@ def login():
     user_type = data.get('user_type', 'student')  # 'student' or 'admin'
     
     try:
+        security = get_system_settings()['security']
+        window = security['login_window_seconds']
+        email_key = f"email:{str(email or '').strip().lower()}"
+        # Every attempt costs the IP; only failed ones cost the account, so others can't lock it out
+        if not login_throttle.available(email_key, security['max_login_attempts'], window) or \
+                not login_throttle.allow(f"ip:{get_client_ip()}", security['max_login_attempts_per_ip'], window):
+            return jsonify({'success': False, 'message': 'Too many login attempts, please try again later'}), 429
+        
         if user_type == 'admin':
             # Admin login
-            admins_ref = db.collection('admins')
-            admin_query = admins_ref.where('email', '==', email).limit(1)
-            docs = admin_query.get()
+            admin_doc = lookup_user('admins', 'email', email) if email else None
             
-            if docs and check_password_hash(docs[0].to_dict()['password'], password):
-                admin_data = docs[0].to_dict()
+            if admin_doc and verify_password(admin_doc, password, security):
+                admin_data = admin_doc.to_dict()
                 return jsonify({
                     'success': True,
                     'user': {
-                        'id': docs[0].id,
+                        'id': admin_doc.id,
                         'email': admin_data['email'],
                         'username': admin_data['username'],
                         'type': 'admin'
                     },
-                    'token': f"admin_{docs[0].id}_{int(time.time())}"
+                    'token': issue_token('admin', admin_doc.id)
                 })
         else:
             # Student login
-            students_ref = db.collection('students')
-            student_query = students_ref.where('email', '==', email).limit(1)
-            docs = student_query.get()
+            student_doc = lookup_user('students', 'email', email) if email else None
             
-            if docs and check_password_hash(docs[0].to_dict()['password'], password):
-                student_data = docs[0].to_dict()
+            if student_doc and verify_password(student_doc, password, security):
+                student_data = student_doc.to_dict()
                 return jsonify({
                     'success': True,
                     'user': {
-                        'id': docs[0].id,
+                        'id': student_doc.id,
                         'email': student_data['email'],
                         'username': student_data['username'],
                         'student_id': student_data['student_id'],
@@ -1075,11 +3959,17 @@ def login():
                         'eco_points': student_data.get('eco_points', 0),
                         'type': 'student'
                     },
-                    'token': f"student_{docs[0].id}_{int(time.time())}"
+                    'token': issue_token('student', student_doc.id)
                 })
         
+        login_throttle.allow(email_key, security['max_login_attempts'], window)
         return jsonify({'success': False, 'message': 'Invalid credentials'}), 401
     
+    except HashPoolBusyError:
+        return jsonify({'success': False, 'message': 'Login is busy, please try again shortly'}), 503
+    except TokenSigningUnavailableError:
+        logger.error("Login refused: SECRET_KEY is not set and legacy tokens are disabled")
+        return jsonify({'success': False, 'message': 'Login is unavailable, please contact an administrator'}), 503
     except Exception as e:
         logger.error(f"Login error: {e}")
         return jsonify({'success': False, 'message': 'Login failed'}), 500
@@ -1098,22 +3988,20 @@ def register():
             if admin_code != 'PRINTQ2024ADMIN':  # Change this to your desired admin code
                 return jsonify({'success': False, 'message': 'Invalid admin code'}), 400
             
-            # Check if admin email already exists
-            admins_ref = db.collection('admins')
-            existing = admins_ref.where('email', '==', data['email']).get()
-            if existing:
-                return jsonify({'success': False, 'message': 'Admin email already exists'}), 400
-            
             admin_data = {
                 'id': str(uuid.uuid4()),
                 'username': data['username'],
                 'email': data['email'],
-                'password': generate_password_hash(data['password']),
+                'password': password_hasher.hash(data['password'], get_system_settings()['security']['password_hash_method']),
                 'created_at': datetime.datetime.now(),
                 'is_default': False
             }
             
-            admins_ref.document(admin_data['id']).set(admin_data)
+            # Claims the email in the user index; fails if it already exists
+            try:
+                create_user_with_index(db.transaction(), 'admins', admin_data)
+            except DuplicateUserKeyError:
+                return jsonify({'success': False, 'message': 'Admin email already exists'}), 400
             
             return jsonify({
                 'success': True,
@@ -1121,25 +4009,14 @@ def register():
                 'user_id': admin_data['id']
             })
         
-        else:
-            # Student registration
-            students_ref = db.collection('students')
-            
-            # Check if email or student_id already exists
-            existing_email = students_ref.where('email', '==', data['email']).get()
-            existing_student_id = students_ref.where('student_id', '==', data['student_id']).get()
-            
-            if existing_email:
-                return jsonify({'success': False, 'message': 'Email already exists'}), 400
-            if existing_student_id:
-                return jsonify({'success': False, 'message': 'Student ID already exists'}), 400
-            
+        else:
+            # Student registration
             student_data = {
                 'id': str(uuid.uuid4()),
                 'username': data['username'],
                 'email': data['email'],
                 'student_id': data['student_id'],
-                'password': generate_password_hash(data['password']),
+                'password': password_hasher.hash(data['password'], get_system_settings()['security']['password_hash_method']),
                 'wallet_balance': 0.0,
                 'eco_points': 0,
                 'total_jobs': 0,
@@ -1151,10 +4028,15 @@ def register():
                 'auto_duplex': True
             }
             
-            students_ref.document(student_data['id']).set(student_data)
+            # Claims email and student_id in the user index; fails if either exists
+            try:
+                create_user_with_index(db.transaction(), 'students', student_data)
+            except DuplicateUserKeyError as e:
+                message = 'Email already exists' if e.field == 'email' else 'Student ID already exists'
+                return jsonify({'success': False, 'message': message}), 400
             
             # Send welcome email
-            threading.Thread(target=send_email, args=(
+            send_email(
                 data['email'],
                 'Welcome to PrintQ!',
                 'job_submitted',  # Reusing template
@@ -1164,8 +4046,9 @@ def register():
                     'file_name': 'Welcome to PrintQ Campus Printing',
                     'pages': 1,
                     'cost': 0.00
-                }
-            )).start()
+                },
+                idempotency_key=f"welcome:{student_data['id']}"
+            )
             
             return jsonify({
                 'success': True,
@@ -1173,6 +4056,8 @@ def register():
                 'user_id': student_data['id']
             })
     
+    except HashPoolBusyError:
+        return jsonify({'success': False, 'message': 'Registration is busy, please try again shortly'}), 503
     except Exception as e:
         logger.error(f"Registration error: {e}")
         return jsonify({'success': False, 'message': 'Registration failed'}), 500
@@ -1180,96 +4065,166 @@ def register():
 @app.route('/api/jobs/submit', methods=['POST'])
 @require_auth  # Add authentication middleware
 def submit_job():
-    """Submit a new print job"""
+    """Submit a new print job
+
+    Accepts either a multipart form with a 'file' field, or a streaming
+    upload: the raw file as the request body, the file name in the
+    X-File-Name header and the print options in the query string. The
+    streaming form is validated (type, size, balance) before any of the
+    body is read. A streaming request may instead pass content_sha256 and
+    content_size (see /api/uploads/preflight) and no body at all, to print
+    content the server already holds.
+    """
+    pending_upload = None
     try:
-        # Check if file is uploaded
-        if 'file' not in request.files:
-            return jsonify({'success': False, 'message': 'No file uploaded'}), 400
-        
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({'success': False, 'message': 'No file selected'}), 400
-        
         # Get student ID from authenticated user (not form data)
         student_id = request.auth['user_id']  # Fixed: Get from auth context
         
-        # Get form data
-        pages = int(request.form.get('pages', 1))
-        is_color = request.form.get('color', 'false').lower() == 'true'
-        is_duplex = request.form.get('duplex', 'false').lower() == 'true'
-        paper_size = request.form.get('paper_size', 'A4')
-        copies = int(request.form.get('copies', 1))
-        binding = request.form.get('binding', 'false').lower() == 'true'
-        scheduled_time = request.form.get('scheduled_time')
+        streaming = not request.mimetype.startswith('multipart/')
+        if streaming:
+            options = request.args
+            original_name = unquote(request.headers.get('X-File-Name') or options.get('file_name', ''))
+        else:
+            # Check if file is uploaded
+            if 'file' not in request.files:
+                return jsonify({'success': False, 'message': 'No file uploaded'}), 400
+            file = request.files['file']
+            options = request.form
+            original_name = file.filename
+        
+        if not original_name:
+            return jsonify({'success': False, 'message': 'No file selected'}), 400
+        
+        # Get print options
+        pages = int(options.get('pages', 1))
+        is_color = options.get('color', 'false').lower() == 'true'
+        is_duplex = options.get('duplex', 'false').lower() == 'true'
+        paper_size = options.get('paper_size', 'A4')
+        copies = int(options.get('copies', 1))
+        binding = options.get('binding', 'false').lower() == 'true'
+        scheduled_time = options.get('scheduled_time') or None
+        if scheduled_time:
+            try:
+                scheduled_time = datetime.datetime.fromisoformat(scheduled_time)
+            except ValueError:
+                return jsonify({'success': False, 'message': 'Invalid scheduled_time'}), 400
+            if scheduled_time.tzinfo is not None:
+                scheduled_time = scheduled_time.astimezone().replace(tzinfo=None)
+        # Jobs due later wait out of the pending list until the scheduler releases them
+        release_at = scheduled_release_at(scheduled_time) if JOB_SCHEDULER_CONFIG['enabled'] else None
+        is_scheduled = release_at is not None and release_at > time.time()
 
         # Validate file type
-        allowed_extensions = {'.pdf', '.docx', '.ppt', '.pptx', '.doc'}
-        file_ext = os.path.splitext(file.filename)[1].lower()
-        if file_ext not in allowed_extensions:
+        file_ext = os.path.splitext(original_name)[1].lower()
+        if file_ext not in UPLOAD_CONFIG['allowed_extensions']:
             return jsonify({'success': False, 'message': 'Unsupported file type'}), 400
 
-        # Save uploaded file
-        filename = secure_filename(file.filename)
-        file_id = str(uuid.uuid4())
-        file_path = f"uploads/{file_id}_{filename}"
-        os.makedirs('uploads', exist_ok=True)
-        file.save(file_path)
-
-        # Calculate cost
+        max_bytes = app.config['MAX_CONTENT_LENGTH']
+        content_sha256 = options.get('content_sha256') if streaming else None
+        reference_blob = None
+        if content_sha256:
+            reference_blob = find_blob(content_sha256, options.get('content_size'))
+            if not reference_blob:
+                return jsonify({'success': False, 'message': 'File is not on the server, please upload it'}), 409
+            if reference_blob.get('pages'):
+                pages = reference_blob['pages']
+        elif streaming:
+            if request.content_length is None:
+                return jsonify({'success': False, 'message': 'Content-Length required'}), 411
+            if request.content_length > max_bytes:
+                return jsonify({'success': False, 'message': 'File too large. Maximum size is 50MB'}), 413
+
+        # Calculate cost from the declared page count
         total_cost = calculate_cost(pages, is_color, is_duplex, paper_size, binding, copies)
 
-        # Get student using auth context
-        student_ref = db.collection('students').document(student_id)
-        student_doc = student_ref.get()
+        # Reject early on balance, before writing anything; the transaction re-checks
+        student_doc = get_identity_map().get('students', student_id)
         if not student_doc.exists:
-            if os.path.exists(file_path):
-                os.remove(file_path)
             return jsonify({'success': False, 'message': 'Student not found'}), 404
-
-        student_data = student_doc.to_dict()
-        if student_data.get('wallet_balance', 0) < total_cost:
-            if os.path.exists(file_path):
-                os.remove(file_path)
+        if student_doc.to_dict().get('wallet_balance', 0) < total_cost:
             return jsonify({'success': False, 'message': 'Insufficient wallet balance'}), 400
 
+        page_count_source = 'declared'
+        if reference_blob:
+            # Content already stored: nothing to transfer
+            file_sha256 = content_sha256.lower()
+            file_size = reference_blob['size']
+            if reference_blob.get('pages'):
+                page_count_source = 'server'
+            elif file_ext == '.pdf':
+                page_count_source = 'unverified'
+        else:
+            # Stream uploaded file to disk, hashing as it is written
+            upload_stream = request.stream if streaming else file.stream
+            try:
+                temp_path, file_sha256, file_size = stream_upload_to_disk(upload_stream, max_bytes)
+            except UploadTooLargeError:
+                return jsonify({'success': False, 'message': 'File too large. Maximum size is 50MB'}), 413
+            pending_upload = temp_path
+            if file_size == 0:
+                os.remove(temp_path)
+                return jsonify({'success': False, 'message': 'No file uploaded'}), 400
+
+            # Price PDFs from their real page count rather than the client's estimate
+            if file_ext == '.pdf':
+                counted_pages = count_pdf_pages(temp_path, file_sha256)
+                if counted_pages:
+                    pages = counted_pages
+                    page_count_source = 'server'
+                    total_cost = calculate_cost(pages, is_color, is_duplex, paper_size, binding, copies)
+                else:
+                    # Billed on the declared count until an admin confirms it at approval
+                    page_count_source = 'unverified'
+
+        # Identical content from any submission shares one stored blob
+        filename = secure_filename(original_name)
+        file_path = blob_path(file_sha256)
+
         # Create job
         job_id = str(uuid.uuid4())
         pickup_pin = generate_pickup_pin()
         job_data = {
             'id': job_id,
             'student_id': student_id,
-            'student_email': student_data['email'],
-            'student_name': student_data['username'],
             'file_name': filename,
             'file_path': file_path,
+            'file_sha256': file_sha256,
+            'file_size': file_size,
             'pages': pages,
+            'page_count_source': page_count_source,
             'is_color': is_color,
             'is_duplex': is_duplex,
             'paper_size': paper_size,
             'copies': copies,
             'binding': binding,
             'total_cost': total_cost,
-            'status': 'pending',
+            'status': 'scheduled' if is_scheduled else 'pending',
             'pickup_pin': pickup_pin,
             'scheduled_time': scheduled_time,
             'created_at': datetime.datetime.now(),
             'updated_at': datetime.datetime.now()
         }
 
-        # Deduct balance + update stats
-        new_balance = student_data.get('wallet_balance', 0) - total_cost
-        student_ref.update({
-            'wallet_balance': new_balance,
-            'total_jobs': student_data.get('total_jobs', 0) + 1
-        })
-
-        # Save job
-        db.collection('jobs').document(job_id).set(job_data)
+        # Deduct balance, update stats and save the job in one transaction
+        try:
+            student_data, new_balance = debit_and_create_job(
+                db.transaction(), student_id, job_data, require_blob=reference_blob is not None
+            )
+        except JobSubmissionError as e:
+            if pending_upload:
+                os.remove(pending_upload)
+            return jsonify({'success': False, 'message': e.message}), e.status_code
+        if pending_upload:
+            commit_blob(pending_upload, file_sha256)
+            pending_upload = None
+        principal_cache.invalidate_user(student_id)
+        if is_scheduled:
+            job_scheduler.schedule(job_id, release_at)
 
         # Send email (non-blocking)
         try:
             if student_data.get('email_notifications', True):
-                threading.Thread(target=send_email, args=(
+                send_email(
                     student_data['email'],
                     'Print Job Submitted',
                     'job_submitted',
@@ -1280,8 +4235,9 @@ def submit_job():
                         'pages': pages,
                         'cost': total_cost,
                         'duplex': is_duplex
-                    }
-                )).start()
+                    },
+                    idempotency_key=f"job_submitted:{job_id}"
+                )
         except Exception as e:
             logger.warning(f"Email sending failed: {e}")
 
@@ -1298,15 +4254,37 @@ def submit_job():
             'job_id': job_id,
             'pickup_pin': pickup_pin,
             'total_cost': total_cost,
+            'pages': pages,
             'new_balance': new_balance,
             'qr_code': qr_code,
+            'status': job_data['status'],
             'message': 'Job submitted successfully'
         }), 200
 
     except Exception as e:
         logger.error(f"Job submission error: {e}")
+        if pending_upload and os.path.exists(pending_upload):
+            os.remove(pending_upload)
         return jsonify({'success': False, 'message': 'Failed to submit job'}), 500
 
+@app.route('/api/uploads/preflight', methods=['POST'])
+@require_auth
+def upload_preflight():
+    """Tell the client whether content with this hash and size is already stored"""
+    try:
+        data = request.get_json() or {}
+        blob_data = find_blob(data.get('sha256'), data.get('size'))
+        
+        return jsonify({
+            'success': True,
+            'exists': blob_data is not None,
+            'pages': blob_data.get('pages') if blob_data else None
+        })
+    
+    except Exception as e:
+        logger.error(f"Upload preflight error: {e}")
+        return jsonify({'success': False, 'message': 'Preflight check failed'}), 500
+
 @app.route('/api/jobs/<job_id>/approve', methods=['POST'])
 @require_auth
 def approve_job(job_id):
@@ -1321,9 +4299,10 @@ def approve_job(job_id):
         
         logger.info(f"Admin {request.auth['user_id']} approving job {job_id}")
         
+        identity_map = get_identity_map()
+        
         # Get job details
-        job_ref = db.collection('jobs').document(job_id)
-        job_doc = job_ref.get()
+        job_doc = identity_map.get('jobs', job_id)
         
         if not job_doc.exists:
             return jsonify({'success': False, 'message': 'Job not found'}), 404
@@ -1334,30 +4313,61 @@ def approve_job(job_id):
         if job_data.get('status') != 'pending':
             return jsonify({'success': False, 'message': f'Job is already {job_data.get("status")}'}), 400
         
+        # A PDF the server could not count is only approved with an admin-confirmed page count
+        verified_update = {}
+        if job_data.get('page_count_source') == 'unverified':
+            try:
+                verified_pages = int(data['pages'])
+            except (KeyError, TypeError, ValueError):
+                return jsonify({
+                    'success': False,
+                    'message': 'Page count could not be verified; confirm the page count to approve this job',
+                    'requires_page_count': True,
+                    'declared_pages': job_data.get('pages')
+                }), 409
+            if verified_pages < 1:
+                return jsonify({'success': False, 'message': 'Page count must be at least 1'}), 400
+            if verified_pages > job_data.get('pages', 0):
+                return jsonify({
+                    'success': False,
+                    'message': 'File has more pages than the student paid for; reject the job so it can be resubmitted'
+                }), 400
+            verified_cost = calculate_cost(verified_pages, job_data.get('is_color', False), job_data.get('is_duplex', False),
+                                           job_data.get('paper_size', 'A4'), job_data.get('binding', False),
+                                           job_data.get('copies', 1))
+            verified_update = {
+                'pages': verified_pages,
+                'total_cost': verified_cost,
+                'page_count_source': 'admin',
+                'page_count_verified_by': request.auth['user_id']
+            }
+            job_data = dict(job_data, **verified_update)
+        
         # Auto-assign printer if not provided
         if not printer_id:
-            printers_ref = db.collection('printers')
-            available_printers = printers_ref.where('status', '==', 'online').limit(1).get()
+            available_printers = get_online_printers()
             
             if not available_printers:
                 return jsonify({'success': False, 'message': 'No available printers online'}), 400
             
-            printer_doc = available_printers[0]
-            printer_id = printer_doc.id
-            printer_data = printer_doc.to_dict()
+            assignment = printer_assigner.assign(job_id, job_data, available_printers)
+            if not assignment:
+                return jsonify({'success': False, 'message': 'No online printer supports this job\'s colour or paper size'}), 400
+            
+            printer_id, printer_data = assignment
             logger.info(f"Auto-assigned printer {printer_id} to job {job_id}")
         else:
             # Get specified printer details
-            printer_ref = db.collection('printers').document(printer_id)
-            printer_doc = printer_ref.get()
+            printer_data = printer_registry.get(printer_id)
             
-            if not printer_doc.exists:
+            if printer_data is None:
                 return jsonify({'success': False, 'message': 'Specified printer not found'}), 404
             
-            printer_data = printer_doc.to_dict()
-            
             if printer_data.get('status') != 'online':
                 return jsonify({'success': False, 'message': 'Specified printer is not online'}), 400
+            
+            if not printer_can_print(printer_data, job_data):
+                return jsonify({'success': False, 'message': 'Specified printer does not support this job\'s colour or paper size'}), 400
         
         # Update job status
         update_data = {
@@ -1370,7 +4380,27 @@ def approve_job(job_id):
             'updated_at': datetime.datetime.now()
         }
         
-        job_ref.update(update_data)
+        update_data.update(verified_update)
+        # Conditioned on the job as read, so of two concurrent approvals only
+        # one commits, and with it the refund below
+        identity_map.stage_update('jobs', job_id, update_data,
+                                  option=db.write_option(last_update_time=job_doc.update_time))
+        
+        # Refund the difference when the confirmed count is below the declared one
+        overcharge = round(job_doc.to_dict().get('total_cost', 0) - job_data.get('total_cost', 0), 2)
+        if overcharge > 0:
+            identity_map.stage_update('students', job_data['student_id'], {
+                'wallet_balance': firestore.Increment(overcharge)
+            })
+        
+        try:
+            identity_map.flush()
+        except FailedPrecondition:
+            printer_assigner.release(job_id)
+            return jsonify({'success': False, 'message': 'Job was changed by another request; reload and try again'}), 409
+        if overcharge > 0:
+            principal_cache.invalidate_user(job_data['student_id'])
+        publish_job_event(job_id, dict(job_data, **update_data), 'approved')
         
         # Send approval email (non-blocking)
         try:
@@ -1382,12 +4412,13 @@ def approve_job(job_id):
                 'pickup_pin': job_data['pickup_pin']
             }
             
-            threading.Thread(target=send_email, args=(
+            send_email(
                 job_data['student_email'],
                 'Job Approved - Ready to Print',
                 'job_approved',
-                email_data
-            )).start()
+                email_data,
+                idempotency_key=f"job_approved:{job_id}"
+            )
             
             logger.info(f"Approval email queued for {job_data['student_email']}")
             
@@ -1408,6 +4439,114 @@ def approve_job(job_id):
         return jsonify({'success': False, 'message': f'Failed to approve job: {str(e)}'}), 500
     
 
+def job_eco_points(job_data):
+    """Eco points for a completed job: 2 per duplex page"""
+    return job_data.get('pages', 0) * 2 if job_data.get('is_duplex') else 0
+
+class JobTransitionError(Exception):
+    """Raised by a bulk plan to fail one job without affecting the others"""
+
+def bulk_transition_jobs(job_ids, allowed_statuses, plan):
+    """Apply one status transition to many jobs with one read and chunked batch writes
+
+    All jobs are fetched with a single get_all. plan(job_id, job_data)
+    returns the job update plus a dict of numeric student increments (or
+    None), or raises JobTransitionError to fail that job; increments for the same student are summed within a batch. Each
+    job update is conditioned on the update time that was read, so a job
+    changed in between fails instead of being overwritten. When a batch
+    fails, its jobs are retried one at a time so failures stay per job.
+    Returns (applied, failed_jobs); applied holds (job_id, job_data, job_update).
+    """
+    job_ids = list(dict.fromkeys(job_ids))
+    jobs_ref = db.collection('jobs')
+    snapshots = {snapshot.id: snapshot for snapshot in db.get_all([jobs_ref.document(job_id) for job_id in job_ids])}
+    
+    failed_jobs = []
+    staged = []
+    for job_id in job_ids:
+        snapshot = snapshots.get(job_id)
+        if snapshot is None or not snapshot.exists:
+            failed_jobs.append({'id': job_id, 'reason': 'Job not found'})
+            continue
+        job_data = snapshot.to_dict()
+        if job_data.get('status') not in allowed_statuses:
+            failed_jobs.append({'id': job_id, 'reason': f'Job is {job_data.get("status")}'})
+            continue
+        try:
+            job_update, student_increments = plan(job_id, job_data)
+        except JobTransitionError as e:
+            failed_jobs.append({'id': job_id, 'reason': str(e)})
+            continue
+        staged.append((job_id, job_data, job_update, student_increments, snapshot.update_time))
+    
+    def commit(chunk):
+        batch = db.batch()
+        increments = {}
+        for job_id, job_data, job_update, student_increments, update_time in chunk:
+            batch.update(jobs_ref.document(job_id), job_update,
+                         option=db.write_option(last_update_time=update_time))
+            if student_increments:
+                totals = increments.setdefault(job_data['student_id'], {})
+                for field, amount in student_increments.items():
+                    totals[field] = totals.get(field, 0) + amount
+        for student_id, totals in increments.items():
+            batch.update(db.collection('students').document(student_id),
+                         {field: firestore.Increment(amount) for field, amount in totals.items()})
+        stage_version_bump(batch, 'jobs', student_ids=[job_data.get('student_id') for _, job_data, _, _, _ in chunk])
+        batch.commit()
+    
+    # Each batch holds its jobs, one version counter per student, one
+    # increment per student with increments and one jobs shard bump
+    chunks = []
+    chunk, students, charged = [], set(), set()
+    for entry in staged:
+        student_id = entry[1].get('student_id')
+        writes = (len(chunk) + 1
+                  + len(students | {student_id} - {None})
+                  + len(charged | ({student_id} if entry[3] else set()) - {None})
+                  + 1)
+        if chunk and writes > BULK_JOB_CONFIG['batch_size']:
+            chunks.append(chunk)
+            chunk, students, charged = [], set(), set()
+        chunk.append(entry)
+        if student_id:
+            students.add(student_id)
+            if entry[3]:
+                charged.add(student_id)
+    if chunk:
+        chunks.append(chunk)
+    
+    applied = []
+    for chunk in chunks:
+        try:
+            commit(chunk)
+            applied.extend(chunk)
+            continue
+        except Exception as e:
+            if len(chunk) == 1:
+                logger.error(f"Bulk update of job {chunk[0][0]} failed: {e}")
+                failed_jobs.append({'id': chunk[0][0], 'reason': str(e)})
+                continue
+            logger.warning(f"Bulk batch of {len(chunk)} jobs failed, retrying individually: {e}")
+        for entry in chunk:
+            try:
+                commit([entry])
+                applied.append(entry)
+            except Exception as e:
+                logger.error(f"Bulk update of job {entry[0]} failed: {e}")
+                failed_jobs.append({'id': entry[0], 'reason': str(e)})
+    
+    return [(job_id, job_data, job_update) for job_id, job_data, job_update, _, _ in applied], failed_jobs
+
+def get_bulk_job_ids(data):
+    """Validated job_ids from a bulk request body, or an error response"""
+    job_ids = data.get('job_ids') or []
+    if not job_ids:
+        return None, (jsonify({'success': False, 'message': 'No jobs specified'}), 400)
+    if len(job_ids) > BULK_JOB_CONFIG['max_jobs']:
+        return None, (jsonify({'success': False, 'message': f'At most {BULK_JOB_CONFIG["max_jobs"]} jobs per request'}), 400)
+    return job_ids, None
+
 @app.route('/api/jobs/bulk-approve', methods=['POST'])
 @require_auth
 def bulk_approve_jobs():
@@ -1416,78 +4555,60 @@ def bulk_approve_jobs():
         if request.auth['user_type'] != 'admin':
             return jsonify({'success': False, 'message': 'Admin access required'}), 403
         
-        data = request.get_json()
-        job_ids = data.get('job_ids', [])
-        
-        if not job_ids:
-            return jsonify({'success': False, 'message': 'No jobs specified'}), 400
+        job_ids, error = get_bulk_job_ids(request.get_json() or {})
+        if error:
+            return error
         
         logger.info(f"Bulk approving {len(job_ids)} jobs by admin {request.auth['user_id']}")
         
-        approved_count = 0
-        failed_jobs = []
-        
-        # Get available printer for all jobs
-        printers_ref = db.collection('printers')
-        available_printers = printers_ref.where('status', '==', 'online').limit(1).get()
+        available_printers = get_online_printers()
         
         if not available_printers:
             return jsonify({'success': False, 'message': 'No available printers online'}), 400
         
-        printer_doc = available_printers[0]
-        printer_data = printer_doc.to_dict()
+        # One queue snapshot for the batch; each assignment adds to it
+        queued = printer_assigner.outstanding_pages()
+        now = datetime.datetime.now()
         
-        for job_id in job_ids:
-            try:
-                # Get job
-                job_ref = db.collection('jobs').document(job_id)
-                job_doc = job_ref.get()
-                
-                if not job_doc.exists:
-                    failed_jobs.append({'id': job_id, 'reason': 'Job not found'})
-                    continue
-                
-                job_data = job_doc.to_dict()
-                
-                if job_data.get('status') != 'pending':
-                    failed_jobs.append({'id': job_id, 'reason': f'Job is {job_data.get("status")}'})
-                    continue
-                
-                # Approve job
-                job_ref.update({
-                    'status': 'approved',
-                    'printer_id': printer_doc.id,
-                    'printer_name': printer_data['name'],
-                    'printer_location': printer_data['location'],
-                    'approved_at': datetime.datetime.now(),
-                    'approved_by': request.auth['user_id'],
-                    'updated_at': datetime.datetime.now()
-                })
-                
-                approved_count += 1
-                
-                # Queue email notification
-                threading.Thread(target=send_email, args=(
-                    job_data['student_email'],
-                    'Job Approved - Ready to Print',
-                    'job_approved',
-                    {
-                        'student_name': job_data['student_name'],
-                        'job_id': job_id,
-                        'printer_name': printer_data['name'],
-                        'printer_location': printer_data['location'],
-                        'pickup_pin': job_data['pickup_pin']
-                    }
-                )).start()
-                
-            except Exception as e:
-                logger.error(f"Failed to approve job {job_id}: {e}")
-                failed_jobs.append({'id': job_id, 'reason': str(e)})
+        def plan(job_id, job_data):
+            if job_data.get('page_count_source') == 'unverified':
+                raise JobTransitionError('Page count could not be verified; approve this job individually')
+            assignment = printer_assigner.assign(job_id, job_data, available_printers, queued)
+            if not assignment:
+                raise JobTransitionError('No online printer supports this job\'s colour or paper size')
+            printer_id, printer_data = assignment
+            return {
+                'status': 'approved',
+                'printer_id': printer_id,
+                'printer_name': printer_data['name'],
+                'printer_location': printer_data['location'],
+                'approved_at': now,
+                'approved_by': request.auth['user_id'],
+                'updated_at': now
+            }, None
+        
+        approved, failed_jobs = bulk_transition_jobs(job_ids, ('pending',), plan)
+        
+        for job_id, job_data, job_update in approved:
+            publish_job_event(job_id, dict(job_data, **job_update), 'approved')
+            send_email(
+                job_data['student_email'],
+                'Job Approved - Ready to Print',
+                'job_approved',
+                {
+                    'student_name': job_data['student_name'],
+                    'job_id': job_id,
+                    'printer_name': job_update['printer_name'],
+                    'printer_location': job_update['printer_location'],
+                    'pickup_pin': job_data['pickup_pin']
+                },
+                idempotency_key=f"job_approved:{job_id}"
+            )
         
         return jsonify({
             'success': True,
-            'message': f'Approved {approved_count} jobs',
-            'approved_count': approved_count,
+            'message': f'Approved {len(approved)} jobs',
+            'approved_count': len(approved),
             'failed_jobs': failed_jobs
         })
         
@@ -1495,13 +4616,138 @@ def bulk_approve_jobs():
         logger.error(f"Bulk approval error: {e}")
         return jsonify({'success': False, 'message': f'Bulk approval failed: {str(e)}'}), 500
 
+@app.route('/api/jobs/bulk-reject', methods=['POST'])
+@require_auth
+def bulk_reject_jobs():
+    """Bulk reject multiple jobs, refunding paid ones (Admin only)"""
+    try:
+        if request.auth['user_type'] != 'admin':
+            return jsonify({'success': False, 'message': 'Admin access required'}), 403
+        
+        data = request.get_json() or {}
+        job_ids, error = get_bulk_job_ids(data)
+        if error:
+            return error
+        reason = data.get('reason', 'Rejected by admin')
+        
+        logger.info(f"Bulk rejecting {len(job_ids)} jobs by admin {request.auth['user_id']}")
+        now = datetime.datetime.now()
+        
+        def plan(job_id, job_data):
+            refund = job_data.get('total_cost', 0) if job_data.get('payment_status') == 'paid' else 0
+            return {
+                'status': 'rejected',
+                'rejected_at': now,
+                'rejected_by': request.auth['user_id'],
+                'rejection_reason': reason,
+                'updated_at': now
+            }, ({'wallet_balance': refund} if refund else None)
+        
+        rejected, failed_jobs = bulk_transition_jobs(job_ids, ('scheduled', 'pending', 'approved'), plan)
+        
+        refunded_total = 0
+        for job_id, job_data, job_update in rejected:
+            job_scheduler.cancel(job_id)
+            refund_amount = job_data.get('total_cost', 0) if job_data.get('payment_status') == 'paid' else 0
+            if refund_amount:
+                refunded_total += refund_amount
+                principal_cache.invalidate_user(job_data['student_id'])
+            publish_job_event(job_id, job_data, 'rejected', reason=reason, refund_amount=refund_amount)
+            send_email(
+                job_data.get('student_email'),
+                'Print Job Rejected',
+                'job_rejected',
+                {
+                    'student_name': job_data.get('student_name', 'Student'),
+                    'job_id': job_id,
+                    'file_name': job_data.get('file_name', 'Unknown'),
+                    'rejection_reason': reason,
+                    'refund_amount': refund_amount
+                },
+                idempotency_key=f"job_rejected:{job_id}"
+            )
+        
+        return jsonify({
+            'success': True,
+            'message': f'Rejected {len(rejected)} jobs',
+            'rejected_count': len(rejected),
+            'refunded_total': round(refunded_total, 2),
+            'failed_jobs': failed_jobs
+        })
+        
+    except Exception as e:
+        logger.error(f"Bulk rejection error: {e}")
+        return jsonify({'success': False, 'message': f'Bulk rejection failed: {str(e)}'}), 500
+
+@app.route('/api/jobs/bulk-complete', methods=['POST'])
+@require_auth
+def bulk_complete_jobs():
+    """Bulk mark approved or printing jobs as completed (Admin only)"""
+    try:
+        if request.auth['user_type'] != 'admin':
+            return jsonify({'success': False, 'message': 'Admin access required'}), 403
+        
+        job_ids, error = get_bulk_job_ids(request.get_json() or {})
+        if error:
+            return error
+        
+        logger.info(f"Bulk completing {len(job_ids)} jobs by admin {request.auth['user_id']}")
+        now = datetime.datetime.now()
+        
+        def plan(job_id, job_data):
+            return {
+                'status': 'completed',
+                'completed_at': now,
+                'updated_at': now
+            }, {
+                'total_pages': job_data.get('pages', 0),
+                'total_spent': job_data.get('total_cost', 0),
+                'eco_points': job_eco_points(job_data)
+            }
+        
+        completed, failed_jobs = bulk_transition_jobs(job_ids, ('approved', 'printing'), plan)
+        printer_throughput.record_completions(
+            [(job_data, job_update['completed_at']) for _, job_data, job_update in completed]
+        )
+        
+        for job_id, job_data, job_update in completed:
+            eco_points = job_eco_points(job_data)
+            principal_cache.invalidate_user(job_data['student_id'])
+            publish_job_event(job_id, job_data, 'completed', eco_points=eco_points)
+            send_email(
+                job_data['student_email'],
+                'Print Job Completed - Ready for Pickup!',
+                'job_completed',
+                {
+                    'student_name': job_data['student_name'],
+                    'job_id': job_id,
+                    'printer_name': job_data.get('printer_name', 'Unknown'),
+                    'printer_location': job_data.get('printer_location', 'Unknown'),
+                    'pickup_pin': job_data['pickup_pin'],
+                    'eco_points': eco_points
+                },
+                idempotency_key=f"job_completed:{job_id}"
+            )
+        
+        return jsonify({
+            'success': True,
+            'message': f'Completed {len(completed)} jobs',
+            'completed_count': len(completed),
+            'failed_jobs': failed_jobs
+        })
+        
+    except Exception as e:
+        logger.error(f"Bulk completion error: {e}")
+        return jsonify({'success': False, 'message': f'Bulk completion failed: {str(e)}'}), 500
+
 @app.route('/api/jobs/<job_id>/complete', methods=['POST'])
 def complete_job(job_id):
     """Mark job as completed"""
     try:
+        identity_map = get_identity_map()
+        
         # Get job details
-        job_ref = db.collection('jobs').document(job_id)
-        job_doc = job_ref.get()
+        job_doc = identity_map.get('jobs', job_id)
         
         if not job_doc.exists:
             return jsonify({'success': False, 'message': 'Job not found'}), 404
@@ -1509,30 +4755,29 @@ def complete_job(job_id):
         job_data = job_doc.to_dict()
         
         # Calculate eco points for duplex printing
-        eco_points = 0
-        if job_data.get('is_duplex'):
-            eco_points = job_data.get('pages', 0) * 2  # 2 points per duplex page
+        eco_points = job_eco_points(job_data)
         
         # Update job status
-        job_ref.update({
+        completed_at = datetime.datetime.now()
+        identity_map.stage_update('jobs', job_id, {
             'status': 'completed',
-            'completed_at': datetime.datetime.now(),
-            'updated_at': datetime.datetime.now()
+            'completed_at': completed_at,
+            'updated_at': completed_at
         })
         
-        # Update student statistics
-        student_ref = db.collection('students').document(job_data['student_id'])
-        student_doc = student_ref.get()
-        student_data = student_doc.to_dict()
-        
-        student_ref.update({
-            'total_pages': student_data.get('total_pages', 0) + job_data.get('pages', 0),
-            'total_spent': student_data.get('total_spent', 0) + job_data.get('total_cost', 0),
-            'eco_points': student_data.get('eco_points', 0) + eco_points
+        # Update student statistics (server-side increments, no student read)
+        identity_map.stage_update('students', job_data['student_id'], {
+            'total_pages': firestore.Increment(job_data.get('pages', 0)),
+            'total_spent': firestore.Increment(job_data.get('total_cost', 0)),
+            'eco_points': firestore.Increment(eco_points)
         })
+        identity_map.flush()
+        principal_cache.invalidate_user(job_data['student_id'])
+        printer_throughput.record_completions([(job_data, completed_at)])
+        publish_job_event(job_id, job_data, 'completed', eco_points=eco_points)
         
         # Send completion email
-        threading.Thread(target=send_email, args=(
+        send_email(
             job_data['student_email'],
             'Print Job Completed - Ready for Pickup!',
             'job_completed',
@@ -1543,8 +4788,9 @@ def complete_job(job_id):
                 'printer_location': job_data.get('printer_location', 'Unknown'),
                 'pickup_pin': job_data['pickup_pin'],
                 'eco_points': eco_points
-            }
-        )).start()
+            },
+            idempotency_key=f"job_completed:{job_id}"
+        )
         
         return jsonify({
             'success': True,
@@ -1556,30 +4802,210 @@ def complete_job(job_id):
         logger.error(f"Job completion error: {e}")
         return jsonify({'success': False, 'message': 'Failed to complete job'}), 500
 
+@app.route('/api/jobs/<job_id>/eta', methods=['GET'])
+@require_auth
+def get_job_eta(job_id):
+    """Queue position and estimated completion time of a job"""
+    try:
+        job_data = job_view.get(job_id) if job_view.ensure_started() and job_view.ready('active') else None
+        if job_data is None:
+            job_doc = db.collection('jobs').document(job_id).get()
+            if not job_doc.exists:
+                return jsonify({'success': False, 'message': 'Job not found'}), 404
+            job_data = job_doc.to_dict()
+        
+        if request.auth['user_type'] != 'admin' and job_data.get('student_id') != request.auth['user_id']:
+            return jsonify({'success': False, 'message': 'Access denied'}), 403
+        
+        status = job_data.get('status')
+        printer_id = job_data.get('printer_id')
+        eta = {
+            'job_id': job_id,
+            'status': status,
+            'printer_id': printer_id,
+            'position': None,
+            'jobs_ahead': None,
+            'pages_ahead': None,
+            'pages_per_minute': None,
+            'rate_source': None,
+            'estimated_completion': None
+        }
+        
+        if status == 'completed':
+            eta['position'] = 0
+            eta['estimated_completion'] = job_data.get('completed_at')
+        elif status in PRINTER_ASSIGNMENT_CONFIG['queued_statuses'] and printer_id:
+            if job_view.ready('active'):
+                jobs_ahead, pages_ahead = job_view.queue_position(printer_id, job_id)
+            else:
+                queue = sorted((job for job in get_queued_jobs() if job[1].get('printer_id') == printer_id),
+                               key=printer_queue_order)
+                queue_ids = [queued_id for queued_id, _ in queue]
+                ahead = queue[:queue_ids.index(job_id)] if job_id in queue_ids else queue
+                jobs_ahead, pages_ahead = len(ahead), sum(job_print_pages(data) for _, data in ahead)
+            
+            rate, source = printer_throughput.rate(printer_id, printer_registry.get(printer_id))
+            minutes = (pages_ahead + job_print_pages(job_data)) / rate
+            eta.update({
+                'position': jobs_ahead + 1,
+                'jobs_ahead': jobs_ahead,
+                'pages_ahead': pages_ahead,
+                'pages_per_minute': round(rate, 2),
+                'rate_source': source,
+                'estimated_completion': datetime.datetime.now() + datetime.timedelta(minutes=minutes)
+            })
+        
+        return jsonify({'success': True, 'eta': eta})
+    
+    except Exception as e:
+        logger.error(f"Get job ETA error for {job_id}: {e}")
+        return jsonify({'success': False, 'message': 'Failed to estimate job completion'}), 500
+
+def format_sse(event_id, event_type, data):
+    return f"id: {event_id}\nevent: {event_type}\ndata: {app.json.dumps(data)}\n\n"
+
+@app.route('/api/jobs/stream', methods=['GET'])
+def stream_job_events():
+    """Server-sent events stream of the signed-in student's job status changes
+
+    EventSource cannot send headers, so the token comes in the query string.
+    Resumes from Last-Event-ID when the client reconnects.
+    """
+    auth_data, error = validate_token(f"Bearer {request.args.get('token', '')}")
+    if error:
+        return jsonify({'success': False, 'message': error}), 401
+    if auth_data['user_type'] != 'student':
+        return jsonify({'success': False, 'message': 'Student access required'}), 403
+    
+    auth_data.pop('user_doc', None)
+    student_id = auth_data['user_id']
+    expires_at = auth_data.get('expires_at')
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    # The view's listeners forward transitions made by other workers to this hub
+    job_view.ensure_started()
+    subscription, backlog, resync = job_event_hub.subscribe(student_id, last_event_id)
+    config = EVENT_STREAM_CONFIG
+    
+    def generate():
+        try:
+            yield f"retry: {config['retry_ms']}\n\n"
+            if resync:
+                yield format_sse(job_event_hub.latest_event_id(), 'resync', {})
+            for event_id, _, event_type, data in backlog:
+                yield format_sse(event_id, event_type, data)
+            
+            while True:
+                if subscription.overflowed:
+                    # Events were dropped for this slow client; have it reload and reconnect
+                    yield format_sse(job_event_hub.latest_event_id(), 'resync', {})
+                    return
+                try:
+                    event_id, _, event_type, data = subscription.queue.get(timeout=config['heartbeat_seconds'])
+                except queue.Empty:
+                    if expires_at and time.time() >= expires_at:
+                        return
+                    yield ": heartbeat\n\n"
+                    continue
+                yield format_sse(event_id, event_type, data)
+        finally:
+            job_event_hub.unsubscribe(student_id, subscription)
+    
+    response = app.response_class(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stop reverse proxies from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @app.route('/api/jobs/student/<student_id>', methods=['GET'])
 @require_auth
+@conditional_get('jobs', per_student=True)
 def get_student_jobs(student_id):
-    """Get all jobs for a student"""
+    """Get a student's jobs, optionally only those changed since a watermark
+
+    status takes one status or a comma-separated list. updated_since is the
+    watermark returned by a previous call; only jobs whose updated_at is
+    later are returned.
+    """
     try:
         jobs_ref = db.collection('jobs')
         jobs_query = jobs_ref.where(filter=FieldFilter('student_id', '==', student_id))
         
         status_filter = request.args.get('status')
         if status_filter and status_filter != 'all':
-            jobs_query = jobs_query.where('status', '==', status_filter)
+            statuses = [status.strip() for status in status_filter.split(',') if status.strip()]
+            if len(statuses) > FIRESTORE_IN_LIMIT:
+                return jsonify({'success': False, 'message': f'At most {FIRESTORE_IN_LIMIT} statuses may be requested'}), 400
+            if len(statuses) == 1:
+                jobs_query = jobs_query.where(filter=FieldFilter('status', '==', statuses[0]))
+            elif statuses:
+                jobs_query = jobs_query.where(filter=FieldFilter('status', 'in', statuses))
+        
+        updated_since = request.args.get('updated_since')
+        if updated_since:
+            try:
+                since = datetime.datetime.fromisoformat(updated_since)
+            except ValueError:
+                return jsonify({'success': False, 'message': 'updated_since must be an ISO 8601 timestamp'}), 400
+            if since.tzinfo is None:
+                # Firestore stores naive datetimes as UTC
+                since = since.replace(tzinfo=datetime.timezone.utc)
+            jobs_query = jobs_query.where(filter=FieldFilter('updated_at', '>', since))
         
         jobs = []
+        watermark = None
         for doc in jobs_query.get():
             job_data = doc.to_dict()
             job_data['id'] = doc.id
+            updated_at = job_data.get('updated_at')
+            if updated_at and (watermark is None or updated_at > watermark):
+                watermark = updated_at
             jobs.append(job_data)
         
-        return jsonify({'success': True, 'jobs': jobs})
+        return jsonify({
+            'success': True,
+            'jobs': jobs,
+            # Latest updated_at seen; pass back as updated_since on the next poll
+            'watermark': watermark or updated_since
+        })
     
     except Exception as e:
-        logger.error(f"Get student jobs error: {e}")@app.route('/api/jobs', methods=['GET'])
-        
-    
+        logger.error(f"Get student jobs error: {e}")
+        return jsonify({'success': False, 'message': 'Failed to get jobs'}), 500
+
+class InvalidCursorError(Exception):
+    pass
+
+def encode_job_cursor(created_at, doc_id):
+    """Opaque cursor for the job after which the next page starts"""
+    payload = {'created_at': created_at.isoformat() if created_at else None, 'id': doc_id}
+    return _b64url_encode(json.dumps(payload, separators=(',', ':')).encode())
+
+def decode_job_cursor(cursor):
+    """Turn a cursor back into start_after values for the (created_at, __name__) ordering"""
+    try:
+        payload = json.loads(_b64url_decode(cursor))
+        created_at = payload['created_at']
+        return {
+            'created_at': datetime.datetime.fromisoformat(created_at) if created_at else None,
+            '__name__': str(payload['id'])
+        }
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidCursorError(str(e))
+
+JOB_FIELD_NAME = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+def parse_job_fields(value):
+    """Validate a comma-separated fields= projection; None means all fields"""
+    if not value:
+        return None
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    if not fields or not all(JOB_FIELD_NAME.match(field) for field in fields):
+        raise ValueError('Invalid fields parameter')
+    # created_at is always read because the next cursor is built from it
+    if 'created_at' not in fields:
+        fields.append('created_at')
+    return fields
+
 @app.route('/api/jobs', methods=['GET'])
 @require_auth
 def get_all_jobs():
@@ -1591,37 +5017,80 @@ def get_all_jobs():
         
         logger.info(f"Admin {request.auth['user_id']} requesting all jobs")
         
-        jobs_ref = db.collection('jobs')
-        query = jobs_ref.order_by('created_at', direction=firestore.Query.DESCENDING)
+        try:
+            page_size = int(request.args.get('page_size', JOB_LIST_CONFIG['default_page_size']))
+        except ValueError:
+            return jsonify({'success': False, 'message': 'page_size must be an integer'}), 400
+        page_size = max(1, min(page_size, JOB_LIST_CONFIG['max_page_size']))
+        
+        try:
+            fields = parse_job_fields(request.args.get('fields'))
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
         
-        # Apply filters
         status_filter = request.args.get('status')
-        if status_filter and status_filter != '' and status_filter != 'all':
-            query = query.where('status', '==', status_filter)
+        if status_filter in ('', 'all'):
+            status_filter = None
         
         printer_filter = request.args.get('printer')
-        if printer_filter and printer_filter != '' and printer_filter != 'all':
-            query = query.where('printer_id', '==', printer_filter)
+        if printer_filter in ('', 'all'):
+            printer_filter = None
+        
+        cursor = None
+        start_after = request.args.get('start_after')
+        if start_after:
+            try:
+                cursor = decode_job_cursor(start_after)
+            except InvalidCursorError:
+                return jsonify({'success': False, 'message': 'Invalid start_after cursor'}), 400
+        
+        # One extra job tells us whether another page exists
+        if status_filter in JOB_VIEW_CONFIG['active_statuses'] and job_view.ensure_started() and job_view.ready('active'):
+            # Every job in an active status is in the view
+            page = newest_first(job_view.select(status=status_filter, printer_id=printer_filter))
+            if cursor:
+                position = (normalize_timestamp(cursor['created_at']), cursor['__name__'])
+                page = [(job_id, data) for job_id, data in page
+                        if (normalize_timestamp(data['created_at']), job_id) < position]
+            page = page[:page_size + 1]
+        else:
+            jobs_ref = db.collection('jobs')
+            # Document id breaks created_at ties so cursors never skip or repeat a job
+            query = jobs_ref.order_by('created_at', direction=firestore.Query.DESCENDING)
+            query = query.order_by('__name__', direction=firestore.Query.DESCENDING)
+            if status_filter:
+                query = query.where('status', '==', status_filter)
+            if printer_filter:
+                query = query.where('printer_id', '==', printer_filter)
+            if cursor:
+                query = query.start_after(cursor)
+            if fields:
+                query = query.select(fields)
+            page = [(doc.id, doc.to_dict()) for doc in query.limit(page_size + 1).get()]
+        
+        has_more = len(page) > page_size
+        page = page[:page_size]
+        next_cursor = encode_job_cursor(page[-1][1].get('created_at'), page[-1][0]) if has_more else None
         
         jobs = []
         job_count = 0
         
-        for doc in query.limit(100).get():  # Limit to 100 for performance
-            job_data = doc.to_dict()
-            job_data['id'] = doc.id
-            
-            # Convert Firestore timestamps to ISO format
-            if 'created_at' in job_data and job_data['created_at']:
-                job_data['created_at'] = job_data['created_at'].isoformat() if hasattr(job_data['created_at'], 'isoformat') else str(job_data['created_at'])
-            
-            if 'updated_at' in job_data and job_data['updated_at']:
-                job_data['updated_at'] = job_data['updated_at'].isoformat() if hasattr(job_data['updated_at'], 'isoformat') else str(job_data['updated_at'])
-            
+        for job_id, job_data in page:
+            if fields:
+                job_data = {field: job_data[field] for field in fields if field in job_data}
+            job_data['id'] = job_id
             jobs.append(job_data)
             job_count += 1
         
         logger.info(f"Retrieved {job_count} jobs for admin")
-        return jsonify({'success': True, 'jobs': jobs, 'count': job_count})
+        return jsonify({
+            'success': True,
+            'jobs': jobs,
+            'count': job_count,
+            'page_size': page_size,
+            'has_more': has_more,
+            'next_cursor': next_cursor
+        })
     
     except Exception as e:
         logger.error(f"Get all jobs error: {e}")
@@ -1645,12 +5114,6 @@ def get_job(job_id):
         job_data = doc.to_dict()
         job_data['id'] = doc.id
 
-        # Convert datetime fields if present
-        if 'created_at' in job_data and job_data['created_at']:
-            job_data['created_at'] = job_data['created_at'].isoformat() if hasattr(job_data['created_at'], 'isoformat') else str(job_data['created_at'])
-        if 'updated_at' in job_data and job_data['updated_at']:
-            job_data['updated_at'] = job_data['updated_at'].isoformat() if hasattr(job_data['updated_at'], 'isoformat') else str(job_data['updated_at'])
-
         return jsonify({'success': True, 'job': job_data}), 200
 
     except Exception as e:
@@ -1684,6 +5147,31 @@ def debug_jobs_count():
             'message': 'Debug failed'
         })
 
+@app.route('/api/debug/metrics', methods=['GET'])
+@require_auth
+def debug_metrics():
+    """Debug endpoint exposing in-process cache and pool counters (Admin only)"""
+    if request.auth['user_type'] != 'admin':
+        return jsonify({'success': False, 'message': 'Admin access required'}), 403
+    
+    return jsonify({
+        'success': True,
+        'metrics': {
+            'auth_cache': principal_cache.stats(),
+            'token_revocations': token_revocations.stats(),
+            'password_hasher': password_hasher.stats(),
+            'login_throttle': login_throttle.stats(),
+            'page_count_cache': page_count_cache.stats(),
+            'notifications': notification_dispatcher.stats(),
+            'job_events': job_event_hub.stats(),
+            'job_view': job_view.stats(),
+            'printer_assignment': printer_assigner.stats(),
+            'job_scheduler': job_scheduler.stats(),
+            'printer_registry': printer_registry.stats(),
+            'printer_throughput': printer_throughput.stats()
+        }
+    })
+
 # Add this to your Flask app if you don't have it already
 
 @app.route('/api/jobs/<job_id>/reject', methods=['POST'])
@@ -1699,9 +5187,10 @@ def reject_job(job_id):
         
         logger.info(f"Admin {request.auth['user_id']} rejecting job {job_id}")
         
+        identity_map = get_identity_map()
+        
         # Get job details
-        job_ref = db.collection('jobs').document(job_id)
-        job_doc = job_ref.get()
+        job_doc = identity_map.get('jobs', job_id)
         
         if not job_doc.exists:
             logger.error(f"Job {job_id} not found in database")
@@ -1710,7 +5199,7 @@ def reject_job(job_id):
         job_data = job_doc.to_dict()
         
         # Check if job can be rejected
-        if job_data.get('status') not in ['pending', 'approved']:
+        if job_data.get('status') not in ['scheduled', 'pending', 'approved']:
             return jsonify({
                 'success': False, 
                 'message': f'Cannot reject job with status: {job_data.get("status")}'
@@ -1725,26 +5214,24 @@ def reject_job(job_id):
             'updated_at': datetime.datetime.now()
         }
         
-        job_ref.update(update_data)
+        identity_map.stage_update('jobs', job_id, update_data)
         
         # Refund student if payment was processed
+        refund_amount = 0
         if job_data.get('payment_status') == 'paid':
-            try:
-                student_ref = db.collection('students').document(job_data['student_id'])
-                student_doc = student_ref.get()
-                
-                if student_doc.exists:
-                    student_data = student_doc.to_dict()
-                    current_balance = student_data.get('wallet_balance', 0)
-                    refund_amount = job_data.get('total_cost', 0)
-                    
-                    student_ref.update({
-                        'wallet_balance': current_balance + refund_amount
-                    })
-                    
-                    logger.info(f"Refunded ${refund_amount} to student {job_data['student_id']}")
-            except Exception as e:
-                logger.error(f"Failed to process refund for job {job_id}: {e}")
+            refund_amount = job_data.get('total_cost', 0)
+            identity_map.stage_update('students', job_data['student_id'], {
+                'wallet_balance': firestore.Increment(refund_amount)
+            })
+        
+        # Status change and refund land together or not at all
+        identity_map.flush()
+        job_scheduler.cancel(job_id)
+        publish_job_event(job_id, job_data, 'rejected', reason=reason, refund_amount=refund_amount)
+        
+        if refund_amount:
+            principal_cache.invalidate_user(job_data['student_id'])
+            logger.info(f"Refunded ${refund_amount} to student {job_data['student_id']}")
         
         # Send rejection email (non-blocking)
         try:
@@ -1756,12 +5243,13 @@ def reject_job(job_id):
                 'refund_amount': job_data.get('total_cost', 0) if job_data.get('payment_status') == 'paid' else 0
             }
             
-            threading.Thread(target=send_email, args=(
+            send_email(
                 job_data.get('student_email'),
                 'Print Job Rejected',
                 'job_rejected',
-                email_data
-            )).start()
+                email_data,
+                idempotency_key=f"job_rejected:{job_id}"
+            )
             
         except Exception as e:
             logger.warning(f"Email notification failed for job {job_id}: {e}")
@@ -1804,10 +5292,10 @@ def delete_job(job_id):
     """Delete a job by ID"""
     try:
         job_ref = db.collection('jobs').document(job_id)
-        if not job_ref.get().exists:
+        if not delete_job_files(job_ref):
             return jsonify({"success": False, "message": "Job not found"}), 404
+        job_scheduler.cancel(job_id)
 
-        job_ref.delete()
         return jsonify({"success": True, "message": "Job deleted successfully"})
     
     except Exception as e:
@@ -1876,6 +5364,7 @@ def add_money():
         # Update wallet balance
         new_balance = student_data.get('wallet_balance', 0) + amount
         student_ref.update({'wallet_balance': new_balance})
+        principal_cache.invalidate_user(student_id)
         
         # Create transaction record
         transaction_data = {
@@ -1920,15 +5409,14 @@ def get_transactions(student_id):
         return jsonify({'success': False, 'message': 'Failed to get transactions'}), 500
 
 @app.route('/api/printers', methods=['GET'])
+@conditional_get('printers')
 def get_printers():
     """Get all printers"""
     try:
-        printers_ref = db.collection('printers')
         printers = []
         
-        for doc in printers_ref.get():
-            printer_data = doc.to_dict()
-            printer_data['id'] = doc.id
+        for printer_id, printer_data in printer_registry.all():
+            printer_data['id'] = printer_id
             printers.append(printer_data)
         
         return jsonify({'success': True, 'printers': printers})
@@ -1951,10 +5439,16 @@ def add_printer():
             'status': data.get('status', 'online'),
             'paper_level': int(data.get('paper_level', 100)),
             'toner_level': int(data.get('toner_level', 100)),
+            'pages_per_minute': int(data.get('pages_per_minute', PRINTER_ASSIGNMENT_CONFIG['default_pages_per_minute'])),
             'created_at': datetime.datetime.now()
         }
+        # Without an explicit value A3 support follows the printer type
+        if 'supports_a3' in data:
+            printer_data['supports_a3'] = bool(data['supports_a3'])
         
         db.collection('printers').document(printer_data['id']).set(printer_data)
+        bump_collection_versions('printers')
+        printer_registry.record_write(printer_data['id'], printer_data)
         
         return jsonify({'success': True, 'printer_id': printer_data['id']})
     
@@ -1978,13 +5472,20 @@ def update_printer(printer_id):
             'status': data.get('status'),
             'paper_level': int(data.get('paper_level', 0)),
             'toner_level': int(data.get('toner_level', 0)),
+            'supports_a3': bool(data['supports_a3']) if data.get('supports_a3') is not None else None,
+            'pages_per_minute': int(data['pages_per_minute']) if data.get('pages_per_minute') else None,
             'updated_at': datetime.datetime.now()
         }
         
         # Remove None values
         update_data = {k: v for k, v in update_data.items() if v is not None}
+        # An explicit null puts A3 support back on the printer type's default
+        if 'supports_a3' in data and data['supports_a3'] is None:
+            update_data['supports_a3'] = firestore.DELETE_FIELD
         
         db.collection('printers').document(printer_id).update(update_data)
+        bump_collection_versions('printers')
+        printer_registry.record_write(printer_id, update_data, merge=True)
         
         return jsonify({'success': True, 'message': 'Printer updated successfully'})
     
@@ -2047,7 +5548,8 @@ def get_user(user_id):
 @app.route('/api/auth/logout', methods=['POST'])
 def logout():
     """Clear session"""
-    session.clear()
+    if app.secret_key:
+        session.clear()
     return jsonify({'success': True, 'message': 'Logged out'})
 
 
@@ -2059,16 +5561,20 @@ def update_user(user_id):
         data = request.get_json()
         for collection in ['students', 'admins']:
             doc_ref = db.collection(collection).document(user_id)
-            if doc_ref.get().exists:
+            user_doc = doc_ref.get()
+            if user_doc.exists:
                 update_data = {
                     'username': data.get('username'),
                     'email': data.get('email'),
                     'type': data.get('type')
                 }
                 update_data = {k: v for k, v in update_data.items() if v is not None}
-                doc_ref.update(update_data)
+                update_user_with_index(db.transaction(), collection, user_id, user_doc.to_dict(), update_data)
+                principal_cache.invalidate_user(user_id)
                 return jsonify({'success': True, 'message': 'User updated successfully'})
         return jsonify({'success': False, 'message': 'User not found'}), 404
+    except DuplicateUserKeyError:
+        return jsonify({'success': False, 'message': 'Email already exists'}), 400
     except Exception as e:
         logger.error(f"Update user error: {e}")
         return jsonify({'success': False, 'message': 'Failed to update user'}), 500
@@ -2085,8 +5591,16 @@ def get_dashboard_stats():
         today_revenue = 0.0
         pending_jobs = 0
 
-        for doc in jobs_ref.get():
-            job_data = doc.to_dict()
+        if job_view.ensure_started() and job_view.ready('active', 'today'):
+            # Today's jobs and every pending job are in the view
+            candidates = [data for _, data in job_view.select(today_only=True)]
+            pending_jobs = len(job_view.select(status='pending'))
+            count_pending = False
+        else:
+            candidates = [doc.to_dict() for doc in jobs_ref.get()]
+            count_pending = True
+
+        for job_data in candidates:
             job_date = job_data.get('created_at')
 
             # ✅ Normalize Firestore Timestamp -> datetime
@@ -2102,20 +5616,16 @@ def get_dashboard_stats():
                 today_revenue += float(job_data.get('total_cost', 0))
 
             # Count pending jobs
-            if job_data.get('status') == 'pending':
+            if count_pending and job_data.get('status') == 'pending':
                 pending_jobs += 1
 
         # Active printers
-        printers_ref = db.collection('printers')
-        active_printers = sum(
-            1 for doc in printers_ref.get()
-            if doc.to_dict().get('status') == 'online'
-        )
+        active_printers = len(printer_registry.online())
 
         # Active users = submitted at least 1 job in last 30 days
         thirty_days_ago = datetime.datetime.now() - datetime.timedelta(days=30)
         active_users = set()
-        for doc in jobs_ref.where('created_at', '>=', thirty_days_ago).get():
+        for doc in jobs_ref.where('created_at', '>=', thirty_days_ago).select(['student_id']).get():
             job_data = doc.to_dict()
             if job_data.get('student_id'):
                 active_users.add(job_data['student_id'])
@@ -2137,12 +5647,22 @@ def get_dashboard_stats():
 
 
 @app.route('/api/dashboard/recent-jobs', methods=['GET'])
+@conditional_get('jobs')
 def get_recent_jobs():
     """Get recent jobs for dashboard"""
     try:
-        jobs_ref = db.collection('jobs')
         recent_jobs = []
         
+        # With ten or more jobs created today, the newest ten are all in the view
+        if job_view.ensure_started() and job_view.ready('today'):
+            todays_jobs = newest_first(job_view.select(today_only=True))
+            if len(todays_jobs) >= 10:
+                for job_id, job_data in todays_jobs[:10]:
+                    job_data['id'] = job_id
+                    recent_jobs.append(job_data)
+                return jsonify({'success': True, 'jobs': recent_jobs})
+        
+        jobs_ref = db.collection('jobs')
         query = jobs_ref.order_by('created_at', direction=firestore.Query.DESCENDING).limit(10)
         
         for doc in query.get():
@@ -2173,6 +5693,7 @@ def get_job_detail(job_id):
 
 
 @app.route('/api/settings', methods=['GET'])
+@conditional_get('settings')
 def get_settings():
     """Get system settings"""
     try:
@@ -2183,24 +5704,10 @@ def get_settings():
             settings = settings_doc.to_dict()
         else:
             # Default settings
-            settings = {
-                'max_file_size': 50,
-                'supported_formats': 'PDF, DOCX, PPT, PPTX',
-                'auto_delete_hours': 24,
-                'pricing': PRICING,
-                'email_notifications': {
-                    'job_submitted': True,
-                    'job_completed': True,
-                    'job_failed': True
-                },
-                'security': {
-                    'require_2fa': False,
-                    'session_timeout': 60,
-                    'max_login_attempts': 5
-                }
-            }
+            settings = copy.deepcopy(DEFAULT_SETTINGS)
             # Save default settings
             settings_ref.set(settings)
+            bump_collection_versions('settings')
         
         return jsonify({'success': True, 'settings': settings})
     
@@ -2216,6 +5723,8 @@ def update_settings():
         
         settings_ref = db.collection('settings').document('system')
         settings_ref.update(data)
+        bump_collection_versions('settings')
+        invalidate_settings_cache()
         
         # Update global PRICING if changed
         if 'pricing' in data:
@@ -2244,7 +5753,7 @@ def check_low_balance():
             
             if balance < threshold and student_data.get('email_notifications', True):
                 # Send low balance notification
-                threading.Thread(target=send_email, args=(
+                send_email(
                     student_data['email'],
                     'Low Wallet Balance Alert',
                     'low_balance',
@@ -2252,8 +5761,10 @@ def check_low_balance():
                         'student_name': student_data['username'],
                         'balance': balance,
                         'top_up_link': 'https://printq.campus.edu/wallet'
-                    }
-                )).start()
+                    },
+                    # At most one low-balance alert per student per day
+                    idempotency_key=f"low_balance:{doc.id}:{datetime.date.today().isoformat()}"
+                )
                 low_balance_count += 1
         
         return jsonify({
@@ -2321,8 +5832,12 @@ def daily_summary():
         jobs_today, revenue_today = 0, 0.0
         printer_usage = {}
 
-        for doc in jobs_ref.get():
-            job = doc.to_dict()
+        if job_view.ensure_started() and job_view.ready('today'):
+            candidates = [data for _, data in job_view.select(today_only=True)]
+        else:
+            candidates = [doc.to_dict() for doc in jobs_ref.get()]
+
+        for job in candidates:
             dt = normalize_timestamp(job.get('created_at'))
             if dt and dt.date() == today:
                 jobs_today += 1
@@ -2478,7 +5993,7 @@ def cleanup_old_jobs():
                    .where(filter=FieldFilter('completed_at', '<', cutoff_date))
         
         for doc in old_jobs.get():
-            doc.reference.delete()
+            delete_job_files(doc.reference)
             
         logger.info("Old jobs cleanup completed")
     except Exception as e:
@@ -2487,11 +6002,7 @@ def cleanup_old_jobs():
 def monitor_printer_status():
     """Monitor printer status and send alerts"""
     try:
-        printers_ref = db.collection('printers')
-        
-        for doc in printers_ref.get():
-            printer_data = doc.to_dict()
-            
+        for _, printer_data in printer_registry.all():
             # Check for low paper/toner
             if printer_data.get('paper_level', 100) < 20 or printer_data.get('toner_level', 100) < 20:
                 # Log alert (in real implementation, you'd send notifications to admins)
@@ -2516,6 +6027,7 @@ def update_profile():
 
         student_ref = db.collection('students').document(student_id)
         student_ref.update(updates)
+        principal_cache.invalidate_user(student_id)
 
         return jsonify({'success': True, 'message': 'Profile updated successfully'})
     except Exception as e:
@@ -2542,8 +6054,20 @@ def debug_jobs():
 
             
 
-# Start background tasks
-threading.Thread(target=run_background_tasks, daemon=True).start()
+def start_background_tasks():
+    """Start the cleanup thread, the job scheduler and the notification dispatcher
+
+    Called at import so each gunicorn worker (which imports app:app) runs
+    them; BACKGROUND_TASKS_ENABLED=False imports the module without them,
+    e.g. for tests and one-off scripts.
+    """
+    threading.Thread(target=run_background_tasks, daemon=True).start()
+    job_scheduler.start()
+    # Drain rows left queued by an earlier process without waiting for a new enqueue
+    notification_dispatcher.start()
+
+if os.environ.get('BACKGROUND_TASKS_ENABLED', 'True').lower() == 'true':
+    start_background_tasks()
 
 # Error handlers
 @app.errorhandler(404)
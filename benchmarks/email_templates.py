@@ -0,0 +1,116 @@
+"""Email rendering benchmark: precompiled EmailTemplate against the old f-string builder
+
+The old get_email_template is loaded from git history (by default the
+parent of the commit that introduced EmailTemplate) and both renderers are
+timed on every template type with the same data, alternating between them
+and keeping each side's best round so machine noise hits both alike. Each
+pair of outputs must match once whitespace is collapsed and character
+references are decoded; the renders/sec of each side and the speedup are
+reported. Template types the baseline did not have are skipped.
+
+    python benchmarks/email_templates.py --rounds 40
+"""
+import argparse
+import ast
+import html
+import os
+import re
+import subprocess
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+SAMPLE_DATA = {
+    'student_name': 'Test Student',
+    'job_id': 'job-1',
+    'file_name': 'notes.pdf',
+    'pages': 12,
+    'cost': 1.2,
+    'duplex': True,
+    'eco_points': 24,
+    'printer_name': 'Library Printer',
+    'printer_location': 'Library, Ground Floor',
+    'pickup_pin': '4821',
+    'reason': 'File is password protected',
+    'amount': 10.0,
+    'new_balance': 42.5
+}
+
+
+def git(*args):
+    return subprocess.run(['git', *args], cwd=ROOT, check=True, capture_output=True, text=True).stdout
+
+
+def baseline_revision():
+    """Parent of the commit that added EmailTemplate to app.py"""
+    introduced = git('log', '--format=%H', '--reverse', '-S', 'class EmailTemplate', '--', 'app.py').split()
+    if not introduced:
+        raise SystemExit('EmailTemplate not found in the history of app.py; pass --baseline')
+    return introduced[0] + '^'
+
+
+def load_legacy_renderer(revision):
+    """Return get_email_template as it was at revision"""
+    source = git('show', f"{revision}:app.py")
+    for node in ast.parse(source).body:
+        if isinstance(node, ast.FunctionDef) and node.name == 'get_email_template':
+            namespace = {}
+            exec(compile(ast.Module(body=[node], type_ignores=[]), f"{revision}:app.py", 'exec'), namespace)
+            return namespace['get_email_template']
+    raise SystemExit(f"get_email_template not found at {revision}")
+
+
+def normalize(page):
+    return re.sub(r'\s+', ' ', html.unescape(page)).strip()
+
+
+def best_rates(renderers, template_type, data, rounds, number):
+    """Renders/sec of each renderer from its fastest of rounds interleaved timings"""
+    best = [float('inf')] * len(renderers)
+    for _ in range(rounds):
+        for index, render in enumerate(renderers):
+            best[index] = min(best[index], timeit.timeit(lambda: render(template_type, data), number=number))
+    return [number / seconds for seconds in best]
+
+
+def run(app, legacy, template_type, rounds, number):
+    """Time both renderers on one template; returns (passed, legacy rate, compiled rate)"""
+    ok = normalize(legacy(template_type, SAMPLE_DATA)) == normalize(app.get_email_template(template_type, SAMPLE_DATA))
+    legacy_rate, compiled_rate = best_rates((legacy, app.get_email_template), template_type, SAMPLE_DATA, rounds, number)
+    print(f"{'ok  ' if ok else 'FAIL'} {template_type}: f-string {legacy_rate:,.0f}/s, "
+          f"compiled {compiled_rate:,.0f}/s, {compiled_rate / legacy_rate:.2f}x")
+    return ok, legacy_rate, compiled_rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=40, help='interleaved timing rounds per template')
+    parser.add_argument('--number', type=int, default=1000, help='renders per timing round')
+    parser.add_argument('--baseline', help='git revision holding the old get_email_template')
+    args = parser.parse_args()
+
+    os.environ.setdefault('BACKGROUND_TASKS_ENABLED', 'False')
+    import app
+
+    legacy = load_legacy_renderer(args.baseline or baseline_revision())
+
+    passed = True
+    legacy_total = compiled_total = 0
+    fallback = legacy('default', SAMPLE_DATA)
+    for template_type in app.EMAIL_TEMPLATES:
+        if template_type != 'default' and legacy(template_type, SAMPLE_DATA) == fallback:
+            print(f"skip {template_type}: not in the baseline")
+            continue
+        ok, legacy_rate, compiled_rate = run(app, legacy, template_type, args.rounds, args.number)
+        passed = passed and ok
+        legacy_total += 1 / legacy_rate
+        compiled_total += 1 / compiled_rate
+    print(f"overall: compiled renders take {compiled_total / legacy_total:.2f}x the time of the f-string builder")
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == '__main__':
+    main()
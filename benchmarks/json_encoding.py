@@ -0,0 +1,105 @@
+"""JSON response benchmark: stdlib json against orjson, with and without gzip
+
+Builds a synthetic job listing shaped like a /api/jobs page, with
+Firestore-style datetimes, and times encoding it the way PrintQJSONProvider
+does on each path, then gzipping the body at the configured level as
+compress_json_response does. Both encodings must decode to the same data.
+
+    python benchmarks/json_encoding.py --jobs 10000
+"""
+import argparse
+import datetime
+import gzip
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+STATUSES = ('pending', 'approved', 'printing', 'completed', 'rejected')
+
+
+def make_jobs(count, seed=0):
+    """count job documents with the fields a listing returns"""
+    rng = random.Random(seed)
+    started = datetime.datetime(2026, 1, 1, 8, 0)
+    jobs = []
+    for index in range(count):
+        created_at = started + datetime.timedelta(minutes=7 * index, microseconds=rng.randrange(10 ** 6))
+        pages = rng.randint(1, 60)
+        jobs.append({
+            'id': f"job-{index:06d}-{rng.getrandbits(64):016x}",
+            'student_id': f"student-{rng.randrange(2000):05d}",
+            'student_name': f"Student {rng.randrange(2000)}",
+            'student_email': f"student{rng.randrange(2000)}@example.edu",
+            'file_name': f"assignment-{rng.randrange(100)}.pdf",
+            'pages': pages,
+            'copies': rng.choice((1, 1, 1, 2)),
+            'is_color': rng.random() < 0.3,
+            'is_duplex': rng.random() < 0.5,
+            'paper_size': rng.choice(('A4', 'A4', 'A3')),
+            'total_cost': round(pages * 0.1, 2),
+            'status': rng.choice(STATUSES),
+            'printer_id': f"printer-{rng.randrange(8)}",
+            'pickup_pin': f"{rng.randrange(10000):04d}",
+            'created_at': created_at,
+            'updated_at': created_at + datetime.timedelta(minutes=rng.randrange(120))
+        })
+    return {'success': True, 'jobs': jobs, 'count': len(jobs), 'has_more': False}
+
+
+def best_seconds(fn, rounds):
+    best = float('inf')
+    for _ in range(rounds):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def run(name, encode, payload, level, rounds):
+    """Time one encoder with and without gzip; returns the encoded body"""
+    body = encode(payload)
+    encode_seconds = best_seconds(lambda: encode(payload), rounds)
+    compressed = gzip.compress(body, compresslevel=level)
+    both_seconds = best_seconds(lambda: gzip.compress(encode(payload), compresslevel=level), rounds)
+    print(f"{name:8} encode {encode_seconds * 1000:7.1f} ms -> {len(body) / 1e6:5.2f} MB | "
+          f"encode+gzip {both_seconds * 1000:7.1f} ms -> {len(compressed) / 1e6:5.2f} MB")
+    return body, encode_seconds, both_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--jobs', type=int, default=10000)
+    parser.add_argument('--rounds', type=int, default=5, help='timed rounds per measurement; the best is kept')
+    args = parser.parse_args()
+
+    os.environ.setdefault('BACKGROUND_TASKS_ENABLED', 'False')
+    import app
+
+    payload = make_jobs(args.jobs)
+    level = app.JSON_RESPONSE_CONFIG['gzip_level']
+    print(f"{args.jobs} jobs, gzip level {level}")
+
+    # The same call DefaultJSONProvider.response makes when orjson is not installed
+    stdlib_body, stdlib_encode, stdlib_both = run(
+        'json', lambda obj: json.dumps(obj, default=app.json_default, ensure_ascii=True, sort_keys=True,
+                                       separators=(',', ':')).encode(),
+        payload, level, args.rounds)
+    if app.orjson is None:
+        print('skip orjson: not installed')
+        sys.exit(0)
+    orjson_body, orjson_encode, orjson_both = run(
+        'orjson', lambda obj: app.orjson.dumps(obj, default=app.json_default, option=app.PrintQJSONProvider.orjson_options),
+        payload, level, args.rounds)
+
+    ok = json.loads(stdlib_body) == json.loads(orjson_body)
+    print(f"{'ok  ' if ok else 'FAIL'} both encodings decode to the same data")
+    print(f"orjson: encode {stdlib_encode / orjson_encode:.1f}x faster, encode+gzip {stdlib_both / orjson_both:.1f}x faster")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
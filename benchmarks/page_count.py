@@ -0,0 +1,119 @@
+"""Page-count benchmark for PdfPageCounter on large synthetic PDFs
+
+Writes PDFs in both classic-xref and xref-stream layouts, then times the
+server-side page count and traces the peak Python allocation of each run.
+The count must match the generated page total. Growing each page's content
+stream must leave the peak flat, since page content is never read; growing
+the number of pages is reported for reference, as the xref and /Kids data
+the counter does read scale with it.
+
+    python benchmarks/page_count.py --pages 1000 --page-bytes 2000 20000 200000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+def write_pdf(path, pages, page_bytes, xref_stream):
+    """Write a PDF with pages single-page leaves under one /Pages root"""
+    offsets = {}
+    with open(path, 'wb') as f:
+        def obj(number, body):
+            offsets[number] = f.tell()
+            f.write(b'%d 0 obj\n' % number + body + b'\nendobj\n')
+
+        f.write(b'%PDF-1.5\n%\xe2\xe3\xcf\xd3\n')
+        obj(1, b'<< /Type /Catalog /Pages 2 0 R >>')
+        kids = b' '.join(b'%d 0 R' % (3 + 2 * i) for i in range(pages))
+        obj(2, b'<< /Type /Pages /Count %d /Kids [%s] >>' % (pages, kids))
+        content = b'q ' + b'0 0 1 1 re f ' * (page_bytes // 13) + b'Q'
+        for i in range(pages):
+            obj(3 + 2 * i, b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents %d 0 R >>' % (4 + 2 * i))
+            obj(4 + 2 * i, b'<< /Length %d >>\nstream\n' % len(content) + content + b'\nendstream')
+
+        size = 3 + 2 * pages
+        if xref_stream:
+            xref_number = size
+            offsets[xref_number] = f.tell()
+            rows = b'\x00\x00\x00\x00\x00\xff\xff'
+            rows += b''.join(b'\x01' + offsets[n].to_bytes(4, 'big') + b'\x00\x00' for n in range(1, size + 1))
+            data = zlib.compress(rows)
+            f.write(b'%d 0 obj\n<< /Type /XRef /Size %d /W [1 4 2] /Root 1 0 R /Filter /FlateDecode /Length %d >>\nstream\n'
+                    % (xref_number, size + 1, len(data)) + data + b'\nendstream\nendobj\n')
+            start = offsets[xref_number]
+        else:
+            start = f.tell()
+            f.write(b'xref\n0 %d\n0000000000 65535 f \n' % size)
+            for n in range(1, size):
+                f.write(b'%010d 00000 n \n' % offsets[n])
+            f.write(b'trailer\n<< /Size %d /Root 1 0 R >>\n' % size)
+        f.write(b'startxref\n%d\n%%%%EOF\n' % start)
+
+
+def measure(app, path):
+    """Return (pages, seconds, peak traced bytes) for one uncached count"""
+    tracemalloc.start()
+    started = time.perf_counter()
+    pages = app.PdfPageCounter().count(path)
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return pages, elapsed, peak
+
+
+def run(app, directory, layout, xref_stream, pages, page_bytes):
+    """Count one generated file; returns (passed, peak traced bytes)"""
+    path = os.path.join(directory, f"bench-{pages}-{page_bytes}.pdf")
+    write_pdf(path, pages, page_bytes, xref_stream)
+    counted, elapsed, peak = measure(app, path)
+    ok = counted == pages
+    print(f"{'ok  ' if ok else 'FAIL'} {layout}: {pages} pages of {page_bytes} bytes, "
+          f"{os.path.getsize(path) / 1e6:.1f} MB file, counted {counted} in {elapsed * 1000:.1f} ms, "
+          f"peak {peak / 1024:.0f} KiB")
+    os.remove(path)
+    return ok, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pages', type=int, default=1000)
+    parser.add_argument('--page-bytes', type=int, nargs='+', default=[2000, 20000, 200000])
+    parser.add_argument('--page-counts', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--max-peak-growth', type=float, default=1.5,
+                        help='fail if content growth raises the peak by more than this factor')
+    args = parser.parse_args()
+
+    import app
+
+    passed = True
+    with tempfile.TemporaryDirectory() as directory:
+        # Warm up regex caches and imports so they are not charged to the first file
+        write_pdf(os.path.join(directory, 'warmup.pdf'), 1, 0, True)
+        measure(app, os.path.join(directory, 'warmup.pdf'))
+
+        for xref_stream in (False, True):
+            layout = 'xref stream' if xref_stream else 'xref table'
+            peaks = []
+            for page_bytes in args.page_bytes:
+                ok, peak = run(app, directory, layout, xref_stream, args.pages, page_bytes)
+                passed = passed and ok
+                peaks.append(peak)
+            growth = max(peaks) / max(1, min(peaks))
+            ok = growth <= args.max_peak_growth
+            passed = passed and ok
+            print(f"{'ok  ' if ok else 'FAIL'} {layout}: peak memory grew {growth:.2f}x with page content size")
+
+            for pages in args.page_counts:
+                ok, _ = run(app, directory, layout, xref_stream, pages, min(args.page_bytes))
+                passed = passed and ok
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""Contention benchmark for debit_and_create_job against the Firestore emulator
+
+Fires concurrent submissions for one student and checks that every debit
+landed exactly once: the final balance, the total_jobs counter and the
+number of job documents must agree with the successful submissions, and
+the wallet must never be overdrawn. Prints the latency distribution and
+how many transaction attempts each submission needed.
+
+    gcloud emulators firestore start --host-port=localhost:8080
+    FIRESTORE_EMULATOR_HOST=localhost:8080 python benchmarks/submit_contention.py --submissions 50
+"""
+import argparse
+import datetime
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def run(app, client, submissions, workers, balance, cost):
+    """Run the benchmark with client as the app's database; returns True if every check passed"""
+    app.db = client
+    student_id = f"bench-{uuid.uuid4()}"
+    client.collection('students').document(student_id).set({
+        'email': f"{student_id}@bench.invalid",
+        'username': 'bench',
+        'wallet_balance': balance,
+        'total_jobs': 0
+    })
+
+    attempts = {}
+    attempts_lock = threading.Lock()
+
+    # Same transaction body as submit_job, counting how often each submission is retried
+    @app.firestore.transactional
+    def counted_debit(transaction, job_data):
+        with attempts_lock:
+            attempts[job_data['id']] = attempts.get(job_data['id'], 0) + 1
+        return app.debit_and_create_job.to_wrap(transaction, student_id, job_data)
+
+    def submit(index):
+        job_data = {
+            'id': f"{student_id}-{index}",
+            'student_id': student_id,
+            'total_cost': cost,
+            'status': 'pending',
+            'created_at': datetime.datetime.now()
+        }
+        started = time.perf_counter()
+        try:
+            counted_debit(client.transaction(), job_data)
+            succeeded = True
+        except app.JobSubmissionError:
+            succeeded = False
+        return succeeded, time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(submit, range(submissions)))
+    elapsed = time.perf_counter() - started
+
+    succeeded = sum(1 for ok, _ in results if ok)
+    latencies = [seconds * 1000 for _, seconds in results]
+    student = client.collection('students').document(student_id).get().to_dict()
+    job_count = len(client.collection('jobs').where('student_id', '==', student_id).get())
+    expected = min(submissions, int(round(balance * 100)) // int(round(cost * 100)))
+    retries = {}
+    for count in attempts.values():
+        retries[count] = retries.get(count, 0) + 1
+
+    print(f"{submissions} submissions over {workers} threads in {elapsed:.2f}s")
+    print(f"latency ms: p50={percentile(latencies, 0.5):.1f} p95={percentile(latencies, 0.95):.1f} "
+          f"p99={percentile(latencies, 0.99):.1f} max={max(latencies):.1f}")
+    print("attempts per submission: " + ', '.join(f"{count}x{n}" for count, n in sorted(retries.items())))
+
+    checks = [
+        ('successful submissions', succeeded, expected),
+        ('final balance', round(student['wallet_balance'], 2), round(balance - succeeded * cost, 2)),
+        ('total_jobs', student['total_jobs'], succeeded),
+        ('job documents', job_count, succeeded)
+    ]
+    passed = student['wallet_balance'] >= -1e-9
+    if not passed:
+        print(f"FAIL wallet overdrawn: {student['wallet_balance']}")
+    for name, actual, wanted in checks:
+        ok = actual == wanted
+        passed = passed and ok
+        print(f"{'ok  ' if ok else 'FAIL'} {name}: {actual} (expected {wanted})")
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--submissions', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=25)
+    parser.add_argument('--balance', type=float, default=40.0)
+    parser.add_argument('--cost', type=float, default=1.05)
+    parser.add_argument('--project', default='demo-printq')
+    args = parser.parse_args()
+
+    if not os.environ.get('FIRESTORE_EMULATOR_HOST'):
+        sys.exit("Set FIRESTORE_EMULATOR_HOST; this benchmark writes test data and must not run against production")
+
+    from google.cloud import firestore as cloud_firestore
+    import app
+
+    client = cloud_firestore.Client(project=args.project)
+    passed = run(app, client, args.submissions, args.workers, args.balance, args.cost)
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -7,8 +7,11 @@ let currentUser = null;
 let currentPage = 1;
 let currentSection = 'dashboard';
 let jobsPerPage = 20;
+let jobPageCursors = [null]; // start_after cursor for each loaded page of jobs
 let refreshInterval = null;
 let charts = {};
+let printersById = {}; // last loaded printers, for the edit form
+let editingPrinterId = null;
 
 // Utility functions
 const showLoading = () => {
@@ -101,7 +104,9 @@ const apiRequest = async (endpoint, options = {}) => {
                 throw new Error('Access denied. Admin privileges required.');
             }
 
-            throw new Error(data.message || `HTTP ${response.status}: Request failed`);
+            const error = new Error(data.message || `HTTP ${response.status}: Request failed`);
+            error.data = data;
+            throw error;
         }
 
         return data;
@@ -539,6 +544,7 @@ const displaySystemAlerts = (alerts) => {
 
 const getJobStatusIcon = (status) => {
     const icons = {
+        scheduled: 'fa-calendar-alt',
         pending: 'fa-clock',
         approved: 'fa-check',
         printing: 'fa-print',
@@ -625,6 +631,7 @@ const loadPrinters = async () => {
         showLoading();
         const response = await apiRequest('/printers');
         if (response.success) {
+            printersById = Object.fromEntries(response.printers.map(printer => [printer.id, printer]));
             displayPrintersManagement(response.printers);
         }
     } catch (error) {
@@ -1383,6 +1390,7 @@ const closeModal = (modalId) => {
 // FIXED: Printer management functions
 const addPrinter = () => {
     // Clear form
+    editingPrinterId = null;
     document.getElementById('printer-form').reset();
     document.getElementById('printer-modal-title').textContent = 'Add Printer';
     showModal('printer-modal');
@@ -1391,15 +1399,25 @@ const addPrinter = () => {
 const editPrinter = (printerId) => {
     console.log('Editing printer:', printerId);
 
-    // In a real implementation, you'd fetch printer data
-    // For now, we'll show the modal with sample data
+    const printer = printersById[printerId];
+    if (!printer) {
+        showNotification('Printer not found, refresh the list and try again', 'error');
+        return;
+    }
+
+    editingPrinterId = printerId;
+    document.getElementById('printer-form').reset();
     document.getElementById('printer-modal-title').textContent = 'Edit Printer';
-    document.getElementById('printer-name').value = 'Sample Printer';
-    document.getElementById('printer-location').value = 'Library Floor 1';
-    document.getElementById('printer-type').value = 'bw';
-    document.getElementById('printer-status').value = 'online';
-    document.getElementById('paper-level').value = '85';
-    document.getElementById('toner-level').value = '65';
+    document.getElementById('printer-name').value = printer.name || '';
+    document.getElementById('printer-location').value = printer.location || '';
+    document.getElementById('printer-type').value = printer.type || 'bw';
+    document.getElementById('printer-status').value = printer.status || 'online';
+    document.getElementById('paper-level').value = printer.paper_level ?? 100;
+    document.getElementById('toner-level').value = printer.toner_level ?? 100;
+    // Printers without the field keep following their type
+    document.getElementById('printer-supports-a3').value =
+        typeof printer.supports_a3 === 'boolean' ? String(printer.supports_a3) : '';
+    document.getElementById('printer-ppm').value = printer.pages_per_minute || '';
 
     showModal('printer-modal');
 };
@@ -1441,29 +1459,29 @@ const savePrinter = async () => {
             toner_level: parseInt(document.getElementById('toner-level').value)
         };
 
-        console.log('Saving printer:', printerData);
+        // Left blank, these are omitted so the server falls back to the type and default rate
+        const supportsA3 = document.getElementById('printer-supports-a3').value;
+        if (supportsA3) {
+            printerData.supports_a3 = supportsA3 === 'true';
+        } else if (editingPrinterId) {
+            printerData.supports_a3 = null; // clears a stored value
+        }
+        const pagesPerMinute = parseInt(document.getElementById('printer-ppm').value);
+        if (pagesPerMinute > 0) printerData.pages_per_minute = pagesPerMinute;
 
-        // Mock save - replace with actual API call
-        setTimeout(() => {
-            showNotification('Printer saved successfully!', 'success');
-            closeModal('printer-modal');
-            loadPrinters();
-            hideLoading();
-        }, 1000);
+        console.log('Saving printer:', printerData);
 
-        /*
-        // Actual API call would be:
-        const response = await apiRequest('/printers', {
-            method: 'POST',
+        const response = await apiRequest(editingPrinterId ? `/printers/${editingPrinterId}` : '/printers', {
+            method: editingPrinterId ? 'PUT' : 'POST',
             body: JSON.stringify(printerData)
         });
-        
+
         if (response.success) {
             showNotification('Printer saved successfully!', 'success');
             closeModal('printer-modal');
+            editingPrinterId = null;
             loadPrinters();
         }
-        */
 
     } catch (error) {
         console.error('Failed to save printer:', error);
@@ -1488,14 +1506,45 @@ const refreshPrinters = () => {
     showNotification('Printer list refreshed', 'info');
 };
 
+// Only the columns the jobs table renders; details are fetched per job on demand
+const JOB_TABLE_FIELDS = 'student_name,file_name,pages,total_cost,status,printer_name,created_at';
+
+const resetJobPages = () => {
+    currentPage = 1;
+    jobPageCursors = [null];
+};
+
+const updateJobPagination = (hasMore) => {
+    const prevBtn = document.getElementById('prev-page');
+    const nextBtn = document.getElementById('next-page');
+    const pageInfo = document.getElementById('page-info');
+
+    if (prevBtn) prevBtn.disabled = currentPage <= 1;
+    if (nextBtn) nextBtn.disabled = !hasMore;
+    if (pageInfo) pageInfo.textContent = `Page ${currentPage}`;
+};
+
 const loadJobs = async () => {
     try {
         showLoading();
-        const response = await apiRequest('/jobs'); // Flask: /api/jobs should exist
+        const params = new URLSearchParams({ page_size: jobsPerPage, fields: JOB_TABLE_FIELDS });
+
+        const status = document.getElementById('job-status-filter')?.value;
+        const printer = document.getElementById('printer-filter')?.value;
+        if (status && status !== 'all') params.set('status', status);
+        if (printer && printer !== 'all') params.set('printer', printer);
+
+        const cursor = jobPageCursors[currentPage - 1];
+        if (cursor) params.set('start_after', cursor);
+
+        const response = await apiRequest(`/jobs?${params.toString()}`);
         if (response.success) {
+            jobPageCursors[currentPage] = response.next_cursor;
             displayJobs(response.jobs);
+            updateJobPagination(response.has_more);
         } else {
             displayJobs([]);
+            updateJobPagination(false);
         }
     } catch (error) {
         console.error('Failed to load jobs:', error);
@@ -1598,7 +1647,7 @@ const viewJobDetails = async (jobId) => {
         }
 
         if (rejectBtn) {
-            if (["pending", "approved"].includes(job.status)) {
+            if (["scheduled", "pending", "approved"].includes(job.status)) {
                 rejectBtn.style.display = "inline-block";
                 rejectBtn.setAttribute("onclick", `rejectJob('${jobIdentifier}')`);
             } else {
@@ -1625,7 +1674,7 @@ const approveJob = async (jobId) => {
     }
 };
 
-const approveJobQuick = async (jobId) => {
+const approveJobQuick = async (jobId, body = {}) => {
     try {
         showLoading();
         console.log('Approving job:', jobId);
@@ -1634,10 +1683,21 @@ const approveJobQuick = async (jobId) => {
             throw new Error('Admin privileges required');
         }
 
-        const response = await apiRequest(`/jobs/${jobId}/approve`, {
-            method: 'POST',
-            body: JSON.stringify({})
-        });
+        let response;
+        try {
+            response = await apiRequest(`/jobs/${jobId}/approve`, {
+                method: 'POST',
+                body: JSON.stringify(body)
+            });
+        } catch (error) {
+            // The server could not count this PDF's pages: ask the admin to confirm them
+            if (!error.data?.requires_page_count) throw error;
+            hideLoading();
+            const pages = prompt(`${error.message}.\nStudent declared ${error.data.declared_pages} pages. Actual page count:`,
+                error.data.declared_pages);
+            if (pages === null) return;
+            return approveJobQuick(jobId, { ...body, pages: parseInt(pages, 10) });
+        }
 
         if (response.success) {
             showNotification(`Job approved successfully!`, 'success');
@@ -1688,51 +1748,63 @@ const rejectJob = async (jobId) => {
 };
 
 
-const bulkApprove = async () => {
+const runBulkJobAction = async (action, { verb, pastTense, countKey, body = {} }) => {
     try {
         const checkedJobs = document.querySelectorAll('.job-checkbox:checked');
         if (checkedJobs.length === 0) {
-            showNotification('Please select jobs to approve', 'warning');
+            showNotification(`Please select jobs to ${verb}`, 'warning');
             return;
         }
 
         const jobIds = Array.from(checkedJobs).map(checkbox => checkbox.value);
 
-        if (!confirm(`Approve ${jobIds.length} selected jobs?`)) {
+        if (!confirm(`${verb.charAt(0).toUpperCase() + verb.slice(1)} ${jobIds.length} selected jobs?`)) {
             return;
         }
 
         showLoading();
-        console.log('Bulk approving jobs:', jobIds);
+        console.log(`Bulk ${action} jobs:`, jobIds);
 
-        const response = await apiRequest('/jobs/bulk-approve', {
+        const response = await apiRequest(`/jobs/bulk-${action}`, {
             method: 'POST',
-            body: JSON.stringify({ job_ids: jobIds })
+            body: JSON.stringify({ job_ids: jobIds, ...body })
         });
 
         if (response.success) {
-            showNotification(`${response.approved_count} jobs approved successfully!`, 'success');
+            showNotification(`${response[countKey]} jobs ${pastTense} successfully!`, 'success');
 
             if (response.failed_jobs && response.failed_jobs.length > 0) {
-                console.warn('Some jobs failed to approve:', response.failed_jobs);
-                showNotification(`${response.failed_jobs.length} jobs failed to approve`, 'warning');
+                console.warn(`Some jobs failed to ${verb}:`, response.failed_jobs);
+                showNotification(`${response.failed_jobs.length} jobs failed to ${verb}`, 'warning');
             }
 
             // Clear selections and reload
             document.getElementById('select-all-jobs').checked = false;
             await loadJobs();
         } else {
-            throw new Error(response.message || 'Bulk approval failed');
+            throw new Error(response.message || `Bulk ${action} failed`);
         }
 
     } catch (error) {
-        console.error('Bulk approval error:', error);
-        showNotification(`Bulk approval failed: ${error.message}`, 'error');
+        console.error(`Bulk ${action} error:`, error);
+        showNotification(`Bulk ${action} failed: ${error.message}`, 'error');
     } finally {
         hideLoading();
     }
 };
 
+const bulkApprove = () => runBulkJobAction('approve', {
+    verb: 'approve', pastTense: 'approved', countKey: 'approved_count'
+});
+
+const bulkReject = () => runBulkJobAction('reject', {
+    verb: 'reject', pastTense: 'rejected', countKey: 'rejected_count', body: { reason: 'Rejected by admin' }
+});
+
+const bulkComplete = () => runBulkJobAction('complete', {
+    verb: 'complete', pastTense: 'completed', countKey: 'completed_count'
+});
+
 const exportJobs = () => {
     showNotification('Exporting jobs data...', 'info');
 
@@ -1845,7 +1917,8 @@ const filterJobs = () => {
     console.log('Filtering jobs:', { status, printer, dateFrom, dateTo });
     showNotification('Applying job filters...', 'info');
 
-    // In a real implementation, this would filter the jobs table
+    // Filters change the result set, so earlier page cursors no longer apply
+    resetJobPages();
     setTimeout(() => {
         loadJobs();
     }, 500);
@@ -1887,6 +1960,7 @@ const searchUsers = () => {
 
 // FIXED: Pagination functions
 const nextPage = () => {
+    if (!jobPageCursors[currentPage]) return;
     currentPage++;
     console.log('Next page:', currentPage);
     loadJobs(); // or whatever section is active
@@ -2018,6 +2092,8 @@ window.approveJobQuick = approveJobQuick;
 window.approveJob = approveJob;
 window.rejectJob = rejectJob;
 window.bulkApprove = bulkApprove;
+window.bulkReject = bulkReject;
+window.bulkComplete = bulkComplete;
 window.exportJobs = exportJobs;
 window.addPrinter = addPrinter;
 window.editPrinter = editPrinter;
@@ -6,6 +6,10 @@ const API_BASE_URL = '/api';
 let currentUser = null;
 let currentFile = null;
 let jobUpdateInterval = null;
+let jobUpdatesWatermark = null; // latest job updated_at the client has seen
+let knownJobStatuses = {};
+let jobEventSource = null; // live job status stream (server-sent events)
+let jobPollInterval = null; // polling fallback when the stream is unavailable
 
 // Initialize application when DOM is loaded
 document.addEventListener('DOMContentLoaded', function () {
@@ -191,6 +195,7 @@ function logout() {
     if (jobUpdateInterval) {
         clearInterval(jobUpdateInterval);
     }
+    stopQueueMonitoring();
 
     // Show auth section with animation
     const dashboard = document.getElementById('dashboard-section');
@@ -208,6 +213,13 @@ function logout() {
     showNotification('You have been logged out', 'info');
 }
 
+// The token was refused: stop the stream and polling instead of retrying forever
+function handleSessionExpired() {
+    if (!currentUser) return;
+    logout();
+    showNotification('Your session has expired. Please log in again.', 'warning');
+}
+
 // ===== DASHBOARD =====
 function showAuth() {
     document.getElementById('auth-section').classList.remove('hidden');
@@ -232,6 +244,7 @@ function showDashboard() {
 
         // Start periodic updates
         startPeriodicUpdates();
+        startQueueMonitoring();
 
         setTimeout(() => {
             dashboard.style.opacity = '1';
@@ -526,26 +539,37 @@ async function submitPrintJob() {
     showLoading('Submitting your print job...');
 
     try {
-        // Create FormData for file upload
-        const formData = new FormData();
-        formData.append('file', currentFile);
-        // Remove student_id from form data - backend will get it from token
-        formData.append('pages', estimatedPages);
-        formData.append('color', isColor);
-        formData.append('duplex', isDuplex);
-        formData.append('paper_size', paperSize);
-        formData.append('copies', copies);
-        formData.append('binding', binding);
+        // Print options go in the query string so the server can validate
+        // them before the file body is streamed
+        const params = new URLSearchParams({
+            pages: estimatedPages,
+            color: isColor,
+            duplex: isDuplex,
+            paper_size: paperSize,
+            copies: copies,
+            binding: binding
+        });
         if (scheduledTime) {
-            formData.append('scheduled_time', scheduledTime);
+            params.append('scheduled_time', scheduledTime);
         }
 
-        const response = await fetch(`${API_BASE_URL}/jobs/submit`, {
+        // Skip the transfer entirely when the server already has this file
+        let body = currentFile;
+        const contentHash = await hashFile(currentFile);
+        if (contentHash && await serverHasContent(contentHash, currentFile.size)) {
+            params.append('content_sha256', contentHash);
+            params.append('content_size', currentFile.size);
+            body = null;
+        }
+
+        const response = await fetch(`${API_BASE_URL}/jobs/submit?${params}`, {
             method: 'POST',
             headers: {
-                'Authorization': `Bearer ${currentUser.token}` // Only include auth header, not Content-Type for FormData
+                'Authorization': `Bearer ${currentUser.token}`,
+                'Content-Type': 'application/octet-stream',
+                'X-File-Name': encodeURIComponent(currentFile.name)
             },
-            body: formData
+            body: body
         });
 
         const data = await response.json();
@@ -581,6 +605,40 @@ async function submitPrintJob() {
     }
 }
 
+async function hashFile(file) {
+    // SubtleCrypto is only available in secure contexts
+    if (!window.crypto || !window.crypto.subtle) return null;
+
+    try {
+        const digest = await window.crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+        return Array.from(new Uint8Array(digest))
+            .map(byte => byte.toString(16).padStart(2, '0'))
+            .join('');
+    } catch (error) {
+        console.error('File hashing error:', error);
+        return null;
+    }
+}
+
+async function serverHasContent(sha256, size) {
+    try {
+        const response = await fetch(`${API_BASE_URL}/uploads/preflight`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'Authorization': `Bearer ${currentUser.token}`
+            },
+            body: JSON.stringify({ sha256: sha256, size: size })
+        });
+
+        const data = await response.json();
+        return data.success && data.exists;
+    } catch (error) {
+        console.error('Upload preflight error:', error);
+        return false;
+    }
+}
+
 function resetPrintOptions() {
     document.getElementById('color-option').checked = false;
     document.getElementById('duplex-option').checked = false;
@@ -602,9 +660,17 @@ async function loadUserJobs() {
             }
         });
 
+        if (response.status === 401) {
+            handleSessionExpired();
+            return;
+        }
+
         const data = await response.json();
 
         if (data.success) {
+            jobUpdatesWatermark = data.watermark || jobUpdatesWatermark;
+            knownJobStatuses = {};
+            data.jobs.forEach(job => { knownJobStatuses[job.id] = job.status; });
             displayJobs(data.jobs);
         } else {
             console.error('Failed to load jobs:', data.message);
@@ -666,7 +732,7 @@ function displayJobs(jobs) {
                         <i class="fas fa-qrcode"></i> QR Code
                     </button>
                 ` : ''}
-                ${job.status === 'pending' ? `
+                ${['pending', 'scheduled'].includes(job.status) ? `
                     <button onclick="cancelJob('${job.id}')" class="cancel-btn">
                         <i class="fas fa-times"></i> Cancel
                     </button>
@@ -1249,9 +1315,9 @@ function hideLoading() {
 
 // ===== PERIODIC UPDATES =====
 function startPeriodicUpdates() {
-    // Update jobs every 30 seconds
+    // Update jobs every 30 seconds unless the live stream is delivering changes
     jobUpdateInterval = setInterval(() => {
-        if (currentUser) {
+        if (currentUser && !jobEventSource) {
             const jobsSection = document.getElementById('jobs-section');
             if (jobsSection && jobsSection.classList.contains('active')) {
                 loadUserJobs();
@@ -1418,30 +1484,116 @@ function slideDown(element) {
 
 // ===== PRINT QUEUE MONITORING =====
 function startQueueMonitoring() {
-    // Monitor print queue status for real-time updates
-    setInterval(() => {
+    // Prefer the live stream; fall back to delta polling without EventSource support
+    if (jobEventSource || jobPollInterval) return;
+    if (window.EventSource) {
+        openJobEventStream();
+    } else {
+        startJobPolling();
+    }
+}
+
+function stopQueueMonitoring() {
+    if (jobEventSource) {
+        jobEventSource.close();
+        jobEventSource = null;
+    }
+    if (jobPollInterval) {
+        clearInterval(jobPollInterval);
+        jobPollInterval = null;
+    }
+}
+
+function startJobPolling() {
+    if (jobPollInterval) return;
+    jobPollInterval = setInterval(() => {
         if (currentUser) {
             checkJobUpdates();
         }
     }, 10000); // Check every 10 seconds
 }
 
+function openJobEventStream() {
+    const params = new URLSearchParams({ token: currentUser.token });
+    const source = new EventSource(`${API_BASE_URL}/jobs/stream?${params.toString()}`);
+    let consecutiveErrors = 0;
+
+    source.addEventListener('open', () => {
+        consecutiveErrors = 0;
+    });
+
+    source.addEventListener('job_status', (event) => {
+        handleJobStatusEvent(JSON.parse(event.data));
+    });
+
+    // The server lost track of what this client has seen; reload the list
+    source.addEventListener('resync', () => {
+        loadUserJobs();
+    });
+
+    source.onerror = () => {
+        consecutiveErrors++;
+        // EventSource reconnects on its own (resuming via Last-Event-ID) unless the server refused it
+        if (source.readyState === EventSource.CLOSED || consecutiveErrors >= 3) {
+            source.close();
+            if (jobEventSource === source) {
+                jobEventSource = null;
+                startJobPolling();
+                // Poll at once: a refused token logs out here rather than after the first interval
+                checkJobUpdates();
+            }
+        }
+    };
+
+    jobEventSource = source;
+}
+
+function handleJobStatusEvent(job) {
+    const previous = knownJobStatuses[job.job_id];
+    if (previous !== job.status) {
+        const fileName = job.file_name || 'Your job';
+        const type = job.status === 'rejected' ? 'warning' : 'success';
+        showNotification(`${fileName} is now ${job.status}`, type);
+    }
+    knownJobStatuses[job.job_id] = job.status;
+    loadUserJobs();
+}
+
 async function checkJobUpdates() {
+    // Without a watermark the first poll would return every job; load the list instead
+    if (!jobUpdatesWatermark) {
+        await loadUserJobs();
+        return;
+    }
+
     try {
-        const response = await fetch(`${API_BASE_URL}/jobs/student/${currentUser.id}?status=pending,printing`, {
+        const params = new URLSearchParams({ updated_since: jobUpdatesWatermark });
+        const response = await fetch(`${API_BASE_URL}/jobs/student/${currentUser.id}?${params.toString()}`, {
             headers: {
                 'Authorization': `Bearer ${currentUser.token}`
             }
         });
 
+        if (response.status === 401) {
+            handleSessionExpired();
+            return;
+        }
+
         const data = await response.json();
 
-        if (data.success && data.jobs.length > 0) {
-            // Check for status changes and show notifications
+        if (data.success) {
+            jobUpdatesWatermark = data.watermark || jobUpdatesWatermark;
+            if (data.jobs.length === 0) return;
+
+            // Only jobs changed since the watermark come back; announce status changes
             data.jobs.forEach(job => {
-                // Implementation for real-time job status updates
-                // This would compare with previously stored job states
+                const previous = knownJobStatuses[job.id];
+                if (previous && previous !== job.status) {
+                    showNotification(`${job.file_name || 'Your job'} is now ${job.status}`, 'info');
+                }
+                knownJobStatuses[job.id] = job.status;
             });
+            loadUserJobs();
         }
     } catch (error) {
         console.error('Error checking job updates:', error);
@@ -1463,9 +1615,4 @@ window.addEventListener('offline', function () {
 // ===== INITIALIZATION COMPLETION =====
 console.log('PrintQ Student Interface loaded successfully');
 
-// Start additional features
-setTimeout(() => {
-    if (currentUser) {
-        startQueueMonitoring();
-    }
-}, 2000);
\ No newline at end of file
+// Queue monitoring starts from showDashboard once the student has signed in
\ No newline at end of file
@@ -0,0 +1,9 @@
+"""Import app without side effects: no background threads, no outbox under data/"""
+import os
+import sys
+import tempfile
+
+os.environ['BACKGROUND_TASKS_ENABLED'] = 'False'
+os.environ['NOTIFICATION_OUTBOX_PATH'] = os.path.join(tempfile.mkdtemp(prefix='printq-tests-'), 'outbox.sqlite3')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
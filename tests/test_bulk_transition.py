@@ -0,0 +1,104 @@
+"""bulk_transition_jobs batch sizing against an in-memory stand-in for db
+
+Every batch must stay within Firestore's write limit once the job
+updates, student increments and version counter bumps are all counted.
+
+    python -m pytest tests
+"""
+import types
+
+import pytest
+
+import app
+
+
+class FakeRef:
+    def __init__(self, path):
+        self.path = path
+        self.id = path.rsplit('/', 1)[-1]
+
+    def collection(self, name):
+        return FakeCollection(f"{self.path}/{name}")
+
+
+class FakeCollection:
+    def __init__(self, path):
+        self.path = path
+
+    def document(self, document_id):
+        return FakeRef(f"{self.path}/{document_id}")
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db = db
+        self.writes = []
+
+    def update(self, ref, data, option=None):
+        self.writes.append(ref.path)
+
+    def set(self, ref, data, merge=False):
+        self.writes.append(ref.path)
+
+    def commit(self):
+        # Record oversized batches instead of failing them, so a fallback to
+        # per-job retries cannot hide them
+        self.db.committed.append(self.writes)
+
+
+class FakeDb:
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self.committed = []
+
+    def collection(self, name):
+        return FakeCollection(name)
+
+    def get_all(self, refs):
+        for ref in refs:
+            data = self.jobs.get(ref.id)
+            yield types.SimpleNamespace(id=ref.id, exists=data is not None, update_time=None,
+                                        to_dict=lambda data=data: dict(data))
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def write_option(self, **kwargs):
+        return kwargs
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    def install(jobs):
+        db = FakeDb(jobs)
+        monkeypatch.setattr(app, 'db', db)
+        return db
+    return install
+
+
+@pytest.mark.parametrize('increments', [None, {'wallet_balance': 1.0}])
+def test_batches_stay_within_limit_with_distinct_students(fake_db, increments):
+    jobs = {f"job-{i}": {'status': 'pending', 'student_id': f"student-{i}"} for i in range(500)}
+    db = fake_db(jobs)
+
+    applied, failed = app.bulk_transition_jobs(list(jobs), ('pending',),
+                                               lambda job_id, job_data: ({'status': 'approved'}, increments))
+
+    assert failed == []
+    assert len(applied) == 500
+    assert 1 < len(db.committed) < 500
+    assert all(len(writes) <= app.BULK_JOB_CONFIG['batch_size'] for writes in db.committed)
+    job_writes = [path for writes in db.committed for path in writes if path.startswith('jobs/')]
+    assert sorted(job_writes) == sorted(f"jobs/{job_id}" for job_id in jobs)
+
+
+def test_shared_student_is_counted_once_per_batch(fake_db):
+    jobs = {f"job-{i}": {'status': 'pending', 'student_id': 'student-1'} for i in range(490)}
+    db = fake_db(jobs)
+
+    applied, failed = app.bulk_transition_jobs(list(jobs), ('pending',),
+                                               lambda job_id, job_data: ({'status': 'approved'}, {'wallet_balance': 1.0}))
+
+    # 490 jobs + one increment + one student counter + one shard bump
+    assert failed == []
+    assert [len(writes) for writes in db.committed] == [493]
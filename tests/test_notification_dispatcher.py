@@ -0,0 +1,219 @@
+"""NotificationDispatcher against a local aiosmtpd sink
+
+Covers connection pooling, reconnecting after the server drops a pooled
+connection, retry and dead-lettering when delivery fails, SMTP AUTH
+being used only when credentials are configured, coalescing job updates
+into one digest and deferring sends over the per-recipient rate cap.
+
+    pip install -r requirements-dev.txt
+    python -m pytest tests
+"""
+import socket
+import threading
+import time
+
+import pytest
+from aiosmtpd.controller import Controller
+from aiosmtpd.smtp import AuthResult
+
+import app
+
+JOB_DATA = {
+    'student_name': 'Test Student',
+    'job_id': 'job-1',
+    'file_name': 'notes.pdf',
+    'pages': 3,
+    'cost': 0.3,
+    'duplex': False
+}
+
+
+class SinkHandler:
+    """Records delivered messages and the SMTP session each arrived on"""
+
+    def __init__(self):
+        self.messages = []
+        self.sessions = set()
+        self.logins = []
+        self._lock = threading.Lock()
+
+    async def handle_DATA(self, server, session, envelope):
+        with self._lock:
+            self.messages.append(envelope)
+            self.sessions.add(id(session))
+        return '250 OK'
+
+    def authenticate(self, server, session, envelope, mechanism, auth_data):
+        self.logins.append(auth_data.login.decode())
+        return AuthResult(success=auth_data.password == b'secret')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_sink(handler, port, auth=False):
+    options = {}
+    if auth:
+        options = {'authenticator': handler.authenticate, 'auth_require_tls': False, 'auth_required': True}
+    controller = Controller(handler, hostname='127.0.0.1', port=port, **options)
+    controller.start()
+    return controller
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+@pytest.fixture
+def port():
+    return free_port()
+
+
+@pytest.fixture
+def make_dispatcher(tmp_path, port):
+    """Build a dispatcher on a fresh outbox pointed at the sink's port"""
+    def make(connections=2, max_attempts=8, username='', password='', digest_window=0, recipient_rate_limit=10):
+        config = dict(app.NOTIFICATION_CONFIG,
+                      connections=connections,
+                      max_attempts=max_attempts,
+                      poll_interval=0.05,
+                      backoff_base=0,
+                      digest_window=digest_window,
+                      recipient_rate_limit=recipient_rate_limit,
+                      smtp_timeout=5)
+        email_config = dict(app.EMAIL_CONFIG,
+                            smtp_server='127.0.0.1',
+                            smtp_port=port,
+                            email=username,
+                            password=password,
+                            use_tls=False)
+        # Each dispatcher drains its own outbox so earlier ones cannot claim its rows
+        path = tmp_path / f"outbox-{len(list(tmp_path.iterdir()))}.sqlite3"
+        outbox = app.NotificationOutbox(str(path), config, app.EMAIL_DIGEST_SECTIONS)
+        return app.NotificationDispatcher(config, email_config, outbox)
+    return make
+
+
+def enqueue(dispatcher, count, prefix='student'):
+    for index in range(count):
+        dispatcher.enqueue(f"{prefix}{index}@example.com", 'Print Job Submitted', 'job_submitted',
+                           dict(JOB_DATA, job_id=f"{prefix}-{index}"), idempotency_key=f"{prefix}:{index}")
+
+
+def test_pooled_connections_are_reused(make_dispatcher, port):
+    handler = SinkHandler()
+    controller = start_sink(handler, port)
+    try:
+        dispatcher = make_dispatcher(connections=2)
+        enqueue(dispatcher, 12)
+        assert wait_for(lambda: len(handler.messages) == 12)
+        assert wait_for(lambda: dispatcher.stats()['sent'] == 12)
+        # Every message rode one of the pool's long-lived connections
+        assert len(handler.sessions) <= 2
+        assert dispatcher.stats()['open_connections'] <= 2
+        assert dispatcher.stats()['outbox'].get('sent') == 12
+    finally:
+        controller.stop()
+
+
+def test_reconnects_after_server_drops_connection(make_dispatcher, port):
+    handler = SinkHandler()
+    controller = start_sink(handler, port)
+    dispatcher = make_dispatcher(connections=1)
+    try:
+        enqueue(dispatcher, 1, prefix='before')
+        assert wait_for(lambda: dispatcher.stats()['sent'] == 1)
+    finally:
+        controller.stop()
+
+    # The pooled connection is now dead; the next send must retry on a new one
+    controller = start_sink(handler, port)
+    try:
+        enqueue(dispatcher, 1, prefix='after')
+        assert wait_for(lambda: dispatcher.stats()['sent'] == 2)
+        stats = dispatcher.stats()
+        assert stats['reconnects'] == 1
+        assert stats['retried'] == 0
+        assert len(handler.messages) == 2
+    finally:
+        controller.stop()
+
+
+def test_failed_delivery_is_retried_then_dead_lettered(make_dispatcher):
+    # Nothing listens on the port: every connection attempt is refused
+    dispatcher = make_dispatcher(connections=1, max_attempts=2)
+    enqueue(dispatcher, 1)
+    assert wait_for(lambda: dispatcher.stats()['dead_lettered'] == 1)
+    stats = dispatcher.stats()
+    assert stats['retried'] == 1
+    assert stats['sent'] == 0
+    assert stats['outbox'] == {'dead': 1}
+
+
+@pytest.mark.filterwarnings('ignore:Requiring AUTH while not requiring TLS')
+def test_login_only_when_credentials_are_set(make_dispatcher, port):
+    handler = SinkHandler()
+    controller = start_sink(handler, port, auth=True)
+    try:
+        dispatcher = make_dispatcher(connections=1, username='printq', password='secret')
+        enqueue(dispatcher, 1)
+        assert wait_for(lambda: dispatcher.stats()['sent'] == 1)
+        assert handler.logins == ['printq']
+    finally:
+        controller.stop()
+
+    handler = SinkHandler()
+    controller = start_sink(handler, port)
+    try:
+        dispatcher = make_dispatcher(connections=1)
+        enqueue(dispatcher, 1)
+        assert wait_for(lambda: dispatcher.stats()['sent'] == 1)
+        assert handler.logins == []
+    finally:
+        controller.stop()
+
+
+def test_job_updates_inside_the_window_are_sent_as_one_digest(make_dispatcher, port):
+    handler = SinkHandler()
+    controller = start_sink(handler, port)
+    try:
+        dispatcher = make_dispatcher(connections=1, digest_window=0.5)
+        for index, template_type in enumerate(('job_approved', 'job_completed', 'job_approved')):
+            dispatcher.enqueue('student@example.com', 'Job update', template_type,
+                               dict(JOB_DATA, job_id=f"job-{index}"), idempotency_key=f"update:{index}")
+        assert wait_for(lambda: dispatcher.stats()['outbox'].get('sent') == 3)
+        stats = dispatcher.stats()
+        assert stats['sent'] == 1
+        assert stats['digests'] == 1
+        assert stats['coalesced'] == 3
+        assert len(handler.messages) == 1
+        assert '3 Print Job Updates' in handler.messages[0].content.decode()
+    finally:
+        controller.stop()
+
+
+def test_sends_over_the_recipient_cap_are_deferred_not_dropped(make_dispatcher, port):
+    handler = SinkHandler()
+    controller = start_sink(handler, port)
+    try:
+        dispatcher = make_dispatcher(connections=1, recipient_rate_limit=2)
+        for index in range(5):
+            dispatcher.enqueue('student@example.com', 'Print Job Submitted', 'job_submitted',
+                               dict(JOB_DATA, job_id=f"job-{index}"), idempotency_key=f"submitted:{index}")
+        assert wait_for(lambda: dispatcher.stats()['rate_deferred'] >= 3)
+        # Give the drainer time to (wrongly) send more before checking the cap held
+        time.sleep(0.3)
+        stats = dispatcher.stats()
+        assert len(handler.messages) == 2
+        assert stats['outbox'] == {'sent': 2, 'queued': 3}
+        assert stats['dead_lettered'] == 0
+    finally:
+        controller.stop()